@@ -0,0 +1,1636 @@
+# benchmark.py
+"""Микробенчмарки хендлеров бота на сгенерированной SQLite базе.
+
+Каждый хендлер вызывается напрямую с легковесными фейковыми Update/Context и
+записывающим ботом (без сети). Для каждого вызова измеряются время, число SQL-запросов
+и пиковое выделение памяти (tracemalloc). Результаты сравниваются с сохраненным базовым
+прогоном (benchmark_baseline.json в репозитории, пресет small); время - с поправкой на скорость
+машины, измеренную эталонной нагрузкой рядом с каждым сценарием. При регрессии, без базового
+прогона или если он снят на другом масштабе базы скрипт завершается с кодом 1.
+
+Примеры:
+    python benchmark.py                                  # пресет small
+    python benchmark.py --preset large                   # 10k поставщиков, 100k услуг, 5M слотов
+    python benchmark.py --providers 500 --services 5000 --slots 100000
+    python benchmark.py --update-baseline                # сохранить результаты как базовые
+    python benchmark.py --only services,cb_view_slots
+    python benchmark.py --write-burst --iterations 200   # чтения во время записи: shared vs single writer
+    python benchmark.py --group-commit --iterations 2000 --writers 50  # бронирований/с с групповым commit и без
+    python benchmark.py --time-columns --preset medium   # время текстом vs целыми секундами epoch
+    python benchmark.py --logging                        # стоимость строки лога: синхронно vs через очередь
+    python benchmark.py --inline --preset medium         # нажатие клавиши в @bot: индекс в памяти vs LIKE
+    python benchmark.py --virtual-slots                  # слоты строками vs по правилам расписания
+    python benchmark.py --group-slots                    # групповое занятие: копии слота vs одна строка с местами
+    python benchmark.py --cancel-day                     # отмена дня: /cancel_day vs отмена по одной брони
+    python benchmark.py --checks                         # функциональные проверки (код выхода 1 при ошибке)
+    python benchmark.py --projections                    # списки: экземпляры ORM vs проекции read_models.py
+    python benchmark.py --multibot 10                    # 10 ботов: отдельные процессы vs один процесс (нужен config.py)
+    python benchmark.py --cold-start --iterations 10     # запуск процесса -> первый обработанный апдейт (нужен config.py)
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from timeutil import now_ts, to_ts
+
+PRESETS = {
+    # (поставщики, услуги, слоты)
+    "small": (100, 1_000, 20_000),
+    "medium": (1_000, 10_000, 200_000),
+    "large": (10_000, 100_000, 5_000_000),
+}
+PROVIDER_TG_BASE = 1_000_000 # telegram_id поставщика i = PROVIDER_TG_BASE + i
+RULES_PROVIDER_TG = PROVIDER_TG_BASE - 1 # Поставщик со слотами только по правилам (--virtual-slots)
+GROUP_PROVIDER_TG = PROVIDER_TG_BASE - 2 # Поставщик групповых занятий (--group-slots)
+GROUP_SIZE = 15 # Мест на групповом занятии
+GROUP_SESSIONS = 20 # Занятий на услугу
+TENANT_PROVIDER_TG = PROVIDER_TG_BASE - 3 # Поставщик каждого арендатора (--multibot)
+TENANT_SERVICES = 20 # Услуг у арендатора
+CANCEL_PROVIDER_TG = PROVIDER_TG_BASE - 4 # Поставщик, отменяющий дни (--cancel-day)
+CANCEL_DAY_SLOTS = 10 # Слотов в отменяемом дне
+CANCEL_DAY_SIZES = (10, 100, 500) # Броней в отменяемом дне
+WIDE_PROVIDER_TG = PROVIDER_TG_BASE - 5 # Поставщик с длинными описаниями услуг (--projections)
+WIDE_SERVICES = 300
+CLIENT_TG_BASE = 50_000_000 # telegram_id клиентов из сгенерированных бронирований
+WIDE_CLIENT_TG = CLIENT_TG_BASE - 1 # Клиент, забронировавший все слоты поставщика WIDE_PROVIDER_TG
+BOOKED_SHARE = 0.1 # Доля забронированных слотов
+SEED_BATCH = 20_000
+DEFAULT_BASELINE = "benchmark_baseline.json"
+WARMUP_CALLS = 3 # Неизмеряемых вызовов сценария перед замером
+TIME_SLACK_MS = 0.5 # Абсолютный запас по времени: у быстрых сценариев доли миллисекунды - это шум
+ERROR_MARKERS = ("Произошла", "Ошибка")
+
+
+class Recorder:
+    """Объект, у которого любой неизвестный асинхронный метод просто записывает вызов."""
+
+    def __init__(self, calls: list, **attrs):
+        self._calls = calls
+        self.__dict__.update(attrs)
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+
+        async def method(*args, **kwargs):
+            self._calls.append((name, args, kwargs))
+            return SimpleNamespace(message_id=len(self._calls), chat_id=0)
+
+        return method
+
+
+def make_user(telegram_id: int):
+    return SimpleNamespace(id=telegram_id, first_name="Bench", username=f"bench{telegram_id}", is_bot=False)
+
+
+def make_command(telegram_id: int, text: str, args: list[str]):
+    """Фейковые Update и Context для текстовой команды."""
+    calls = []
+    user = make_user(telegram_id)
+    message = Recorder(calls, chat_id=telegram_id, text=text, document=None, from_user=user)
+    update = SimpleNamespace(update_id=0, effective_user=user, message=message, effective_message=message,
+                             callback_query=None, inline_query=None, effective_chat=SimpleNamespace(id=telegram_id))
+    context = SimpleNamespace(args=args, bot=Recorder(calls), bot_data={}, user_data={}, chat_data={},
+                              job_queue=None)
+    return update, context, calls
+
+
+def make_callback(telegram_id: int, data: str, message_id: int = 1):
+    """Фейковые Update и Context для нажатия инлайн-кнопки."""
+    calls = []
+    user = make_user(telegram_id)
+    message = Recorder(calls, chat_id=telegram_id, message_id=message_id, text="", document=None, from_user=user)
+    query = Recorder(calls, id=str(telegram_id), data=data, from_user=user, message=message, inline_message_id=None)
+    update = SimpleNamespace(update_id=0, effective_user=user, message=None, effective_message=message,
+                             callback_query=query, inline_query=None, effective_chat=SimpleNamespace(id=telegram_id))
+    context = SimpleNamespace(args=None, bot=Recorder(calls), bot_data={}, user_data={}, chat_data={},
+                              job_queue=None)
+    return update, context, calls
+
+
+def make_inline(telegram_id: int, query: str, offset: str = ""):
+    """Фейковые Update и Context для inline-запроса (@bot запрос)."""
+    calls = []
+    user = make_user(telegram_id)
+    inline_query = Recorder(calls, id=str(telegram_id), query=query, offset=offset, from_user=user)
+    update = SimpleNamespace(update_id=0, effective_user=user, message=None, effective_message=None,
+                             callback_query=None, inline_query=inline_query, effective_chat=None)
+    context = SimpleNamespace(args=None, bot=Recorder(calls), bot_data={}, user_data={}, chat_data={},
+                              job_queue=None)
+    return update, context, calls
+
+
+class QueryCounter:
+    """Считает SQL-запросы, выполненные через engine."""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+
+class Dataset:
+    """Сгенерированная база и вспомогательные выборки для подготовки сценариев."""
+
+    def __init__(self, providers: int, services: int, slots: int):
+        import database
+        self.db_module = database
+        self.providers = providers
+        self.services_per_provider = max(1, services // providers)
+        self.slots_per_service = max(1, slots // (self.services_per_provider * providers))
+        self.new_ids = itertools.count(int(time.time() * 1000) % 10**12 + 10**12) # Уникальные ID новых пользователей
+        self.random = random.Random(42)
+
+    def seed(self) -> None:
+        from sqlalchemy import insert, func, select
+        database = self.db_module
+        database.ensure_schema()
+        with database.engine.begin() as conn:
+            if conn.execute(select(func.count()).select_from(database.Provider)).scalar():
+                return # База этого масштаба уже сгенерирована
+
+            print(f"Seeding {self.providers} providers, {self.providers * self.services_per_provider} services, "
+                  f"{self.providers * self.services_per_provider * self.slots_per_service} slots...", file=sys.stderr)
+            conn.execute(insert(database.Provider), [
+                {"provider_id": p + 1, "telegram_id": PROVIDER_TG_BASE + p, "name": f"Provider {p:05d}", "is_active": True}
+                for p in range(self.providers)
+            ])
+            conn.execute(insert(database.Service), [
+                {"service_id": p * self.services_per_provider + s + 1, "provider_id": p + 1,
+                 "name": f"Service {s} of {p}", "description": "Описание услуги " * (s % 8),
+                 "duration_minutes": 60, "price": 100.0 + s}
+                for p in range(self.providers) for s in range(self.services_per_provider)
+            ])
+
+            first_day = to_ts(datetime.now().replace(hour=8, minute=0, second=0, microsecond=0) + timedelta(days=1))
+            slot_id = 0
+            slot_rows, booking_rows = [], []
+            for service_id in range(1, self.providers * self.services_per_provider + 1):
+                for n in range(self.slots_per_service):
+                    slot_id += 1
+                    start = first_day + (n // 10) * 86400 + (n % 10) * 3600
+                    booked = self.random.random() < BOOKED_SHARE
+                    slot_rows.append({"slot_id": slot_id, "service_id": service_id, "start_time": start,
+                                      "end_time": start + 3600, "is_available": not booked,
+                                      "booked_seats": int(booked)})
+                    if booked:
+                        booking_rows.append({"slot_id": slot_id, "client_telegram_id": CLIENT_TG_BASE + slot_id % 5000,
+                                             "status": "confirmed"})
+                    if len(slot_rows) >= SEED_BATCH:
+                        conn.execute(insert(database.TimeSlot), slot_rows)
+                        slot_rows = []
+                if len(booking_rows) >= SEED_BATCH:
+                    conn.execute(insert(database.Booking), booking_rows)
+                    booking_rows = []
+            if slot_rows:
+                conn.execute(insert(database.TimeSlot), slot_rows)
+            if booking_rows:
+                conn.execute(insert(database.Booking), booking_rows)
+
+    # --- Выборки для подготовки сценариев (не входят в замер) ---
+
+    def random_provider(self) -> tuple[int, int]:
+        """(provider_id, telegram_id) случайного поставщика."""
+        p = self.random.randrange(self.providers)
+        return p + 1, PROVIDER_TG_BASE + p
+
+    def random_typed_query(self) -> str:
+        """Начало названия случайной услуги - то, что клиент успел набрать после @bot."""
+        service = self.random.randrange(self.services_per_provider)
+        name = f"Service {service} of {self.random.randrange(self.providers)}"
+        return name[:self.random.randrange(1, len(name) + 1)]
+
+    def random_service_id(self) -> int:
+        return self.random.randrange(self.providers * self.services_per_provider) + 1
+
+    def free_slot_id(self) -> int:
+        database = self.db_module
+        with database.SessionLocal() as db:
+            while True:
+                slot = db.query(database.TimeSlot.slot_id).filter(
+                    database.TimeSlot.service_id == self.random_service_id(),
+                    database.TimeSlot.is_available == True,
+                    database.TimeSlot.start_time > now_ts()
+                ).first()
+                if slot:
+                    return slot.slot_id
+
+    def free_slot_ids(self, count: int) -> list[int]:
+        """count разных свободных будущих слотов случайных услуг."""
+        database = self.db_module
+        with database.SessionLocal() as db:
+            first_service = self.random_service_id()
+            rows = db.query(database.TimeSlot.slot_id).filter(
+                database.TimeSlot.service_id >= first_service,
+                database.TimeSlot.is_available == True,
+                database.TimeSlot.start_time > now_ts()
+            ).limit(count).all()
+        return [row.slot_id for row in rows]
+
+    def create_booking(self, client_telegram_id: int) -> int:
+        """Бронирует свободный слот для клиента напрямую в БД и возвращает booking_id."""
+        database = self.db_module
+        slot_id = self.free_slot_id()
+        with database.SessionLocal() as db:
+            booking = database.Booking(slot_id=slot_id, client_telegram_id=client_telegram_id, status="confirmed")
+            db.query(database.TimeSlot).filter(database.TimeSlot.slot_id == slot_id).update({"is_available": False, "booked_seats": 1})
+            db.add(booking)
+            db.commit()
+            return booking.booking_id
+
+    def provider_booking(self) -> tuple[int, int]:
+        """Создает бронь на услугу случайного поставщика. Возвращает (telegram_id поставщика, booking_id)."""
+        booking_id = self.create_booking(next(self.new_ids))
+        database = self.db_module
+        with database.SessionLocal() as db:
+            telegram_id = db.query(database.Provider.telegram_id)\
+                .join(database.Service).join(database.TimeSlot).join(database.Booking)\
+                .filter(database.Booking.booking_id == booking_id).scalar()
+        return telegram_id, booking_id
+
+
+def build_scenarios(ds: Dataset) -> dict:
+    """Сценарии: имя -> функция подготовки, возвращающая (хендлер, update, context, calls)."""
+    import handlers_common
+    import handlers_client
+    import handlers_inline
+    import handlers_provider
+
+    def command(handler, text_args):
+        def setup():
+            telegram_id, text, args = text_args()
+            return (handler,) + make_command(telegram_id, text, args)
+        return setup
+
+    def callback(data_factory):
+        def setup():
+            telegram_id, data = data_factory()
+            return (handlers_client.button_callback_handler,) + make_callback(telegram_id, data)
+        return setup
+
+    def add_slot_args():
+        provider_id, telegram_id = ds.random_provider()
+        service_id = (provider_id - 1) * ds.services_per_provider + 1
+        start = datetime(2090, 1, 1) + timedelta(hours=next(ds.new_ids) % 10**6)
+        return telegram_id, "/add_slot", [str(service_id), start.strftime("%Y-%m-%d"), start.strftime("%H:%M")]
+
+    def cancel_provider_args():
+        telegram_id, booking_id = ds.provider_booking()
+        return telegram_id, "/cancel_booking_provider", [str(booking_id)]
+
+    def book_slot_data():
+        return next(ds.new_ids), f"book_slot_{ds.free_slot_id()}"
+
+    def cancel_client_data():
+        client_id = next(ds.new_ids)
+        return client_id, f"cancel_booking_client_{ds.create_booking(client_id)}"
+
+    def nav_back_data():
+        # Как после /services и выбора услуги: в истории сообщения страница каталога и список слотов
+        from database import DEFAULT_TENANT
+        from nav_cache import NavView
+        client_id = next(ds.new_ids)
+        for text in ("<b>Доступные услуги для бронирования:</b>\n\n" + "Услуга\n" * 30, "<b>Доступные слоты</b>\n"):
+            handlers_client.navigation.push((DEFAULT_TENANT, client_id), 1, NavView(text, ()))
+        return client_id, "nav_0"
+
+    # У арендатора по умолчанию тысячи услуг, и /services сразу отвечает "слишком много услуг" (больше 30).
+    # Список рисуется для каталога арендатора с TENANT_SERVICES услугами.
+    catalog_tenant = ensure_tenant_services(ds, 1)[0]
+
+    def services_setup():
+        handler, update, context, calls = (handlers_client.list_available_services,) + make_command(next(ds.new_ids), "/services", [])
+        context.bot_data["tenant"] = catalog_tenant
+        return handler, update, context, calls
+
+    return {
+        "start": command(handlers_common.start, lambda: (next(ds.new_ids), "/start", [])),
+        "help": command(handlers_common.help_command, lambda: (next(ds.new_ids), "/help", [])),
+        "services": services_setup,
+        "my_bookings": command(handlers_client.my_bookings_client,
+                               lambda: (CLIENT_TG_BASE + ds.random.randrange(5000), "/my_bookings", [])),
+        "register_provider": command(handlers_provider.register_provider,
+                                     lambda: (next(ds.new_ids), "/register_provider", ["Bench", "Provider"])),
+        "add_service": command(handlers_provider.add_service,
+                               lambda: (ds.random_provider()[1], "/add_service", "Bench; Описание; 45; 300".split())),
+        "my_services": command(handlers_provider.my_services, lambda: (ds.random_provider()[1], "/my_services", [])),
+        "add_slot": command(handlers_provider.add_slot, add_slot_args),
+        "my_slots": command(handlers_provider.my_slots, lambda: (ds.random_provider()[1], "/my_slots", [])),
+        "cancel_booking_provider": command(handlers_provider.cancel_booking_provider, cancel_provider_args),
+        "cb_view_slots": callback(lambda: (next(ds.new_ids), f"view_slots_{ds.random_service_id()}")),
+        "cb_book_slot": callback(book_slot_data),
+        "cb_cancel_booking_client": callback(cancel_client_data),
+        "cb_nav_back": callback(nav_back_data),
+        "cb_unknown": callback(lambda: (next(ds.new_ids), "unknown_payload")),
+        "inline_search": lambda: (handlers_inline.inline_search,) + make_inline(next(ds.new_ids), ds.random_typed_query()),
+    }
+
+
+def _has_error(calls: list) -> bool:
+    for _, args, kwargs in calls:
+        text = kwargs.get("text") or (args[0] if args and isinstance(args[0], str) else "")
+        if isinstance(text, str) and text.startswith(ERROR_MARKERS):
+            return True
+    return False
+
+
+async def run_handler(handler, update, context) -> None:
+    """Вызывает хендлер и закрывает сессию апдейта, как это делает обертка в main.py."""
+    import db_access
+    try:
+        await handler(update, context)
+    finally:
+        db_access.finish_update(context)
+
+
+async def measure(setup, iterations: int, counter: QueryCounter) -> dict:
+    """Прогоняет сценарий: время и число запросов по каждому вызову, память - отдельным вызовом."""
+    timings, queries, errors = [], [], 0
+    for _ in range(WARMUP_CALLS): # Кэш страниц SQLite и ленивые импорты - не в замер (иначе первый прогон после генерации базы быстрее)
+        handler, update, context, calls = setup()
+        await run_handler(handler, update, context)
+    for _ in range(iterations):
+        handler, update, context, calls = setup()
+        counter.count = 0
+        started = time.perf_counter()
+        await run_handler(handler, update, context)
+        timings.append((time.perf_counter() - started) * 1000)
+        queries.append(counter.count)
+        errors += _has_error(calls)
+
+    # tracemalloc сильно замедляет код, поэтому память меряется в отдельном вызове
+    handler, update, context, calls = setup()
+    tracemalloc.start()
+    await run_handler(handler, update, context)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "median_ms": round(statistics.median(timings), 3),
+        "p95_ms": round(sorted(timings)[max(0, int(len(timings) * 0.95) - 1)], 3),
+        "queries": statistics.median(queries),
+        "peak_kib": round(peak / 1024, 1),
+        "errors": errors,
+    }
+
+
+def calibrate(rounds: int = 5) -> float:
+    """Время (мс) эталонной нагрузки: SQLite в памяти и форматирование строк, как в хендлерах.
+
+    Скорость машины плавает (в CI - в разы между прогонами), поэтому время сценария
+    сравнивается с базовым прогоном в единицах этой нагрузки, измеренной рядом со сценарием.
+    """
+    import sqlite3
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, v TEXT)")
+    conn.executemany("INSERT INTO t (v) VALUES (?)", [(f"value {n}",) for n in range(2000)])
+    samples = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for n in range(100):
+            rows = conn.execute("SELECT id, v FROM t WHERE id BETWEEN ? AND ?", (n, n + 20)).fetchall()
+            "".join(f"{i}:{v}\n" for i, v in rows)
+        samples.append((time.perf_counter() - started) * 1000)
+    conn.close()
+    return statistics.median(samples)
+
+
+def compare(results: dict, baseline: dict, tolerance: float, time_tolerance: float) -> list[str]:
+    """Список регрессий относительно базового прогона.
+
+    Число запросов сравнивается строго, пиковая память - с tolerance, время - с time_tolerance
+    после поправки на скорость машины (calibration_ms) и с запасом TIME_SLACK_MS.
+    """
+    regressions = []
+    for name, current in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        speed = current["calibration_ms"] / base["calibration_ms"]
+        allowed_ms = base["median_ms"] * speed * (1 + time_tolerance) + TIME_SLACK_MS
+        if current["median_ms"] > allowed_ms:
+            regressions.append(f"{name}: median {current['median_ms']} ms > baseline {base['median_ms']} ms "
+                               f"(x{speed:.2f} machine speed, allowed {allowed_ms:.3f} ms)")
+        if current["queries"] > base["queries"]:
+            regressions.append(f"{name}: {current['queries']} queries > baseline {base['queries']}")
+        if current["peak_kib"] > base["peak_kib"] * (1 + tolerance):
+            regressions.append(f"{name}: peak {current['peak_kib']} KiB > baseline {base['peak_kib']} KiB")
+    return regressions
+
+
+def _percentiles(latencies: list[float]) -> tuple[float, float]:
+    ordered = sorted(latencies)
+    return round(statistics.median(ordered), 3), round(ordered[max(0, int(len(ordered) * 0.95) - 1)], 3)
+
+
+async def measure_reads_under_writes(ds: Dataset, iterations: int, writers: int, period_ms: float) -> dict:
+    """Задержка чтений (view_slots_) в покое и во время всплеска бронирований/отмен.
+
+    Чтения запускаются с фиксированным периодом, задержка считается от запланированного
+    момента запуска: если event loop занят записью, чтение стартует позже и это видно в p95.
+    """
+    import handlers_client
+    from functools import partial
+    from database import DEFAULT_TENANT
+    from db_access import run_write
+
+    async def reads() -> list[float]:
+        latencies = []
+        next_start = time.perf_counter()
+        for _ in range(iterations):
+            next_start += period_ms / 1000
+            delay = next_start - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            handler, update, context, _ = (handlers_client.button_callback_handler,) + make_callback(
+                next(ds.new_ids), f"view_slots_{ds.random_service_id()}")
+            await run_handler(handler, update, context)
+            latencies.append((time.perf_counter() - next_start) * 1000)
+        return latencies
+
+    slot_ids = [ds.free_slot_id() for _ in range(writers * 50)]
+
+    async def write_burst(stop: asyncio.Event, my_slots: list[int]) -> int:
+        done = 0
+        while not stop.is_set():
+            for slot_id in my_slots:
+                client_id = next(ds.new_ids)
+                booked = await run_write(partial(handlers_client.book_slot, slot_id=slot_id, client_telegram_id=client_id, tenant=DEFAULT_TENANT))
+                if booked:
+                    await run_write(partial(handlers_client.cancel_booking_by_client,
+                                            booking_id=booked["booking_id"], client_telegram_id=client_id, tenant=DEFAULT_TENANT))
+                done += 2
+                await asyncio.sleep(0)
+                if stop.is_set():
+                    break
+        return done
+
+    idle = await reads()
+    stop = asyncio.Event()
+    burst = [asyncio.create_task(write_burst(stop, slot_ids[i::writers])) for i in range(writers)]
+    started = time.perf_counter()
+    loaded = await reads()
+    stop.set()
+    writes_done = sum(await asyncio.gather(*burst))
+    elapsed = time.perf_counter() - started
+    return {
+        "idle": _percentiles(idle),
+        "burst": _percentiles(loaded),
+        "writes_per_s": round(writes_done / elapsed, 1),
+    }
+
+
+async def run_write_burst(ds: Dataset, args) -> int:
+    """Сравнивает общий engine и режим single writer по задержке чтений во время записи."""
+    import db_access
+    print(f"{'mode':<16}{'idle median':>13}{'idle p95':>10}{'burst median':>14}{'burst p95':>11}{'writes/s':>10}")
+    for mode in ("shared", "single_writer"):
+        if mode == "single_writer":
+            db_access.enable_single_writer()
+        result = await measure_reads_under_writes(ds, args.iterations, args.writers, args.period_ms)
+        if mode == "single_writer":
+            await db_access.disable_single_writer()
+        print(f"{mode:<16}{result['idle'][0]:>13}{result['idle'][1]:>10}"
+              f"{result['burst'][0]:>14}{result['burst'][1]:>11}{result['writes_per_s']:>10}")
+    return 0
+
+
+async def run_group_commit(ds: Dataset, args) -> int:
+    """Бронирований в секунду при конкурентных клиентах: писатель без группового commit и с ним."""
+    import db_access
+    import handlers_client
+    from functools import partial
+    from database import DEFAULT_TENANT
+
+    print(f"{'group commit':<16}{'bookings/s':>12}{'avg group':>11}{'conflicts':>11}")
+    for label, window_ms in (("off", 0), (f"on ({args.group_commit_ms} ms)", args.group_commit_ms)):
+        slot_ids = ds.free_slot_ids(args.iterations)
+        writer = db_access.enable_single_writer(group_commit_ms=window_ms)
+
+        async def client(my_slots: list[int]) -> int:
+            conflicts = 0
+            for slot_id in my_slots:
+                booked = await db_access.run_write(partial(
+                    handlers_client.book_slot, slot_id=slot_id, client_telegram_id=next(ds.new_ids), tenant=DEFAULT_TENANT))
+                conflicts += booked is None
+            return conflicts
+
+        started = time.perf_counter()
+        conflicts = sum(await asyncio.gather(*(client(slot_ids[i::args.writers]) for i in range(args.writers))))
+        elapsed = time.perf_counter() - started
+        avg_group = writer.completed / max(1, writer.commits)
+        await db_access.disable_single_writer()
+        print(f"{label:<16}{len(slot_ids) / elapsed:>12.1f}{avg_group:>11.1f}{conflicts:>11}")
+    return 0
+
+
+def run_time_columns(args, rows: int) -> int:
+    """Текстовые DateTime-колонки (как до перехода на epoch) против целых секунд UTC epoch.
+
+    Обе таблицы одинаковые, с индексом (service_id, start_time); замеряются выборка слотов
+    услуги по времени, подсчет по диапазону без индекса и загрузка строк (гидрация).
+    """
+    from sqlalchemy import Column, DateTime, Integer, MetaData, Table, create_engine, func, insert, select
+
+    path = os.path.abspath("bench_time_columns.db")
+    if os.path.exists(path):
+        os.remove(path)
+    engine = create_engine(f"sqlite:///{path}")
+    metadata = MetaData()
+    tables = {
+        kind: Table(f"slots_{kind}", metadata,
+                    Column("slot_id", Integer, primary_key=True),
+                    Column("service_id", Integer, nullable=False),
+                    Column("start_time", column_type, nullable=False),
+                    Column("end_time", column_type, nullable=False))
+        for kind, column_type in (("text", DateTime), ("epoch", Integer))
+    }
+    metadata.create_all(engine)
+    with engine.begin() as conn:
+        for table in tables.values():
+            conn.exec_driver_sql(f"CREATE INDEX ix_{table.name}_service_start ON {table.name} (service_id, start_time)")
+
+    services = max(1, rows // 200)
+    first_day = datetime.now().replace(hour=8, minute=0, second=0, microsecond=0)
+    starts = [first_day + timedelta(days=n // 10, hours=n % 10) for n in range(200)]
+    with engine.begin() as conn:
+        for kind, table in tables.items():
+            convert = to_ts if kind == "epoch" else (lambda value: value)
+            batch = []
+            for slot_id in range(rows):
+                start = starts[slot_id % 200]
+                batch.append({"slot_id": slot_id + 1, "service_id": slot_id // 200 + 1,
+                              "start_time": convert(start), "end_time": convert(start + timedelta(hours=1))})
+                if len(batch) >= SEED_BATCH:
+                    conn.execute(insert(table), batch)
+                    batch = []
+            if batch:
+                conn.execute(insert(table), batch)
+
+    rng = random.Random(7)
+    window_start = first_day + timedelta(days=5)
+    window_end = first_day + timedelta(days=10)
+    results = {}
+    with engine.connect() as conn:
+        for kind, table in tables.items():
+            convert = to_ts if kind == "epoch" else (lambda value: value)
+            by_service = select(table.c.slot_id, table.c.start_time, table.c.end_time).where(
+                table.c.service_id == 0, table.c.start_time > convert(window_start)
+            ).order_by(table.c.start_time).limit(10)
+            in_range = select(func.count()).select_from(table).where(
+                table.c.start_time >= convert(window_start), table.c.start_time < convert(window_end)
+            )
+            hydrate = select(table.c.slot_id, table.c.start_time, table.c.end_time)
+
+            timings = {"service range": [], "range count": [], "hydrate all": []}
+            for _ in range(args.iterations):
+                service_id = rng.randrange(services) + 1
+                started = time.perf_counter()
+                conn.execute(by_service.where(table.c.service_id == service_id)).all()
+                timings["service range"].append((time.perf_counter() - started) * 1000)
+
+                started = time.perf_counter()
+                conn.execute(in_range).scalar()
+                timings["range count"].append((time.perf_counter() - started) * 1000)
+
+                started = time.perf_counter()
+                conn.execute(hydrate).all()
+                timings["hydrate all"].append((time.perf_counter() - started) * 1000)
+            results[kind] = {name: round(statistics.median(values), 3) for name, values in timings.items()}
+    engine.dispose()
+    os.remove(path)
+
+    print(f"{rows} slots, median ms over {args.iterations} runs")
+    print(f"{'query':<16}{'text':>10}{'epoch':>10}{'speedup':>9}")
+    for name in results["text"]:
+        text_ms, epoch_ms = results["text"][name], results["epoch"][name]
+        print(f"{name:<16}{text_ms:>10}{epoch_ms:>10}{text_ms / max(epoch_ms, 1e-6):>8.1f}x")
+    return 0
+
+
+def run_inline(ds: Dataset, args) -> int:
+    """Стоимость одного нажатия клавиши в inline-режиме: префиксный индекс против LIKE-запроса в БД.
+
+    Набор запроса моделируется всеми префиксами названий случайных услуг. В обоих вариантах
+    ближайшие слоты страницы результатов берутся из БД одним запросом (next_free_slots).
+    """
+    import handlers_inline
+    from database import DEFAULT_TENANT, Provider, Service
+
+    counter = QueryCounter(ds.db_module.engine)
+    started = time.perf_counter()
+    index = handlers_inline.rebuild_catalog_index(DEFAULT_TENANT)
+    build_s = time.perf_counter() - started
+    print(f"index: {len(index)} services, built in {build_s:.3f}s")
+
+    def like_search(db, query: str) -> list[int]: # Как искали бы без индекса
+        pattern = f"%{query}%"
+        rows = db.query(Service.service_id).join(Provider, Service.provider_id == Provider.provider_id).filter(
+            Provider.is_active == True, (Service.name.ilike(pattern)) | (Provider.name.ilike(pattern))
+        ).order_by(Service.name).limit(handlers_inline.INLINE_RESULTS_LIMIT)
+        return [row.service_id for row in rows]
+
+    def index_search(db, query: str) -> list[int]:
+        entries, _ = index.search(query, 0, handlers_inline.INLINE_RESULTS_LIMIT)
+        return [entry.service_id for entry in entries]
+
+    keystrokes = []
+    for _ in range(args.iterations):
+        name = ds.random_typed_query()
+        keystrokes.extend(name[:length] for length in range(1, len(name) + 1))
+
+    print(f"{len(keystrokes)} keystrokes")
+    print(f"{'search':<10}{'median ms':>11}{'p95 ms':>10}{'queries':>9}")
+    for label, search in (("like", like_search), ("index", index_search)):
+        latencies = []
+        counter.count = 0
+        with ds.db_module.SessionLocal() as db:
+            for query in keystrokes:
+                started = time.perf_counter()
+                handlers_inline.next_free_slots(db, search(db, query))
+                latencies.append((time.perf_counter() - started) * 1000)
+        median, p95 = _percentiles(latencies)
+        print(f"{label:<10}{median:>11}{p95:>10}{counter.count / len(keystrokes):>9.1f}")
+    return 0
+
+
+def ensure_rule_services(ds: Dataset) -> list[int]:
+    """Поставщик, у услуг которого нет строк слотов, только правила: 08:00-18:00 каждый день,
+    та же плотность, что у сгенерированных слотов (10 часовых слотов в день). Возвращает ID услуг."""
+    database = ds.db_module
+    with database.SessionLocal() as db:
+        provider = db.query(database.Provider).filter(database.Provider.telegram_id == RULES_PROVIDER_TG).first()
+        if provider is None:
+            provider = database.Provider(telegram_id=RULES_PROVIDER_TG, name="Rules provider", is_active=True)
+            db.add(provider)
+            db.flush()
+            for n in range(ds.services_per_provider):
+                service = database.Service(provider_id=provider.provider_id, name=f"Rules service {n}",
+                                           duration_minutes=60, price=100.0)
+                db.add(service)
+                db.flush()
+                db.add_all([database.ScheduleRule(service_id=service.service_id, kind="hours", weekday=weekday,
+                                                  start_minute=8 * 60, end_minute=18 * 60) for weekday in range(7)])
+            db.commit()
+        return [service_id for (service_id,) in
+                db.query(database.Service.service_id).filter(database.Service.provider_id == provider.provider_id)]
+
+
+async def run_virtual_slots(ds: Dataset, args) -> int:
+    """Слоты строками TimeSlot против слотов по правилам расписания: просмотр, бронирование и объем таблицы."""
+    import handlers_client
+    from database import DEFAULT_TENANT
+    from virtual_slots import load_service_schedule, upcoming_slots
+    database = ds.db_module
+    rule_service_ids = ensure_rule_services(ds)
+    counter = QueryCounter(database.engine)
+
+    def view(service_ids):
+        def setup():
+            return (handlers_client.button_callback_handler,) + make_callback(
+                next(ds.new_ids), f"view_slots_{ds.random.choice(service_ids)}")
+        return setup
+
+    def book_rule_slot():
+        with database.SessionLocal() as db:
+            while True:
+                service_id = ds.random.choice(rule_service_ids)
+                slots = [slot for slot in upcoming_slots(db, service_id, load_service_schedule(db, service_id, DEFAULT_TENANT)[1], 10)
+                         if slot[2] is None]
+                if slots:
+                    break
+        start = ds.random.choice(slots)[0]
+        return (handlers_client.button_callback_handler,) + make_callback(next(ds.new_ids), f"book_vslot_{service_id}_{start}")
+
+    row_service_ids = list(range(1, ds.services_per_provider + 1))
+    scenarios = {
+        "view_slots rows": view(row_service_ids),
+        "view_slots rules": view(rule_service_ids),
+        "book_slot rows": lambda: (handlers_client.button_callback_handler,) + make_callback(
+            next(ds.new_ids), f"book_slot_{ds.free_slot_id()}"),
+        "book_vslot rules": book_rule_slot,
+    }
+    print(f"{'scenario':<26}{'median ms':>11}{'p95 ms':>10}{'queries':>9}{'peak KiB':>10}{'errors':>8}")
+    for name, setup in scenarios.items():
+        result = await measure(setup, args.iterations, counter)
+        print(f"{name:<26}{result['median_ms']:>11}{result['p95_ms']:>10}{result['queries']:>9}"
+              f"{result['peak_kib']:>10}{result['errors']:>8}")
+
+    with database.SessionLocal() as db:
+        for label, service_ids in (("rows", row_service_ids), ("rules", rule_service_ids)):
+            rows = db.query(database.TimeSlot).filter(database.TimeSlot.service_id.in_(service_ids)).count()
+            print(f"time_slots rows per service ({label}): {rows / len(service_ids):.1f}")
+    return 0
+
+
+def ensure_group_services(ds: Dataset) -> tuple[int, int]:
+    """Две услуги с одинаковым расписанием групповых занятий: по GROUP_SIZE копий слота на занятие
+    (как приходилось делать без мест) и одна строка с capacity=GROUP_SIZE. Возвращает (ID копий, ID мест)."""
+    from sqlalchemy import insert
+    database = ds.db_module
+    with database.SessionLocal() as db:
+        provider = db.query(database.Provider).filter(database.Provider.telegram_id == GROUP_PROVIDER_TG).first()
+        if provider is None:
+            provider = database.Provider(telegram_id=GROUP_PROVIDER_TG, name="Group provider", is_active=True)
+            db.add(provider)
+            db.flush()
+            first_start = to_ts(datetime.now().replace(hour=18, minute=0, second=0, microsecond=0) + timedelta(days=1))
+            for name, copies, capacity in (("Group copies", GROUP_SIZE, 1), ("Group seats", 1, GROUP_SIZE)):
+                service = database.Service(provider_id=provider.provider_id, name=name, duration_minutes=60, price=100.0)
+                db.add(service)
+                db.flush()
+                db.execute(insert(database.TimeSlot), [
+                    {"service_id": service.service_id, "start_time": first_start + n * 86400,
+                     "end_time": first_start + n * 86400 + 3600, "is_available": True, "capacity": capacity}
+                    for n in range(GROUP_SESSIONS) for _ in range(copies)
+                ])
+            db.commit()
+        copies_id, seats_id = [service_id for (service_id,) in db.query(database.Service.service_id)
+                               .filter(database.Service.provider_id == provider.provider_id)
+                               .order_by(database.Service.service_id)]
+    return copies_id, seats_id
+
+
+async def run_group_slots(ds: Dataset, args) -> int:
+    """Групповое занятие копиями слота против одной строки с местами: объем, просмотр и запись на одно занятие."""
+    import db_access
+    import handlers_client
+    from functools import partial
+    from database import DEFAULT_TENANT
+    database = ds.db_module
+    copies_id, seats_id = ensure_group_services(ds)
+    counter = QueryCounter(database.engine)
+
+    def view(service_id):
+        return lambda: (handlers_client.button_callback_handler,) + make_callback(
+            next(ds.new_ids), f"view_slots_{service_id}")
+
+    print(f"{'scenario':<26}{'median ms':>11}{'p95 ms':>10}{'queries':>9}{'peak KiB':>10}{'errors':>8}")
+    for name, setup in (("view_slots copies", view(copies_id)), ("view_slots seats", view(seats_id))):
+        result = await measure(setup, args.iterations, counter)
+        print(f"{name:<26}{result['median_ms']:>11}{result['p95_ms']:>10}{result['queries']:>9}"
+              f"{result['peak_kib']:>10}{result['errors']:>8}")
+
+    with database.SessionLocal() as db:
+        for label, service_id in (("copies", copies_id), ("seats", seats_id)):
+            page = db.query(database.TimeSlot.start_time).filter(
+                database.TimeSlot.service_id == service_id, database.TimeSlot.is_available == True
+            ).order_by(database.TimeSlot.start_time).limit(handlers_client.SLOTS_PER_VIEW).all()
+            print(f"sessions on a view_slots page ({label}): {len(set(page))}")
+
+    # Запись на одно занятие: клиентов вдвое больше, чем мест; каждый жмет кнопку из списка,
+    # который видел (у копий - случайная из свободных, у мест - единственная)
+    print(f"{'contention':<16}{'rows/session':>14}{'booked':>8}{'retries':>9}{'bookings/s':>12}")
+    for label, service_id in (("copies", copies_id), ("seats", seats_id)):
+        with database.SessionLocal() as db:
+            rows = db.query(database.TimeSlot).filter(database.TimeSlot.service_id == service_id).count()
+            session_start = db.query(database.TimeSlot.start_time).filter(
+                database.TimeSlot.service_id == service_id,
+                database.TimeSlot.is_available == True
+            ).order_by(database.TimeSlot.start_time).limit(1).scalar()
+            slot_ids = [slot_id for (slot_id,) in db.query(database.TimeSlot.slot_id).filter(
+                database.TimeSlot.service_id == service_id,
+                database.TimeSlot.start_time == session_start,
+                database.TimeSlot.is_available == True
+            )]
+        booked = retries = 0
+
+        async def client() -> None:
+            nonlocal booked, retries
+            client_id = next(ds.new_ids)
+            for _ in range(GROUP_SIZE): # Неудача - клиент обновляет список и пробует еще раз
+                if await db_access.run_write(partial(
+                        handlers_client.book_slot, slot_id=ds.random.choice(slot_ids), client_telegram_id=client_id, tenant=DEFAULT_TENANT)):
+                    booked += 1
+                    return
+                retries += 1
+                with database.SessionLocal() as db:
+                    free = [slot_id for (slot_id,) in db.query(database.TimeSlot.slot_id).filter(
+                        database.TimeSlot.slot_id.in_(slot_ids), database.TimeSlot.is_available == True)]
+                if not free:
+                    return
+                slot_ids[:] = free
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(GROUP_SIZE * 2)))
+        elapsed = time.perf_counter() - started
+        print(f"{label:<16}{rows / GROUP_SESSIONS:>14.0f}{booked:>8}{retries:>9}{booked / elapsed:>12.1f}")
+    return 0
+
+
+def ensure_tenant_services(ds: Dataset, count: int) -> list[str]:
+    """count арендаторов (брендированных ботов) с одним поставщиком, TENANT_SERVICES услугами и слотами.
+    У всех поставщиков один telegram_id: в разных арендаторах это разные записи. Возвращает имена арендаторов."""
+    from sqlalchemy import insert
+    database = ds.db_module
+    tenants = [f"bench{n}" for n in range(count)]
+    first_start = to_ts(datetime.now().replace(hour=9, minute=0, second=0, microsecond=0) + timedelta(days=1))
+    with database.SessionLocal() as db:
+        existing = {tenant for (tenant,) in db.query(database.Provider.tenant).filter(database.Provider.tenant.in_(tenants))}
+        for tenant in tenants:
+            if tenant in existing:
+                continue
+            provider = database.Provider(tenant=tenant, telegram_id=TENANT_PROVIDER_TG, name=f"Provider of {tenant}", is_active=True)
+            db.add(provider)
+            db.flush()
+            for s in range(TENANT_SERVICES):
+                service = database.Service(provider_id=provider.provider_id, name=f"{tenant} service {s}",
+                                           duration_minutes=60, price=100.0 + s)
+                db.add(service)
+                db.flush()
+                db.execute(insert(database.TimeSlot), [
+                    {"service_id": service.service_id, "start_time": first_start + n * 3600,
+                     "end_time": first_start + n * 3600 + 3600, "is_available": True}
+                    for n in range(10)
+                ])
+        db.commit()
+    return tenants
+
+
+def run_multibot(ds: Dataset, args) -> int:
+    """N ботов: N отдельных процессов против одного процесса multibot.py. Память и CPU в дочерних процессах."""
+    import subprocess
+    tenants = ensure_tenant_services(ds, args.multibot)
+
+    def child(bot_tenants: list[str]) -> dict:
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--db", args.db_path, "--iterations", str(args.iterations),
+             "--multibot-child", ",".join(bot_tenants)],
+            check=True, capture_output=True, text=True).stdout
+        return json.loads(output.splitlines()[-1])
+
+    print(f"{len(tenants)} bots, {args.iterations} rounds of updates per bot")
+    print(f"{'mode':<14}{'processes':>10}{'RSS MiB':>9}{'MiB/bot':>9}{'CPU s':>8}{'CPU ms/bot':>12}{'us/update':>11}{'errors':>8}")
+    for label, runs in (("separate", [child([tenant]) for tenant in tenants]), ("one process", [child(tenants)])):
+        rss = sum(run["rss_kib"] for run in runs) / 1024
+        cpu = sum(run["cpu_s"] for run in runs)
+        workload_cpu = sum(run["workload_cpu_s"] for run in runs)
+        updates = sum(run["updates"] for run in runs)
+        print(f"{label:<14}{len(runs):>10}{rss:>9.1f}{rss / len(tenants):>9.1f}{cpu:>8.2f}"
+              f"{cpu / len(tenants) * 1000:>12.0f}{workload_cpu / updates * 1e6:>11.0f}{sum(run['errors'] for run in runs):>8}")
+    return 0
+
+
+async def run_multibot_child(args) -> int:
+    """Дочерний процесс --multibot: боты арендаторов через build_application из main.py и их апдейты по кругу.
+
+    Сети нет: хендлеры вызываются напрямую (как это делает Application) с bot_data своего бота.
+    В stdout последней строкой - JSON с пиковым RSS процесса и CPU (весь процесс и только апдейты).
+    """
+    import logging
+    import resource
+    import database
+    import main as bot_main
+    logging.getLogger().setLevel(logging.ERROR) # Строки таймингов не нужны
+    tenants = args.multibot_child.split(",")
+    applications = [bot_main.build_application(f"{100000 + n}:bench", tenant) for n, tenant in enumerate(tenants)]
+    with database.SessionLocal() as db:
+        service_ids = {tenant: [service_id for (service_id,) in db.query(database.Service.service_id)
+                                .join(database.Provider).filter(database.Provider.tenant == tenant)]
+                       for tenant in tenants}
+    rng = random.Random(42)
+    client_ids = itertools.count(CLIENT_TG_BASE * 2)
+    services = bot_main.lazy_handler("handlers_client", "list_available_services")
+    buttons = bot_main.lazy_handler("handlers_client", "button_callback_handler")
+    inline = bot_main.lazy_handler("handlers_inline", "inline_search")
+
+    errors = updates = 0
+    workload_started = time.process_time()
+    for _ in range(args.iterations):
+        for application in applications: # Апдейты ботов вперемешку, как в одном event loop
+            tenant = application.bot_data["tenant"]
+            client_id = next(client_ids)
+            for handler, (update, context, calls) in (
+                    (services, make_command(client_id, "/services", [])),
+                    (buttons, make_callback(client_id, f"view_slots_{rng.choice(service_ids[tenant])}")),
+                    (inline, make_inline(client_id, tenant[:4]))):
+                context.bot_data = application.bot_data
+                await handler(update, context)
+                updates += 1
+                errors += _has_error(calls)
+    workload_cpu = time.process_time() - workload_started
+    errors += sum(application.bot_data["metrics"].failed for application in applications)
+
+    print(json.dumps({
+        "rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, # В Linux - КиБ
+        "cpu_s": round(time.process_time(), 3),
+        "workload_cpu_s": round(workload_cpu, 3),
+        "updates": updates,
+        "errors": errors,
+    }))
+    bot_main.log_listener.stop()
+    return 0
+
+
+def run_cold_start(ds: Dataset, args) -> int:
+    """Холодный старт: от запуска процесса до готовности к опросу и до первого обработанного апдейта.
+
+    Каждый замер - новый процесс (--cold-start-child) на уже сгенерированной базе. Время считается
+    в родителе от запуска дочернего процесса, то есть включает старт интерпретатора и все импорты.
+    """
+    import subprocess
+
+    def child() -> dict:
+        started = time.time()
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--db", args.db_path, "--cold-start-child"],
+            check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.splitlines()[-1])
+        return {"ready_ms": (result["ready_at"] - started) * 1000, "first_update_ms": (result["first_update_at"] - started) * 1000}
+
+    runs = [child() for _ in range(args.iterations)]
+    print(f"{args.iterations} cold starts, first update: /start")
+    print(f"{'stage':<22}{'median ms':>11}{'p95 ms':>10}")
+    for label, key in (("ready to poll", "ready_ms"), ("first update handled", "first_update_ms")):
+        median, p95 = _percentiles([run[key] for run in runs])
+        print(f"{label:<22}{median:>11}{p95:>10}")
+    return 0
+
+
+async def run_cold_start_child(args) -> int:
+    """Дочерний процесс --cold-start: запуск бота как в main.main(), но с Telegram Bot API в памяти.
+
+    Тот же путь, что у run_polling: initialize (getMe), post_init, опрос и обработка первого
+    апдейта через Application. В stdout последней строкой - JSON с моментами (time.time())
+    готовности к опросу и завершения первого апдейта.
+    """
+    from telegram import Update
+    from telegram.ext import TypeHandler
+    from telegram.request import HTTPXRequest
+    import main as bot_main
+
+    client_id = CLIENT_TG_BASE * 3
+    chat = {"id": client_id, "type": "private"}
+    first_update = {"update_id": 1, "message": {
+        "message_id": 1, "date": now_ts(), "chat": chat, "from": {"id": client_id, "is_bot": False, "first_name": "Bench"},
+        "text": "/start", "entities": [{"type": "bot_command", "offset": 0, "length": 6}]}}
+    pending_updates = [first_update]
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs) -> tuple[int, bytes]:
+        """Ответы Bot API без сети: getUpdates отдает один апдейт, остальные методы - успех."""
+        api_method = url.rsplit("/", 1)[-1]
+        if api_method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        elif api_method == "getUpdates":
+            result = [pending_updates.pop()] if pending_updates else []
+            if not result:
+                await asyncio.sleep(0.05)
+        elif api_method in ("sendMessage", "editMessageText"):
+            result = {"message_id": 2, "date": now_ts(), "chat": chat, "text": "ok"}
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+    HTTPXRequest.do_request = do_request
+    handled = asyncio.Event()
+
+    async def first_update_handled(update: Update, context) -> None:
+        handled.set()
+
+    application = bot_main.build_application(bot_main.config.BOT_TOKEN, post_init=bot_main.post_init, post_shutdown=bot_main.post_shutdown)
+    application.add_handler(TypeHandler(Update, first_update_handled), group=1) # После хендлеров апдейта (группа 0)
+    await application.initialize()
+    await application.post_init(application)
+    await application.updater.start_polling()
+    await application.start()
+    ready_at = time.time()
+    await handled.wait()
+    first_update_at = time.time()
+
+    await application.updater.stop()
+    await application.stop()
+    await application.post_shutdown(application)
+    await application.shutdown()
+    print(json.dumps({"ready_at": ready_at, "first_update_at": first_update_at}))
+    bot_main.log_listener.stop()
+    return 0
+
+
+def seed_cancel_day(ds: Dataset, day: datetime, bookings: int) -> None:
+    """День поставщика CANCEL_PROVIDER_TG с bookings бронями: CANCEL_DAY_SLOTS слотов, все места заняты."""
+    from sqlalchemy import insert
+    database = ds.db_module
+    with database.SessionLocal() as db:
+        provider = db.query(database.Provider).filter(database.Provider.telegram_id == CANCEL_PROVIDER_TG).first()
+        if provider is None:
+            provider = database.Provider(telegram_id=CANCEL_PROVIDER_TG, name="Cancelling provider", is_active=True)
+            provider.services.append(database.Service(name="Cancelled service", duration_minutes=60, price=100.0))
+            db.add(provider)
+            db.flush()
+        provider.is_active = True
+        service_id = provider.services[0].service_id
+        capacity = max(1, bookings // CANCEL_DAY_SLOTS)
+        start = to_ts(day.replace(hour=9))
+        for n in range(CANCEL_DAY_SLOTS):
+            slot = database.TimeSlot(service_id=service_id, start_time=start + n * 3600, end_time=start + n * 3600 + 3600,
+                                     capacity=capacity, booked_seats=capacity, is_available=False)
+            db.add(slot)
+            db.flush()
+            db.execute(insert(database.Booking), [
+                {"slot_id": slot.slot_id, "client_telegram_id": next(ds.new_ids), "status": "confirmed"}
+                for _ in range(capacity)
+            ])
+        db.commit()
+
+
+async def run_cancel_day(ds: Dataset, args) -> int:
+    """Отмена дня с сотнями броней: /cancel_day против /cancel_booking_provider по одной брони.
+
+    Код выхода 1, если число запросов /cancel_day растет с числом броней (отмена снова пошла по одной).
+    """
+    from sqlalchemy import func
+    import handlers_bulk_cancel
+    import handlers_provider
+    database = ds.db_module
+    counter = QueryCounter(database.engine)
+
+    def no_tasks(coroutine, name=None): # Рассылку уведомлений бенчмарк не запускает - только ставит в очередь
+        coroutine.close()
+
+    print(f"{'bookings':>9}{'bulk queries':>14}{'bulk ms':>10}{'queued':>8}"
+          f"{'one-by-one queries':>20}{'one-by-one ms':>15}{'sent inline':>13}")
+    bulk_counts = []
+    for n, bookings in enumerate(CANCEL_DAY_SIZES):
+        day = datetime.now().replace(minute=0, second=0, microsecond=0) + timedelta(days=400 + n)
+
+        seed_cancel_day(ds, day, bookings)
+        update, context, calls = make_command(CANCEL_PROVIDER_TG, "/cancel_day", [day.strftime("%Y-%m-%d")])
+        context.application = SimpleNamespace(create_task=no_tasks)
+        counter.count = 0
+        started = time.perf_counter()
+        await run_handler(handlers_bulk_cancel.cancel_day, update, context)
+        bulk_ms = (time.perf_counter() - started) * 1000
+        bulk_queries = counter.count
+        bulk_counts.append(bulk_queries)
+        with database.SessionLocal() as db:
+            queued = db.query(func.count()).select_from(database.BroadcastRecipient).filter(
+                database.BroadcastRecipient.broadcast_id == db.query(func.max(database.Broadcast.broadcast_id)).scalar_subquery()
+            ).scalar()
+
+        seed_cancel_day(ds, day, bookings)
+        with database.SessionLocal() as db:
+            booking_ids = [booking_id for (booking_id,) in db.query(database.Booking.booking_id)
+                           .join(database.TimeSlot).join(database.Service).join(database.Provider)
+                           .filter(database.Provider.telegram_id == CANCEL_PROVIDER_TG)]
+        counter.count = 0
+        sent = 0
+        started = time.perf_counter()
+        for booking_id in booking_ids:
+            update, context, calls = make_command(CANCEL_PROVIDER_TG, "/cancel_booking_provider", [str(booking_id)])
+            await run_handler(handlers_provider.cancel_booking_provider, update, context)
+            sent += sum(name == "send_message" for name, _, _ in calls)
+        single_ms = (time.perf_counter() - started) * 1000
+        print(f"{len(booking_ids):>9}{bulk_queries:>14}{bulk_ms:>10.1f}{queued:>8}"
+              f"{counter.count:>20}{single_ms:>15.1f}{sent:>13}")
+
+        with database.SessionLocal() as db: # Освобожденные слоты дня больше не нужны
+            db.query(database.TimeSlot).filter(database.TimeSlot.slot_id.in_(
+                db.query(database.TimeSlot.slot_id).join(database.Service).join(database.Provider)
+                .filter(database.Provider.telegram_id == CANCEL_PROVIDER_TG).scalar_subquery()
+            )).delete(synchronize_session=False)
+            db.commit()
+
+    if len(set(bulk_counts)) > 1:
+        print(f"REGRESSION /cancel_day queries depend on bookings: "
+              + ", ".join(f"{size}: {count}" for size, count in zip(CANCEL_DAY_SIZES, bulk_counts)))
+        return 1
+    return 0
+
+
+def ensure_wide_provider(ds: Dataset) -> tuple[int, int]:
+    """Поставщик с WIDE_SERVICES услугами с длинным описанием, по слоту на услугу; все слоты забронированы
+    одним клиентом WIDE_CLIENT_TG. Возвращает (provider_id, telegram_id клиента)."""
+    from sqlalchemy import insert
+    database = ds.db_module
+    with database.SessionLocal() as db:
+        provider = db.query(database.Provider).filter(database.Provider.telegram_id == WIDE_PROVIDER_TG).first()
+        if provider is None:
+            provider = database.Provider(telegram_id=WIDE_PROVIDER_TG, name="Wide provider", is_active=True)
+            db.add(provider)
+            db.flush()
+            start = to_ts(datetime.now().replace(hour=10, minute=0, second=0, microsecond=0) + timedelta(days=2))
+            for n in range(WIDE_SERVICES):
+                service = database.Service(provider_id=provider.provider_id, name=f"Wide service {n:03d}",
+                                           description=f"Подробное описание услуги {n}. " * 80, duration_minutes=60, price=500.0)
+                db.add(service)
+                db.flush()
+                slot = database.TimeSlot(service_id=service.service_id, start_time=start + n * 3600, end_time=start + n * 3600 + 3600,
+                                         is_available=False, booked_seats=1)
+                db.add(slot)
+                db.flush()
+                db.execute(insert(database.Booking), [{"slot_id": slot.slot_id, "client_telegram_id": WIDE_CLIENT_TG}])
+            db.commit()
+        return provider.provider_id, WIDE_CLIENT_TG
+
+
+def run_projections(ds: Dataset, args) -> int:
+    """Загрузка списков: экземпляры ORM (как было) против проекций read_models.py. Время и память на элемент."""
+    import read_models
+    from sqlalchemy.orm import contains_eager, selectinload, undefer
+    database = ds.db_module
+    from database import DEFAULT_TENANT, Provider, Service, TimeSlot, Booking
+    provider_id, client_id = ensure_wide_provider(ds)
+
+    def orm_catalog(db):
+        rows = db.query(Service, Provider.name).join(Provider, Service.provider_id == Provider.provider_id)\
+            .options(undefer(Service.description))\
+            .filter(Provider.tenant == DEFAULT_TENANT, Provider.is_active == True)\
+            .order_by(Provider.name, Service.name).all()
+        return [(service, name, service.description[:100] if service.description else None) for service, name in rows]
+
+    def orm_services(db):
+        return db.query(Service).options(undefer(Service.description)).filter(Service.provider_id == provider_id).all()
+
+    def orm_slots(db):
+        slots = db.query(TimeSlot).join(Service)\
+            .options(contains_eager(TimeSlot.service), selectinload(TimeSlot.bookings))\
+            .filter(Service.provider_id == provider_id).order_by(TimeSlot.start_time).all()
+        return [(slot, slot.service.name, slot.bookings) for slot in slots]
+
+    def orm_bookings(db):
+        bookings = db.query(Booking).join(Booking.slot).join(TimeSlot.service).join(Service.provider)\
+            .options(contains_eager(Booking.slot).contains_eager(TimeSlot.service).contains_eager(Service.provider))\
+            .filter(Booking.client_telegram_id == client_id, Booking.status == "confirmed",
+                    TimeSlot.start_time > now_ts(), Provider.tenant == DEFAULT_TENANT)\
+            .order_by(TimeSlot.start_time).all()
+        return [(booking, booking.slot.service.name, booking.slot.service.provider.name) for booking in bookings]
+
+    cases = {
+        "catalog (/services)": (orm_catalog, lambda db: read_models.catalog_services(db, DEFAULT_TENANT)),
+        "my_services": (orm_services, lambda db: read_models.provider_services(db, provider_id, "Wide provider")),
+        "my_slots": (orm_slots, lambda db: read_models.provider_slots(db, provider_id)),
+        "my_bookings": (orm_bookings, lambda db: read_models.client_bookings(db, client_id, DEFAULT_TENANT, now_ts())),
+    }
+
+    def measure_loader(loader) -> tuple[int, float, float]:
+        timings = []
+        for _ in range(args.iterations):
+            with database.SessionLocal() as db: # Пустая identity map, как у сессии апдейта
+                started = time.perf_counter()
+                items = len(loader(db))
+                timings.append(time.perf_counter() - started)
+        with database.SessionLocal() as db:
+            tracemalloc.start()
+            result = loader(db)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            del result
+        return items, statistics.median(timings) / items * 1e6, peak / items
+
+    print(f"{'list':<22}{'items':>7}{'ORM us/item':>13}{'rows us/item':>14}{'ORM B/item':>12}{'rows B/item':>13}")
+    for name, (orm_loader, projection_loader) in cases.items():
+        items, orm_us, orm_bytes = measure_loader(orm_loader)
+        _, rows_us, rows_bytes = measure_loader(projection_loader)
+        print(f"{name:<22}{items:>7}{orm_us:>13.2f}{rows_us:>14.2f}{orm_bytes:>12.0f}{rows_bytes:>13.0f}")
+    return 0
+
+
+async def check_navigation(ds: Dataset) -> None:
+    """Назад -> Вперед -> Назад и повторный просмотр слотов в пределах CALLBACK_RESULT_TTL: каждое нажатие перерисовывает сообщение."""
+    import handlers_client
+    from database import DEFAULT_TENANT
+    from nav_cache import NavView
+    client_id = next(ds.new_ids)
+    catalog_text = "<b>Доступные услуги для бронирования:</b>\n\nУслуга\n"
+    handlers_client.navigation.push((DEFAULT_TENANT, client_id), 1, NavView(catalog_text, ()))
+    service_id = ds.random_service_id()
+
+    screens = []
+    for data in (f"view_slots_{service_id}", "nav_0", "nav_1", "nav_0", "nav_1", f"view_slots_{service_id}"):
+        update, context, calls = make_callback(client_id, data, message_id=1)
+        await run_handler(handlers_client.button_callback_handler, update, context)
+        edits = [kwargs["text"] for name, _, kwargs in calls if name == "edit_message_text"]
+        assert len(edits) == 1, f"{data}: {len(edits)} edit_message_text, expected 1"
+        screens.append(edits[0])
+    slots_text = screens[0]
+    assert slots_text != catalog_text, "view_slots shows the catalog"
+    expected = [slots_text, catalog_text, slots_text, catalog_text, slots_text, slots_text]
+    assert screens == expected, f"screens after presses differ: {[text[:30] for text in screens]}"
+
+
+async def check_my_slots_cancelled(ds: Dataset) -> None:
+    """Отмененная бронь (строка cancelled_by_client из старой базы) на свободном слоте не показывается в /my_slots."""
+    import handlers_provider
+    database = ds.db_module
+    slot_id = ds.free_slot_id()
+    client_id = next(ds.new_ids)
+    with database.SessionLocal() as db:
+        provider_tg = db.query(database.Provider.telegram_id).join(database.Service).join(database.TimeSlot)\
+            .filter(database.TimeSlot.slot_id == slot_id).scalar()
+        booking = database.Booking(slot_id=slot_id, client_telegram_id=client_id, status="cancelled_by_client")
+        db.add(booking)
+        db.commit()
+        booking_id = booking.booking_id
+    try:
+        update, context, calls = make_command(provider_tg, "/my_slots", [])
+        await run_handler(handlers_provider.my_slots, update, context)
+        assert not _has_error(calls), f"/my_slots failed: {calls[:1]}"
+        text = "".join(args[0] for name, args, _ in calls if name == "reply_text")
+        assert str(client_id) not in text, f"/my_slots shows cancelled booking {booking_id} of client {client_id}"
+    finally:
+        with database.SessionLocal() as db:
+            db.query(database.Booking).filter(database.Booking.booking_id == booking_id).delete()
+            db.commit()
+
+
+async def check_cancel_day_cancelled(ds: Dataset) -> None:
+    """/cancel_day не считает отменой и не уведомляет клиентов броней, уже отмененных в старой базе (cancelled_by_*)."""
+    from sqlalchemy import func
+    import handlers_bulk_cancel
+    database = ds.db_module
+    day = datetime.now().replace(minute=0, second=0, microsecond=0) + timedelta(days=500)
+    seed_cancel_day(ds, day, CANCEL_DAY_SLOTS) # По одной подтвержденной брони на слот
+    legacy_client = next(ds.new_ids)
+    with database.SessionLocal() as db:
+        slot_id = db.query(func.max(database.TimeSlot.slot_id)).scalar()
+        db.add(database.Booking(slot_id=slot_id, client_telegram_id=legacy_client, status="cancelled_by_client"))
+        db.commit()
+
+    update, context, calls = make_command(CANCEL_PROVIDER_TG, "/cancel_day", [day.strftime("%Y-%m-%d")])
+    context.application = SimpleNamespace(create_task=lambda coroutine, name=None: coroutine.close())
+    await run_handler(handlers_bulk_cancel.cancel_day, update, context)
+    assert not _has_error(calls), f"/cancel_day failed: {calls[:1]}"
+    text = "".join(args[0] for name, args, _ in calls if name == "reply_text")
+    assert f"отменено бронирований - {CANCEL_DAY_SLOTS}," in text, f"unexpected summary: {text[:80]!r}"
+    with database.SessionLocal() as db:
+        recipients = {client for (client,) in db.query(database.BroadcastRecipient.client_telegram_id).filter(
+            database.BroadcastRecipient.broadcast_id == db.query(func.max(database.Broadcast.broadcast_id)).scalar_subquery()
+        )}
+        left = db.query(func.count()).select_from(database.Booking).filter(database.Booking.slot_id == slot_id).scalar()
+    assert legacy_client not in recipients, "client of an already cancelled booking is notified again"
+    assert len(recipients) == CANCEL_DAY_SLOTS, f"{len(recipients)} recipients, expected {CANCEL_DAY_SLOTS}"
+    assert left == 0, f"{left} booking rows still reference the removed slot"
+
+
+async def check_rebook_after_cancel(ds: Dataset) -> None:
+    """Клиент, чья бронь слота отменена в старой базе (строка cancelled_by_client, схема v7), снова записывается на этот слот."""
+    import handlers_client
+    database = ds.db_module
+    slot_id = ds.free_slot_id()
+    client_id = next(ds.new_ids)
+    with database.SessionLocal() as db:
+        db.add(database.Booking(slot_id=slot_id, client_telegram_id=client_id, status="cancelled_by_client"))
+        db.commit()
+    with database.engine.begin() as conn:
+        conn.exec_driver_sql("PRAGMA user_version = 7")
+    assert database.ensure_schema(), "schema v7 was not migrated"
+
+    update, context, calls = make_callback(client_id, f"book_slot_{slot_id}")
+    await run_handler(handlers_client.button_callback_handler, update, context)
+    text = "".join(kwargs.get("text", "") for name, _, kwargs in calls if name == "edit_message_text")
+    assert "успешно забронировали" in text, f"booking after a cancelled booking failed: {text[:80]!r}"
+
+
+async def check_export_cancelled(ds: Dataset) -> None:
+    """Свободный слот с отмененной бронью из старой базы выгружается без брони (в .ics - TRANSPARENT, без клиента)."""
+    import handlers_export
+    database = ds.db_module
+    slot_id = ds.free_slot_id()
+    with database.SessionLocal() as db:
+        provider_id, start_time = db.query(database.Service.provider_id, database.TimeSlot.start_time)\
+            .join(database.TimeSlot).filter(database.TimeSlot.slot_id == slot_id).one()
+        booking = database.Booking(slot_id=slot_id, client_telegram_id=next(ds.new_ids), status="cancelled_by_client")
+        db.add(booking)
+        db.commit()
+        booking_id = booking.booking_id
+    try:
+        day = datetime.fromtimestamp(start_time).replace(hour=0, minute=0, second=0)
+        with database.SessionLocal() as db:
+            rows = [row for row in handlers_export.iter_schedule_rows(db, provider_id, day, day + timedelta(days=1))
+                    if row.slot_id == slot_id]
+        assert len(rows) == 1, f"{len(rows)} export rows for slot {slot_id}, expected 1"
+        assert rows[0].booking_id is None, f"slot {slot_id} is exported with cancelled booking {rows[0].booking_id}"
+    finally:
+        with database.SessionLocal() as db:
+            db.query(database.Booking).filter(database.Booking.booking_id == booking_id).delete()
+            db.commit()
+
+
+async def check_import_off_loop(ds: Dataset) -> None:
+    """Импорт JSON-документа добавляет услуги и слоты, а event loop продолжает работать, пока файл разбирается."""
+    import handlers_import
+    database = ds.db_module
+    provider_tg = PROVIDER_TG_BASE
+    prefix = f"Import check {next(ds.new_ids)}"
+    services, slots_per_service = 100, 60
+    start = datetime.now().replace(minute=0, second=0, microsecond=0) + timedelta(days=700)
+    rows = [{"type": "service", "name": f"{prefix} {n}", "duration_minutes": 30, "price": 100} for n in range(services)]
+    rows += [{"type": "slot", "service": f"{prefix} {n}", "start": (start + timedelta(hours=k)).strftime("%Y-%m-%d %H:%M")}
+             for n in range(services) for k in range(slots_per_service)]
+    payload = json.dumps(rows).encode()
+
+    async def download_to_memory(out):
+        out.write(payload)
+
+    update, context, calls = make_command(provider_tg, "", [])
+    update.message.document = SimpleNamespace(file_name="import.json", file_size=len(payload),
+                                              get_file=lambda: asyncio.sleep(0, SimpleNamespace(download_to_memory=download_to_memory)))
+    ticks, max_gap = 0, 0.0
+    done = asyncio.Event()
+
+    async def ticker():
+        nonlocal ticks, max_gap
+        last = time.perf_counter()
+        while not done.is_set():
+            await asyncio.sleep(0.005)
+            now = time.perf_counter()
+            ticks, max_gap = ticks + 1, max(max_gap, now - last)
+            last = now
+
+    ticking = asyncio.create_task(ticker())
+    started = time.perf_counter()
+    try:
+        await run_handler(handlers_import.import_document, update, context)
+        elapsed = time.perf_counter() - started
+        done.set()
+        await ticking
+        replies = [args[0] if args else kwargs.get("text") for name, args, kwargs in calls if name == "reply_text"]
+        assert replies and f"Добавлено услуг: {services}" in replies[-1] and f"Добавлено слотов: {services * slots_per_service}" in replies[-1], \
+            f"unexpected import reply {replies}"
+        # Импорт в event loop дал бы один разрыв длиной во весь импорт
+        assert max_gap < max(0.1, elapsed / 2), f"event loop stalled for {max_gap * 1000:.0f} ms of a {elapsed * 1000:.0f} ms import"
+    finally:
+        done.set()
+        with database.SessionLocal() as db:
+            service_ids = [service_id for (service_id,) in db.query(database.Service.service_id)
+                           .filter(database.Service.name.like(f"{prefix} %"))]
+            db.query(database.TimeSlot).filter(database.TimeSlot.service_id.in_(service_ids)).delete(synchronize_session=False)
+            db.query(database.Service).filter(database.Service.service_id.in_(service_ids)).delete(synchronize_session=False)
+            db.commit()
+
+
+async def check_read_pool(ds: Dataset) -> None:
+    """Одновременные апдейты двух ботов держат сессии через await и читают из потока, не ожидая соединения пула.
+
+    При нехватке соединений выдача из пула блокирует event loop до pool_timeout (30 с) и падает с TimeoutError.
+    """
+    import logging
+    from sqlalchemy import select
+    from sqlalchemy.exc import TimeoutError as PoolTimeout
+    import main as bot_main
+    from db_access import UnitOfWork, get_read_db
+    logging.getLogger().setLevel(logging.ERROR)
+    bots = 2
+    updates = bots * bot_main.concurrent_updates()
+
+    def read_in_thread():
+        db = next(get_read_db())
+        try:
+            db.execute(select(1))
+        finally:
+            db.close()
+
+    async def update():
+        uow = UnitOfWork()
+        try:
+            uow.session.execute(select(1)) # Соединение занято до конца апдейта
+            await asyncio.sleep(0.05)
+            await asyncio.to_thread(read_in_thread) # Как выгрузка расписания
+            await asyncio.sleep(0.05)
+        finally:
+            uow.finish()
+
+    await bot_main.start_process(bots)
+    try:
+        started = time.perf_counter()
+        try:
+            await asyncio.gather(*(update() for _ in range(updates)))
+        except PoolTimeout as e:
+            raise AssertionError(f"{updates} concurrent updates exhausted the read pool: {e}")
+        elapsed = time.perf_counter() - started
+        assert elapsed < 5, f"{updates} concurrent updates took {elapsed:.1f}s (waited for pool connections)"
+    finally:
+        await bot_main.stop_process()
+
+
+CHECKS = {
+    "navigation": check_navigation,
+    "my_slots_cancelled": check_my_slots_cancelled,
+    "read_pool": check_read_pool,
+    "cancel_day_cancelled": check_cancel_day_cancelled,
+    "rebook_after_cancel": check_rebook_after_cancel,
+    "export_cancelled": check_export_cancelled,
+    "import_off_loop": check_import_off_loop,
+}
+
+
+async def run_checks(ds: Dataset, args) -> int:
+    """Функциональные проверки поверх сгенерированной базы; код выхода 1, если какая-то не прошла."""
+    names = args.only.split(",") if args.only else list(CHECKS)
+    failed = 0
+    for name in names:
+        try:
+            await CHECKS[name](ds)
+        except AssertionError as e:
+            failed += 1
+            print(f"FAIL {name}: {e}")
+        else:
+            print(f"ok   {name}")
+    return 1 if failed else 0
+
+
+def run_logging(args) -> int:
+    """Стоимость строки лога для вызывающего кода: синхронный StreamHandler против очереди log_setup."""
+    import logging
+    import tempfile
+    from log_setup import setup_logging
+
+    root = logging.getLogger()
+    saved_handlers, saved_level = list(root.handlers), root.level
+    bench_logger = logging.getLogger("handlers_client.views")
+    calls = args.iterations * 500
+    print(f"{calls} log lines to a file")
+    print(f"{'pipeline':<12}{'us/call':>10}")
+    with tempfile.TemporaryFile("w+", encoding="utf-8") as target:
+        for mode in ("sync", "queue"):
+            for handler in list(root.handlers):
+                root.removeHandler(handler)
+            listener = None
+            if mode == "sync": # Как было: logging.basicConfig с форматированием на месте
+                handler = logging.StreamHandler(target)
+                handler.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+                root.addHandler(handler)
+                root.setLevel(logging.INFO)
+            else:
+                listener = setup_logging(logging.INFO, stream=target)
+
+            started = time.perf_counter()
+            for n in range(calls):
+                bench_logger.info("User %s viewed slots for service %s", CLIENT_TG_BASE + n, n % 1000)
+            elapsed = time.perf_counter() - started
+            if listener:
+                listener.stop()
+            print(f"{mode:<12}{elapsed / calls * 1e6:>10.2f}")
+
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for handler in saved_handlers:
+        root.addHandler(handler)
+    root.setLevel(saved_level)
+    return 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Микробенчмарки хендлеров BookBotBoss.")
+    parser.add_argument("--preset", choices=PRESETS, default="small")
+    parser.add_argument("--providers", type=int)
+    parser.add_argument("--services", type=int)
+    parser.add_argument("--slots", type=int)
+    parser.add_argument("--db", help="Файл SQLite для данных бенчмарка (по умолчанию зависит от масштаба)")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--only", help="Список сценариев через запятую")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="Допустимый рост пиковой памяти (доля)")
+    parser.add_argument("--time-tolerance", type=float, default=0.5,
+                        help="Допустимый рост времени (доля) после поправки на скорость машины")
+    parser.add_argument("--write-burst", action="store_true",
+                        help="Вместо сценариев сравнить задержку чтений во время всплеска записей (shared vs single writer)")
+    parser.add_argument("--writers", type=int, default=8, help="Параллельных писателей/клиентов в --write-burst и --group-commit")
+    parser.add_argument("--group-commit", action="store_true",
+                        help="Вместо сценариев сравнить число бронирований в секунду с групповым commit и без")
+    parser.add_argument("--group-commit-ms", type=float, default=5.0)
+    parser.add_argument("--period-ms", type=float, default=5.0, help="Период запуска чтений в --write-burst")
+    parser.add_argument("--logging", action="store_true",
+                        help="Вместо сценариев сравнить стоимость строки лога: синхронный вывод и очередь")
+    parser.add_argument("--inline", action="store_true",
+                        help="Вместо сценариев сравнить inline-поиск по индексу в памяти и LIKE-запросом")
+    parser.add_argument("--virtual-slots", action="store_true",
+                        help="Вместо сценариев сравнить слоты строками и слоты по правилам расписания")
+    parser.add_argument("--group-slots", action="store_true",
+                        help="Вместо сценариев сравнить групповое занятие копиями слота и одной строкой с местами")
+    parser.add_argument("--cancel-day", action="store_true",
+                        help="Вместо сценариев сравнить отмену дня с сотнями броней одной командой и по одной брони")
+    parser.add_argument("--checks", action="store_true",
+                        help="Вместо сценариев выполнить функциональные проверки (--only - список проверок)")
+    parser.add_argument("--projections", action="store_true",
+                        help="Вместо сценариев сравнить загрузку списков экземплярами ORM и проекциями (время и память на элемент)")
+    parser.add_argument("--multibot", type=int, metavar="N",
+                        help="Вместо сценариев сравнить N ботов в отдельных процессах и в одном процессе (память, CPU)")
+    parser.add_argument("--multibot-child", help=argparse.SUPPRESS) # Арендаторы дочернего процесса --multibot
+    parser.add_argument("--cold-start", action="store_true",
+                        help="Вместо сценариев замерить холодный старт бота до первого обработанного апдейта (--iterations запусков)")
+    parser.add_argument("--cold-start-child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--time-columns", action="store_true",
+                        help="Вместо сценариев сравнить хранение времени текстом и целыми секундами epoch")
+    return parser.parse_args(argv)
+
+
+async def run(args) -> int:
+    providers, services, slots = PRESETS[args.preset]
+    providers = args.providers or providers
+    services = args.services or services
+    slots = args.slots or slots
+
+    if args.time_columns:
+        return run_time_columns(args, slots)
+    if args.logging:
+        return run_logging(args)
+    if args.multibot_child:
+        return await run_multibot_child(args)
+    if args.cold_start_child:
+        return await run_cold_start_child(args)
+
+    ds = Dataset(providers, services, slots)
+    ds.seed()
+    if args.write_burst:
+        return await run_write_burst(ds, args)
+    if args.group_commit:
+        return await run_group_commit(ds, args)
+    if args.inline:
+        return run_inline(ds, args)
+    if args.virtual_slots:
+        return await run_virtual_slots(ds, args)
+    if args.group_slots:
+        return await run_group_slots(ds, args)
+    if args.cancel_day:
+        return await run_cancel_day(ds, args)
+    if args.checks:
+        return await run_checks(ds, args)
+    if args.projections:
+        return run_projections(ds, args)
+    if args.multibot:
+        return run_multibot(ds, args)
+    if args.cold_start:
+        return run_cold_start(ds, args)
+    counter = QueryCounter(ds.db_module.engine)
+    # Сценарии меняют базу (услуги, слоты, брони); без отката каждый следующий прогон мерил бы
+    # другую базу и расходился с базовым прогоном
+    snapshot_path = copy_database(args.db_path, f"{args.db_path}-snapshot")
+    try:
+        scenarios = build_scenarios(ds)
+        if args.only:
+            scenarios = {name: scenarios[name] for name in args.only.split(",")}
+
+        results = {}
+        print(f"{'scenario':<26}{'median ms':>11}{'p95 ms':>10}{'queries':>9}{'peak KiB':>10}{'errors':>8}")
+        for name, setup in scenarios.items():
+            calibration_ms = calibrate()
+            result = await measure(setup, args.iterations, counter)
+            result["calibration_ms"] = round((calibration_ms + calibrate()) / 2, 3)
+            results[name] = result
+            print(f"{name:<26}{result['median_ms']:>11}{result['p95_ms']:>10}{result['queries']:>9}"
+                  f"{result['peak_kib']:>10}{result['errors']:>8}")
+    finally:
+        ds.db_module.engine.dispose()
+        copy_database(snapshot_path, args.db_path)
+        os.remove(snapshot_path)
+
+    dataset = [providers, services, slots]
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"dataset": dataset, "scenarios": results}, f, indent=2, ensure_ascii=False)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    # Без базового прогона сравнивать не с чем - это ошибка, а не успех (иначе проверка в CI всегда проходит)
+    if not os.path.exists(args.baseline):
+        print(f"ERROR no baseline at {args.baseline}; run with --update-baseline to create one.")
+        return 1
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("dataset") != dataset:
+        print(f"ERROR baseline {args.baseline} was recorded on dataset {baseline.get('dataset')}, not {dataset}; "
+              f"use the same --preset/--providers/--services/--slots or --update-baseline.")
+        return 1
+    regressions = compare(results, baseline["scenarios"], args.tolerance, args.time_tolerance)
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    return 1 if regressions else 0
+
+
+def copy_database(source: str, target: str) -> str:
+    """Копирует SQLite базу через backup API (корректно и для базы в режиме WAL). Возвращает target."""
+    import sqlite3
+    with sqlite3.connect(source) as src, sqlite3.connect(target) as dst:
+        src.backup(dst)
+    src.close()
+    dst.close()
+    return target
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    scale = PRESETS[args.preset]
+    db_path = args.db or "bench_{}_{}_{}.db".format(args.providers or scale[0], args.services or scale[1], args.slots or scale[2])
+    # URL нужно задать до первого импорта database.py
+    os.environ["BOOKING_BOT_DATABASE_URL"] = f"sqlite:///{db_path}"
+    args.db_path = db_path
+    import logging
+    logging.basicConfig(level=logging.ERROR)
+    return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
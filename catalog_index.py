@@ -0,0 +1,75 @@
+# catalog_index.py
+import re
+from typing import NamedTuple
+
+MAX_PREFIX_LENGTH = 12 # Префиксы длиннее хранятся обрезанными; остаток слова проверяется при поиске
+
+_WORD_RE = re.compile(r"\w+")
+
+
+class CatalogEntry(NamedTuple):
+    service_id: int
+    name: str
+    provider_name: str
+    duration_minutes: int
+    price: float | None
+
+
+def tokenize(text: str) -> list[str]:
+    """Слова текста в нижнем регистре (ё приравнивается к е)."""
+    return _WORD_RE.findall(text.lower().replace("ё", "е"))
+
+
+class CatalogIndex:
+    """Префиксный индекс по названиям услуг и именам поставщиков, целиком в памяти процесса.
+
+    Каждое слово названия раскладывается на префиксы (до MAX_PREFIX_LENGTH символов), префикс
+    указывает на множество позиций записей. Поиск - пересечение множеств по словам запроса,
+    так что каждое нажатие клавиши в inline-режиме обходится без обращения к БД.
+    Записи упорядочены по названию услуги, позиции в результате - тоже.
+    """
+
+    def __init__(self, entries):
+        self.entries = sorted(entries, key=lambda entry: (entry.name.lower(), entry.provider_name.lower()))
+        self._words = [] # позиция -> слова записи (для слов запроса длиннее MAX_PREFIX_LENGTH)
+        self._prefixes = {} # префикс -> set позиций
+        for position, entry in enumerate(self.entries):
+            words = tuple(set(tokenize(entry.name) + tokenize(entry.provider_name)))
+            self._words.append(words)
+            for word in words:
+                for length in range(1, min(len(word), MAX_PREFIX_LENGTH) + 1):
+                    self._prefixes.setdefault(word[:length], set()).add(position)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _positions(self, query: str) -> list[int] | range:
+        words = tokenize(query)
+        if not words:
+            return range(len(self.entries))
+
+        # Начинаем с самого редкого префикса, чтобы пересекаемые множества были меньше
+        candidates = sorted((self._prefixes.get(word[:MAX_PREFIX_LENGTH], set()) for word in words), key=len)
+        positions = set(candidates[0])
+        for other in candidates[1:]:
+            positions &= other
+            if not positions:
+                return []
+
+        long_words = [word for word in words if len(word) > MAX_PREFIX_LENGTH]
+        if long_words:
+            positions = {
+                position for position in positions
+                if all(any(own.startswith(word) for own in self._words[position]) for word in long_words)
+            }
+        return sorted(positions)
+
+    def search(self, query: str, offset: int = 0, limit: int = 20) -> tuple[list[CatalogEntry], int | None]:
+        """Записи, в которых каждое слово запроса - начало какого-либо слова.
+
+        Возвращает (страница записей, смещение следующей страницы или None).
+        """
+        positions = self._positions(query)
+        page = [self.entries[position] for position in positions[offset:offset + limit]]
+        next_offset = offset + limit if offset + limit < len(positions) else None
+        return page, next_offset
@@ -1,2 +1,33 @@
 # config.py
-BOT_TOKEN = "ВАШ_АКТУАЛЬНЫЙ_ТОКЕН_ТЕЛЕГРАМ_БОТА"
\ No newline at end of file
+BOT_TOKEN = "ВАШ_АКТУАЛЬНЫЙ_ТОКЕН_ТЕЛЕГРАМ_БОТА"
+
+# Необязательно: несколько брендированных ботов в одном процессе (python multibot.py).
+# У каждого бота свой арендатор: поставщики, услуги и брони одного арендатора не видны ботам других.
+# Бот из BOT_TOKEN (python main.py) работает с арендатором "default".
+# BOTS = [
+#     {"token": "ТОКЕН_ПЕРВОГО_БОТА", "tenant": "default"},
+#     {"token": "ТОКЕН_ВТОРОГО_БОТА", "tenant": "salon"},
+# ]
+
+# Необязательно: лимиты защиты от флуда, action -> (емкость, токенов в секунду).
+# action - команда ("/services"), префикс колбека ("book_slot") или "default".
+# RATE_LIMITS = {"default": (10, 1.0), "book_slot": (3, 0.5)}
+
+# Необязательно: режим single writer для SQLite - все изменения выполняет одна задача-писатель
+# через очередь, а чтения обслуживает отдельный пул соединений только для чтения.
+# SINGLE_WRITER = True
+# READ_POOL_SIZE = 5 # Минимум; пул увеличивается под одновременные апдейты всех ботов
+
+# Необязательно: групповой commit - бронирования и отмены, накопившиеся в очереди писателя,
+# фиксируются одной транзакцией; окно (мс) - наибольшее время добора группы, одиночная запись
+# его не ждет. Включает и очередь писателя (как SINGLE_WRITER).
+# GROUP_COMMIT_MS = 5
+
+# Необязательно: сколько апдейтов каждый бот обрабатывает одновременно (по умолчанию 4).
+# Пул соединений чтения рассчитывается по этому значению и числу ботов автоматически.
+# CONCURRENT_UPDATES = 4
+
+# Необязательно: логирование. LOG_SAMPLING - доля пропускаемых записей уровня INFO/DEBUG
+# по логгерам (действует и на дочерние). Предупреждения и ошибки пишутся всегда.
+# LOG_LEVEL = "INFO"
+# LOG_SAMPLING = {"handlers_client.views": 0.1, "handlers_provider.views": 0.1, "updates": 0.05, "httpx": 0.01}
@@ -1,22 +1,33 @@
 # database.py
-import datetime
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, Float, DateTime, ForeignKey, Text
-from sqlalchemy.orm import sessionmaker, relationship
+import os
+from sqlalchemy import create_engine, Column, Integer, String, Boolean, Float, ForeignKey, Text, Index, UniqueConstraint
+from sqlalchemy.orm import sessionmaker, relationship, deferred
 from sqlalchemy.ext.declarative import declarative_base
+from timeutil import now_ts
 
-DATABASE_URL = "sqlite:///./booking_bot.db"  # Файл базы данных будет создан в той же директории
+# Файл базы данных будет создан в той же директории; переменная окружения позволяет
+# подставить другую БД (например, для бенчмарков)
+DATABASE_URL = os.environ.get("BOOKING_BOT_DATABASE_URL", "sqlite:///./booking_bot.db")
 
 engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False}) # check_same_thread for SQLite
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+DEFAULT_TENANT = "default" # Арендатор (брендированный бот) по умолчанию - единственный бот из BOT_TOKEN
+
 # Определяем модели таблиц (сущности из нашего плана)
 
 class Provider(Base):
     __tablename__ = "providers"
+    __table_args__ = (
+        UniqueConstraint("tenant", "telegram_id"), # Один человек может быть поставщиком в нескольких ботах
+    )
 
     provider_id = Column(Integer, primary_key=True, index=True, autoincrement=True)
-    telegram_id = Column(Integer, unique=True, nullable=False, index=True)
+    # Арендатор - бот, через который зарегистрирован поставщик. Услуги, слоты, брони и очереди
+    # принадлежат арендатору через поставщика; клиенты бота видят только его данные.
+    tenant = Column(String, nullable=False, default=DEFAULT_TENANT, index=True)
+    telegram_id = Column(Integer, nullable=False, index=True)
     name = Column(String, nullable=False)
     is_active = Column(Boolean, default=True)
 
@@ -28,41 +39,253 @@ class Service(Base):
     service_id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     provider_id = Column(Integer, ForeignKey("providers.provider_id"), nullable=False)
     name = Column(String, nullable=False)
-    description = Column(Text, nullable=True)
+    description = deferred(Column(Text, nullable=True)) # Широкая колонка: не грузится с услугой, списки берут ее через read_models.py
     duration_minutes = Column(Integer, nullable=False)
     price = Column(Float, nullable=True) # Можно сделать REAL если нужно точнее
 
     provider = relationship("Provider", back_populates="services")
     time_slots = relationship("TimeSlot", back_populates="service", cascade="all, delete-orphan")
+    schedule_rules = relationship("ScheduleRule", back_populates="service", cascade="all, delete-orphan")
+
+# Все моменты времени хранятся целыми секундами UTC epoch (см. timeutil.py):
+# сравнения в SQL идут по числам, а при загрузке строк нет разбора дат.
 
 class TimeSlot(Base):
     __tablename__ = "time_slots"
+    __table_args__ = (
+        Index("ix_time_slots_service_start", "service_id", "start_time"), # Поиск слотов услуги по времени
+    )
 
     slot_id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     service_id = Column(Integer, ForeignKey("services.service_id"), nullable=False)
-    start_time = Column(DateTime, nullable=False)
-    end_time = Column(DateTime, nullable=False) # Рассчитывается при создании
-    is_available = Column(Boolean, default=True)
+    start_time = Column(Integer, nullable=False)
+    end_time = Column(Integer, nullable=False) # Рассчитывается при создании
+    is_available = Column(Boolean, default=True) # Есть свободные места: booked_seats < capacity (см. slot_seats.py)
+    capacity = Column(Integer, default=1, nullable=False) # Мест в слоте; групповое занятие - одна строка
+    booked_seats = Column(Integer, default=0, nullable=False) # Занято мест (брони и удержание для очереди)
 
     service = relationship("Service", back_populates="time_slots")
-    booking = relationship("Booking", back_populates="slot", uselist=False, cascade="all, delete-orphan") # Один слот - одно бронирование
+    bookings = relationship("Booking", back_populates="slot", cascade="all, delete-orphan")
 
 class Booking(Base):
     __tablename__ = "bookings"
+    __table_args__ = (
+        UniqueConstraint("slot_id", "client_telegram_id"), # Одно место в слоте на клиента
+    )
 
     booking_id = Column(Integer, primary_key=True, index=True, autoincrement=True)
-    slot_id = Column(Integer, ForeignKey("time_slots.slot_id"), unique=True, nullable=False) # Слот может быть забронирован только один раз
+    slot_id = Column(Integer, ForeignKey("time_slots.slot_id"), nullable=False, index=True)
+    client_telegram_id = Column(Integer, nullable=False)
+    booking_timestamp = Column(Integer, default=now_ts)
+    status = Column(String, default="confirmed") # 'confirmed'; отмена удаляет бронь (cancelled_by_* - только в БД до v8)
+
+    slot = relationship("TimeSlot", back_populates="bookings")
+
+class WaitlistEntry(Base):
+    __tablename__ = "waitlist_entries"
+    __table_args__ = (
+        # Голова очереди услуги - первая запись по индексу (service_id, status, entry_id)
+        Index("ix_waitlist_queue", "service_id", "status", "entry_id"),
+        UniqueConstraint("service_id", "client_telegram_id"), # Клиент стоит в очереди услуги один раз
+    )
+
+    entry_id = Column(Integer, primary_key=True, autoincrement=True) # Порядок в очереди
+    service_id = Column(Integer, ForeignKey("services.service_id"), nullable=False)
     client_telegram_id = Column(Integer, nullable=False)
-    booking_timestamp = Column(DateTime, default=datetime.datetime.utcnow) # Время по UTC
-    status = Column(String, default="confirmed") # e.g., 'confirmed', 'cancelled_by_client', 'cancelled_by_provider'
+    window_start = Column(Integer, nullable=True) # Окно времени; None - подходит любое время
+    window_end = Column(Integer, nullable=True)
+    status = Column(String, default="waiting", nullable=False) # 'waiting' или 'offered'
+    offered_slot_id = Column(Integer, ForeignKey("time_slots.slot_id"), nullable=True) # Слот, удерживаемый для клиента
+    hold_expires_at = Column(Integer, nullable=True)
+    created_at = Column(Integer, default=now_ts)
+
+    service = relationship("Service")
+    offered_slot = relationship("TimeSlot")
+
+# Правила расписания: свободные слоты по ним вычисляются на лету (virtual_slots.py),
+# а строка TimeSlot появляется только при бронировании
+class ScheduleRule(Base):
+    __tablename__ = "schedule_rules"
+
+    rule_id = Column(Integer, primary_key=True, autoincrement=True)
+    service_id = Column(Integer, ForeignKey("services.service_id"), nullable=False, index=True)
+    kind = Column(String, nullable=False) # 'hours' - рабочее окно, 'break' - перерыв, 'closed' - исключение (выходной)
+    weekday = Column(Integer, nullable=True) # 'hours'/'break': 0 - понедельник ... 6 - воскресенье
+    start_minute = Column(Integer, nullable=True) # 'hours'/'break': окно в минутах от полуночи, местное время
+    end_minute = Column(Integer, nullable=True)
+    start_time = Column(Integer, nullable=True) # 'closed': закрытый интервал, секунды UTC epoch
+    end_time = Column(Integer, nullable=True)
+
+    service = relationship("Service", back_populates="schedule_rules")
+
+class Broadcast(Base):
+    __tablename__ = "broadcasts"
+
+    broadcast_id = Column(Integer, primary_key=True, autoincrement=True)
+    provider_id = Column(Integer, ForeignKey("providers.provider_id"), nullable=False, index=True)
+    text = Column(Text, nullable=False) # Готовый HTML-текст рассылки
+    status = Column(String, default="running", nullable=False) # 'running' или 'done'
+    progress_message_id = Column(Integer, nullable=True) # Сообщение поставщику с прогрессом
+    created_at = Column(Integer, default=now_ts)
+
+class BroadcastRecipient(Base):
+    __tablename__ = "broadcast_recipients"
+    __table_args__ = (
+        Index("ix_broadcast_recipients_status", "broadcast_id", "status"), # Выборка еще не отправленных
+    )
+
+    broadcast_id = Column(Integer, ForeignKey("broadcasts.broadcast_id"), primary_key=True)
+    client_telegram_id = Column(Integer, primary_key=True)
+    status = Column(String, default="pending", nullable=False) # 'pending', 'sent' или 'failed'
+    error = Column(String, nullable=True)
+
+
+# Версия схемы хранится в самом файле БД (PRAGMA user_version).
+# Увеличивайте ее при любом изменении моделей, чтобы при следующем запуске
+# схема была пересоздана/дополнена. Если существующие данные нужно преобразовать,
+# добавьте шаг в MIGRATIONS под номером новой версии.
+SCHEMA_VERSION = 8 # 2: очередь ожидания (waitlist_entries); 3: время - целые секунды UTC epoch; 4: рассылки;
+                   # 5: правила расписания (schedule_rules); 6: места в слотах (capacity/booked_seats);
+                   # 7: арендаторы (providers.tenant) для нескольких ботов в одном процессе;
+                   # 8: удалены строки отмененных броней (cancelled_by_*)
+
+# Колонки с датой, хранившиеся до версии 3 текстом ISO: (таблица, колонка, текст в UTC?).
+# Время слотов и очереди записывалось как локальное datetime.now(), отметки создания - как utcnow().
+_EPOCH_COLUMNS = [
+    ("time_slots", "start_time", False),
+    ("time_slots", "end_time", False),
+    ("bookings", "booking_timestamp", True),
+    ("waitlist_entries", "window_start", False),
+    ("waitlist_entries", "window_end", False),
+    ("waitlist_entries", "hold_expires_at", False),
+    ("waitlist_entries", "created_at", True),
+]
+
 
-    slot = relationship("TimeSlot", back_populates="booking")
+def _migrate_to_epoch(conn) -> None:
+    """v3: переводит текстовые даты в целые секунды UTC epoch. Уже числовые значения не трогает."""
+    for table, column, stored_as_utc in _EPOCH_COLUMNS:
+        modifier = "" if stored_as_utc else ", 'utc'" # 'utc': значение слева - местное время
+        conn.exec_driver_sql(
+            f"UPDATE {table} SET {column} = CAST(strftime('%s', {column}{modifier}) AS INTEGER) "
+            f"WHERE typeof({column}) = 'text'"
+        )
+    # Индекс для таблицы, созданной до версии 3 (create_all не добавляет индексы в существующие таблицы)
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_time_slots_service_start ON time_slots (service_id, start_time)"
+    )
+
+
+def _migrate_to_seats(conn) -> None:
+    """v6: места в слотах и несколько броней на слот.
+
+    В time_slots добавляются capacity/booked_seats (у существующих слотов одно место, занятое,
+    если слот недоступен - бронью или удержанием для очереди ожидания). У bookings снимается UNIQUE(slot_id):
+    SQLite не умеет удалять ограничения, поэтому таблица пересоздается по текущей модели.
+    Шаги пропускаются, если таблица уже в новом виде (новая БД, созданная create_all).
+    """
+    columns = {row[1] for row in conn.exec_driver_sql("PRAGMA table_info(time_slots)")}
+    if "capacity" not in columns:
+        conn.exec_driver_sql("ALTER TABLE time_slots ADD COLUMN capacity INTEGER NOT NULL DEFAULT 1")
+        conn.exec_driver_sql("ALTER TABLE time_slots ADD COLUMN booked_seats INTEGER NOT NULL DEFAULT 0")
+        # До v6 у слота одно место и is_available = False ровно тогда, когда оно занято бронью или
+        # удержанием. Брони не пересчитываются: в старых БД остались строки отмененных броней (их удаляет v8).
+        conn.exec_driver_sql("UPDATE time_slots SET booked_seats = 1 WHERE is_available = 0")
+
+    unique_on_slot = any(
+        index[2] and [column[2] for column in conn.exec_driver_sql(f"PRAGMA index_info('{index[1]}')")] == ["slot_id"]
+        for index in conn.exec_driver_sql("PRAGMA index_list(bookings)").fetchall()
+    )
+    if unique_on_slot:
+        conn.exec_driver_sql("ALTER TABLE bookings RENAME TO bookings_old")
+        old_indexes = conn.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'bookings_old' AND sql IS NOT NULL"
+        ).fetchall()
+        for (name,) in old_indexes: # Имена индексов нужны новой таблице
+            conn.exec_driver_sql(f"DROP INDEX {name}")
+        Booking.__table__.create(conn)
+        conn.exec_driver_sql(
+            "INSERT INTO bookings (booking_id, slot_id, client_telegram_id, booking_timestamp, status) "
+            "SELECT booking_id, slot_id, client_telegram_id, booking_timestamp, status FROM bookings_old"
+        )
+        conn.exec_driver_sql("DROP TABLE bookings_old")
+
+
+def _migrate_to_tenants(conn) -> None:
+    """v7: колонка tenant у поставщиков, UNIQUE(telegram_id) заменяется на UNIQUE(tenant, telegram_id).
+
+    Существующие поставщики относятся к DEFAULT_TENANT. Таблица пересоздается по текущей модели,
+    как bookings в v6; legacy_alter_table не дает SQLite перенаправить ссылки services на
+    переименованную старую таблицу. Пропускается, если колонка уже есть (новая БД).
+    """
+    columns = {row[1] for row in conn.exec_driver_sql("PRAGMA table_info(providers)")}
+    if "tenant" in columns:
+        return
+    conn.exec_driver_sql("PRAGMA legacy_alter_table = ON")
+    conn.exec_driver_sql("ALTER TABLE providers RENAME TO providers_old")
+    conn.exec_driver_sql("PRAGMA legacy_alter_table = OFF")
+    old_indexes = conn.exec_driver_sql(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'providers_old' AND sql IS NOT NULL"
+    ).fetchall()
+    for (name,) in old_indexes: # Имена индексов нужны новой таблице
+        conn.exec_driver_sql(f"DROP INDEX {name}")
+    Provider.__table__.create(conn)
+    conn.exec_driver_sql(
+        "INSERT INTO providers (provider_id, tenant, telegram_id, name, is_active) "
+        f"SELECT provider_id, '{DEFAULT_TENANT}', telegram_id, name, is_active FROM providers_old"
+    )
+    conn.exec_driver_sql("DROP TABLE providers_old")
+
+
+# Шаги преобразования данных: версия -> функция(conn). Выполняются после create_all
+# для всех версий выше сохраненной в файле.
+def _drop_cancelled_bookings(conn) -> None:
+    """v8: удаляет строки отмененных броней (cancelled_by_*), оставшиеся от старых версий.
+
+    Сейчас отмена удаляет бронь, а UNIQUE(slot_id, client_telegram_id) и проверка в book_slot
+    не смотрят на статус: с такой строкой клиент не смог бы снова записаться на тот же слот.
+    Отдельной версией, а не в v6, чтобы очистились и базы, уже обновленные до v6/v7.
+    """
+    conn.exec_driver_sql("DELETE FROM bookings WHERE status != 'confirmed'")
+
+
+MIGRATIONS = {
+    3: _migrate_to_epoch,
+    6: _migrate_to_seats,
+    7: _migrate_to_tenants,
+    8: _drop_cancelled_bookings,
+}
 
 
 def create_db_tables():
     """Создает все таблицы в базе данных."""
     Base.metadata.create_all(bind=engine)
 
+
+def get_schema_version() -> int:
+    """Возвращает версию схемы, записанную в файле БД (0 для новой БД)."""
+    with engine.connect() as conn:
+        return conn.exec_driver_sql("PRAGMA user_version").scalar() or 0
+
+
+def ensure_schema() -> bool:
+    """Проверяет сохраненную версию схемы и вызывает create_all только при несовпадении.
+
+    create_all отражает (reflect) все таблицы, что заметно замедляет холодный старт,
+    поэтому при актуальной версии схемы запуск обходится одним PRAGMA-запросом.
+    Возвращает True, если схема была создана или обновлена.
+    """
+    stored_version = get_schema_version()
+    if stored_version == SCHEMA_VERSION:
+        return False
+    create_db_tables()
+    with engine.begin() as conn:
+        for version in range(stored_version + 1, SCHEMA_VERSION + 1):
+            if version in MIGRATIONS:
+                MIGRATIONS[version](conn)
+        conn.exec_driver_sql(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    return True
+
 # Удобная функция для получения сессии базы данных
 def get_db():
     db = SessionLocal()
@@ -76,5 +299,5 @@ if __name__ == "__main__":
     # (например, python database.py)
     # Он создаст таблицы в базе данных.
     print("Creating database tables...")
-    create_db_tables()
+    ensure_schema()
     print("Database tables created successfully (if they didn't exist).")
\ No newline at end of file
@@ -0,0 +1,338 @@
+# db_access.py
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session, sessionmaker
+import database
+
+logger = logging.getLogger(__name__)
+
+READ_POOL_SIZE = 5 # Соединений только для чтения в режиме single writer (минимум; см. read_pool_size_for)
+CONNECTIONS_PER_UPDATE = 2 # Сессия апдейта и сессия его фонового потока (выгрузка, перестройка индекса каталога)
+WRITE_QUEUE_SIZE = 1000 # Сколько изменений может ждать в очереди писателя
+GROUP_COMMIT_MAX = 200 # Максимум изменений в одной групповой транзакции
+
+# Режим доступа к данным. По умолчанию чтение и запись идут через общий engine из database.py,
+# как раньше. В режиме single writer все изменения выполняет одна задача-писатель на одном
+# соединении, а чтения обслуживает отдельный пул соединений с PRAGMA query_only.
+_read_session_factory = database.SessionLocal
+_writer = None
+
+
+def read_pool_size_for(concurrent_updates: int, reserve: int = READ_POOL_SIZE) -> int:
+    """Размер пула чтения, при котором concurrent_updates одновременных апдейтов не ждут соединения.
+
+    Сессия апдейта (UnitOfWork) держит соединение до конца апдейта, в том числе через await.
+    Если соединений меньше, выдача соединения из QueuePool блокирует поток event loop до
+    pool_timeout - останавливаются все боты процесса. reserve - соединения для job queue и рассылок.
+    """
+    return concurrent_updates * CONNECTIONS_PER_UPDATE + reserve
+
+
+def _create_read_engine(pool_size: int, query_only: bool):
+    read_engine = create_engine(
+        database.DATABASE_URL, connect_args={"check_same_thread": False},
+        pool_size=pool_size, max_overflow=0
+    )
+    if query_only:
+        event.listen(read_engine, "connect", _set_query_only)
+    return read_engine
+
+
+def configure_read_pool(pool_size: int) -> None:
+    """Отдельный пул на pool_size соединений для сессий чтения в общем режиме (без очереди писателя).
+
+    Пул общего engine (5 + 10 соединений) не зависит от числа ботов и одновременных апдейтов;
+    записи run_write по-прежнему идут через общий engine.
+    """
+    global _read_session_factory
+    reset_read_pool()
+    _read_session_factory = sessionmaker(autocommit=False, autoflush=False, bind=_create_read_engine(pool_size, False))
+    logger.info("Read pool size %s.", pool_size)
+
+
+def reset_read_pool() -> None:
+    """Возвращает чтение на общий engine и закрывает отдельный пул чтения, если он был."""
+    global _read_session_factory
+    read_engine = _read_session_factory.kw.get("bind")
+    _read_session_factory = database.SessionLocal
+    if read_engine is not None and read_engine is not database.engine:
+        read_engine.dispose()
+
+
+def get_read_db():
+    """Сессия для чтения (каталог, слоты, бронирования). Ничего не изменяйте через нее."""
+    db = _read_session_factory()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+class UnitOfWork:
+    """Сессия одного апдейта: открывается лениво при первом обращении и закрывается один раз.
+
+    Хендлеры получают ее через update_session(context), поэтому все обращения к БД за время
+    апдейта идут через одну сессию и ее identity map: повторный db.get() или memo() по уже
+    загруженной сущности не делает запроса. Изменения по-прежнему выполняет run_write.
+    """
+
+    def __init__(self):
+        self._db = None
+        self._memo = {}
+
+    @property
+    def session(self) -> Session:
+        if self._db is None:
+            self._db = _read_session_factory()
+        return self._db
+
+    @property
+    def opened(self) -> bool:
+        return self._db is not None
+
+    def memo(self, key, loader):
+        """Результат loader(session), вычисленный не более одного раза за апдейт."""
+        if key not in self._memo:
+            self._memo[key] = loader(self.session)
+        return self._memo[key]
+
+    def finish(self, failed: bool = False) -> None:
+        """Завершает транзакцию (commit или rollback при ошибке) и закрывает сессию."""
+        self._memo.clear()
+        if self._db is None:
+            return
+        db, self._db = self._db, None
+        try:
+            if failed:
+                db.rollback()
+            else:
+                db.commit()
+        finally:
+            db.close()
+
+
+def unit_of_work(context) -> UnitOfWork:
+    """UnitOfWork текущего апдейта; хранится в контексте хендлера (один на апдейт)."""
+    uow = getattr(context, "unit_of_work", None)
+    if uow is None:
+        uow = context.unit_of_work = UnitOfWork()
+    return uow
+
+
+def update_session(context) -> Session:
+    """Сессия для чтения текущего апдейта (открывается при первом вызове)."""
+    return unit_of_work(context).session
+
+
+def current_tenant(context) -> str:
+    """Арендатор бота, получившего апдейт (bot_data["tenant"] задает multibot.py)."""
+    return context.bot_data.get("tenant", database.DEFAULT_TENANT)
+
+
+def get_active_provider(context, telegram_id: int):
+    """Активный исполнитель по Telegram ID в арендаторе бота; в пределах апдейта загружается один раз."""
+    Provider = database.Provider
+    tenant = current_tenant(context)
+    return unit_of_work(context).memo(
+        ("active_provider", telegram_id),
+        lambda db: db.query(Provider).filter(
+            Provider.tenant == tenant, Provider.telegram_id == telegram_id, Provider.is_active == True
+        ).first(),
+    )
+
+
+def finish_update(context, failed: bool = False) -> None:
+    """Вызывается оберткой хендлера после обработки апдейта."""
+    uow = getattr(context, "unit_of_work", None)
+    if uow is not None:
+        uow.finish(failed)
+
+
+def apply_write(db: Session, func):
+    """Выполняет func(db) в транзакции: commit при успехе, rollback при ошибке."""
+    try:
+        result = func(db)
+        db.commit()
+        return result
+    except Exception:
+        db.rollback()
+        raise
+
+
+async def run_write(func):
+    """Выполняет изменение func(db) и возвращает его результат.
+
+    func получает сессию, делает запросы/изменения и возвращает простые значения
+    (не ORM-объекты: после commit сессия закрывается). Commit делает run_write.
+    """
+    if _writer is not None:
+        return await _writer.submit(func)
+    with database.SessionLocal() as db:
+        return apply_write(db, func)
+
+
+def run_write_from_thread(func, loop: asyncio.AbstractEventLoop):
+    """run_write для кода в рабочем потоке (asyncio.to_thread): ждет результат, блокируя поток, а не event loop.
+
+    В режиме single writer изменение ставится в очередь писателя на loop, писатель остается один.
+    """
+    if _writer is not None:
+        return asyncio.run_coroutine_threadsafe(_writer.submit(func), loop).result()
+    with database.SessionLocal() as db:
+        return apply_write(db, func)
+
+
+def _set_query_only(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA query_only = ON")
+    cursor.close()
+
+
+def _enable_savepoints(engine) -> None:
+    """Рецепт SQLAlchemy для pysqlite: транзакциями управляет SQLAlchemy, иначе SAVEPOINT не работает."""
+    @event.listens_for(engine, "connect")
+    def _disable_pysqlite_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def _emit_begin(conn):
+        conn.exec_driver_sql("BEGIN")
+
+
+class DatabaseWriter:
+    """Единственный писатель SQLite: задачи из очереди выполняются по одной на выделенном соединении.
+
+    Сама работа с БД идет в отдельном потоке, поэтому event loop не блокируется на fsync,
+    а очередь исключает конкуренцию писателей за блокировку SQLite (database is locked).
+
+    При group_commit_ms > 0 включается групповой commit: изменения, накопившиеся в очереди
+    (окно - верхняя граница ожидания, пустая очередь не ждется), выполняются в одной транзакции (каждое - в своем SAVEPOINT) и фиксируются
+    одним commit, т.е. одним fsync. Ошибка одного изменения откатывает только его SAVEPOINT,
+    остальные получают свои результаты как обычно.
+    """
+
+    def __init__(self, url: str = database.DATABASE_URL, queue_size: int = WRITE_QUEUE_SIZE,
+                 group_commit_ms: float = 0, group_max: int = GROUP_COMMIT_MAX):
+        # Одно соединение без переполнения пула: писатель всегда ровно один
+        self.engine = create_engine(url, connect_args={"check_same_thread": False}, pool_size=1, max_overflow=0)
+        _enable_savepoints(self.engine)
+        self.session_factory = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.group_window = group_commit_ms / 1000
+        self.group_max = group_max
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self._task = None
+        self.completed = 0
+        self.commits = 0 # completed / commits - средний размер группы
+
+    def start(self) -> None:
+        self._task = asyncio.get_running_loop().create_task(self._run(), name="db_writer")
+
+    async def stop(self) -> None:
+        """Дожидается выполнения уже поставленных в очередь изменений и останавливает писателя."""
+        await self.queue.join()
+        if self._task:
+            self._task.cancel()
+        self._executor.shutdown(wait=True)
+        self.engine.dispose()
+
+    async def submit(self, func):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((func, future))
+        return await future
+
+    def _apply_group(self, funcs: list) -> list[tuple[bool, object]]:
+        """Выполняет изменения одной транзакцией. Возвращает [(успех, результат или исключение)]."""
+        with self.session_factory() as db:
+            if len(funcs) == 1:
+                try:
+                    outcomes = [(True, apply_write(db, funcs[0]))]
+                except Exception as e:
+                    outcomes = [(False, e)]
+                self.commits += 1
+                return outcomes
+
+            outcomes = []
+            for func in funcs:
+                try:
+                    with db.begin_nested():
+                        outcomes.append((True, func(db)))
+                except Exception as e:
+                    outcomes.append((False, e))
+            db.commit()
+            self.commits += 1
+            return outcomes
+
+    async def _collect_group(self, first) -> list:
+        """Добирает в группу изменения, уже ждущие в очереди, пока они поступают, но не дольше окна.
+
+        Если очередь пуста и после передачи управления event loop в нее ничего не пришло,
+        группа закрывается сразу: одиночная запись не ждет окно. Под нагрузкой изменения копятся,
+        пока предыдущая группа фиксируется в потоке писателя, и следующая группа забирает их все.
+        """
+        group = [first]
+        if not self.group_window:
+            return group
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.group_window
+        while len(group) < self.group_max:
+            try:
+                group.append(self.queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            if loop.time() >= deadline:
+                break
+            await asyncio.sleep(0) # Даем готовым к записи корутинам поставить изменения в очередь
+            if self.queue.empty():
+                break
+        return group
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            group = await self._collect_group(await self.queue.get())
+            try:
+                outcomes = await loop.run_in_executor(self._executor, self._apply_group, [func for func, _ in group])
+            except Exception as e: # Не удался сам commit - ошибка у всех изменений группы
+                outcomes = [(False, e)] * len(group)
+            for (_, future), (ok, value) in zip(group, outcomes):
+                if future.cancelled():
+                    continue
+                if ok:
+                    future.set_result(value)
+                    self.completed += 1
+                else:
+                    future.set_exception(value)
+            for _ in group:
+                self.queue.task_done()
+
+
+def enable_single_writer(read_pool_size: int = READ_POOL_SIZE, group_commit_ms: float = 0) -> DatabaseWriter:
+    """Включает режим single writer. Вызывать из запущенного event loop (например, в post_init).
+
+    group_commit_ms > 0 дополнительно включает групповой commit (см. DatabaseWriter).
+    """
+    global _read_session_factory, _writer
+    with database.engine.connect() as conn:
+        # WAL позволяет читателям работать параллельно с писателем
+        conn.exec_driver_sql("PRAGMA journal_mode = WAL")
+
+    reset_read_pool()
+    _read_session_factory = sessionmaker(autocommit=False, autoflush=False, bind=_create_read_engine(read_pool_size, True))
+
+    _writer = DatabaseWriter(group_commit_ms=group_commit_ms)
+    _writer.start()
+    logger.info("Single-writer mode enabled (read pool size %s, group commit %s ms).", read_pool_size, group_commit_ms)
+    return _writer
+
+
+async def disable_single_writer() -> None:
+    """Возвращает общий engine для чтения и записи, дождавшись очереди писателя."""
+    global _writer
+    writer, _writer = _writer, None
+    if writer is not None:
+        await writer.stop()
+    reset_read_pool()
@@ -0,0 +1,311 @@
+# handlers_broadcast.py
+import asyncio
+import html
+import logging
+import time
+from functools import partial
+from sqlalchemy import func, insert, literal, select, update as sql_update
+from sqlalchemy.orm import Session
+from telegram import Bot, Update
+from telegram.constants import ParseMode
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError
+from telegram.ext import Application, ContextTypes
+from database import DEFAULT_TENANT, Provider, Service, TimeSlot, Booking, Broadcast, BroadcastRecipient
+from db_access import get_read_db, run_write, update_session, get_active_provider
+from timeutil import now_ts
+
+logger = logging.getLogger(__name__)
+
+# Ограничения Telegram: ~30 сообщений в секунду на бота и не больше 1 сообщения в секунду в один чат
+BROADCAST_GLOBAL_RATE = 25 # Сообщений в секунду (с запасом до 30)
+BROADCAST_PER_CHAT_INTERVAL = 1.0 # Секунд между сообщениями в один чат
+BROADCAST_CHUNK_SIZE = 50 # Получателей на одно чтение из БД и одну запись статусов
+BROADCAST_PROGRESS_INTERVAL = 10.0 # Как часто (секунд) обновлять сообщение с прогрессом
+BROADCAST_MAX_ATTEMPTS = 4 # Попыток отправки одному получателю при RetryAfter/сетевых ошибках
+
+
+class SendScheduler:
+    """Планировщик отправки с глобальным лимитом и лимитом на чат.
+
+    Каждому вызову wait_turn назначается ближайший момент, свободный и по глобальному
+    темпу, и по интервалу для этого чата; вызывающий спит до него. Один планировщик
+    общий для всех рассылок бота (bot_data["send_scheduler"]).
+    """
+
+    def __init__(self, global_rate: float = BROADCAST_GLOBAL_RATE,
+                 per_chat_interval: float = BROADCAST_PER_CHAT_INTERVAL, clock=time.monotonic):
+        self.global_interval = 1.0 / global_rate
+        self.per_chat_interval = per_chat_interval
+        self.clock = clock
+        self._next_global = 0.0
+        self._next_chat = {} # chat_id -> ближайшее разрешенное время
+        self._last_prune = clock()
+
+    def reserve(self, chat_id: int) -> float:
+        """Резервирует момент отправки в chat_id и возвращает, сколько секунд до него ждать."""
+        now = self.clock()
+        if now - self._last_prune > 60: # Чаты с прошедшим интервалом больше не нужны
+            self._next_chat = {chat: at for chat, at in self._next_chat.items() if at > now}
+            self._last_prune = now
+        at = max(now, self._next_global, self._next_chat.get(chat_id, 0.0))
+        self._next_global = at + self.global_interval
+        self._next_chat[chat_id] = at + self.per_chat_interval
+        return at - now
+
+    async def wait_turn(self, chat_id: int) -> None:
+        delay = self.reserve(chat_id)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def pause(self, seconds: float) -> None:
+        """Сдвигает все следующие отправки (ответ Telegram RetryAfter)."""
+        self._next_global = max(self._next_global, self.clock() + seconds)
+
+
+def get_send_scheduler(bot_data: dict) -> SendScheduler:
+    scheduler = bot_data.get("send_scheduler")
+    if scheduler is None:
+        scheduler = bot_data["send_scheduler"] = SendScheduler()
+    return scheduler
+
+
+def create_broadcast(db: Session, provider_id: int, text: str) -> tuple[int | None, int]:
+    """Операция записи: создает рассылку и список ее получателей.
+
+    Получатели - различные client_telegram_id будущих подтвержденных бронирований поставщика;
+    они выбираются и вставляются одним запросом INSERT ... SELECT DISTINCT.
+    Возвращает (broadcast_id, число получателей) или (None, 0), если получателей нет.
+    """
+    broadcast = Broadcast(provider_id=provider_id, text=text)
+    db.add(broadcast)
+    db.flush()
+
+    recipients = select(literal(broadcast.broadcast_id), Booking.client_telegram_id, literal("pending"))\
+        .join(TimeSlot, Booking.slot_id == TimeSlot.slot_id)\
+        .join(Service, TimeSlot.service_id == Service.service_id)\
+        .where(
+            Service.provider_id == provider_id,
+            Booking.status == "confirmed",
+            TimeSlot.start_time > now_ts()
+        )\
+        .distinct()
+    inserted = db.execute(insert(BroadcastRecipient).from_select(
+        ["broadcast_id", "client_telegram_id", "status"], recipients
+    )).rowcount
+    if not inserted:
+        db.delete(broadcast) # Рассылка без получателей не нужна
+        return None, 0
+    return broadcast.broadcast_id, inserted
+
+
+def save_progress_message(db: Session, broadcast_id: int, message_id: int) -> None:
+    db.execute(sql_update(Broadcast).where(Broadcast.broadcast_id == broadcast_id).values(progress_message_id=message_id))
+
+
+def save_results(db: Session, broadcast_id: int, results: list[tuple[int, str, str | None]]) -> None:
+    """Операция записи: статусы пачки получателей [(chat_id, 'sent'/'failed', ошибка)] одним executemany."""
+    db.execute(sql_update(BroadcastRecipient), [
+        {"broadcast_id": broadcast_id, "client_telegram_id": chat_id, "status": status, "error": error}
+        for chat_id, status, error in results
+    ])
+
+
+def count_results(db: Session, broadcast_id: int) -> dict:
+    counts = {"pending": 0, "sent": 0, "failed": 0}
+    for status, count in db.execute(
+        select(BroadcastRecipient.status, func.count())
+        .where(BroadcastRecipient.broadcast_id == broadcast_id)
+        .group_by(BroadcastRecipient.status)
+    ):
+        counts[status] = count
+    return counts
+
+
+def finish_broadcast(db: Session, broadcast_id: int) -> dict:
+    """Операция записи: помечает рассылку завершенной и возвращает итоговые счетчики."""
+    db.execute(sql_update(Broadcast).where(Broadcast.broadcast_id == broadcast_id).values(status="done"))
+    return count_results(db, broadcast_id)
+
+
+async def deliver(bot: Bot, scheduler: SendScheduler, chat_id: int, text: str) -> tuple[str, str | None]:
+    """Отправляет одно сообщение с учетом лимитов. Возвращает ('sent', None) или ('failed', причина)."""
+    error = None
+    for _ in range(BROADCAST_MAX_ATTEMPTS):
+        await scheduler.wait_turn(chat_id)
+        try:
+            await bot.send_message(chat_id=chat_id, text=text, parse_mode=ParseMode.HTML)
+            return "sent", None
+        except RetryAfter as e:
+            scheduler.pause(e.retry_after)
+            error = str(e)
+        except (Forbidden, BadRequest) as e: # Бот заблокирован, чат не найден - повтор не поможет
+            return "failed", str(e)
+        except NetworkError as e:
+            scheduler.pause(1.0)
+            error = str(e)
+        except TelegramError as e:
+            return "failed", str(e)
+    return "failed", error
+
+
+def _progress_text(counts: dict, done: bool = False) -> str:
+    total = counts["pending"] + counts["sent"] + counts["failed"]
+    processed = counts["sent"] + counts["failed"]
+    title = "✅ <b>Рассылка завершена</b>" if done else "📤 <b>Рассылка идет...</b>"
+    return (
+        f"{title}\n\n"
+        f"Обработано: {processed} из {total}\n"
+        f"Доставлено: {counts['sent']}\n"
+        f"Не доставлено: {counts['failed']}"
+    )
+
+
+async def run_broadcast(bot: Bot, bot_data: dict, broadcast_id: int) -> None:
+    """Отправляет рассылку всем получателям со статусом 'pending'.
+
+    Статусы сохраняются пачками, поэтому после перезапуска (resume_broadcasts) рассылка
+    продолжается с неотправленных получателей, а не начинается заново.
+    """
+    scheduler = get_send_scheduler(bot_data)
+    db: Session = next(get_read_db())
+    try:
+        broadcast, provider_chat_id = db.query(Broadcast, Provider.telegram_id)\
+            .join(Provider, Broadcast.provider_id == Provider.provider_id)\
+            .filter(Broadcast.broadcast_id == broadcast_id).one()
+        text, progress_message_id = broadcast.text, broadcast.progress_message_id
+        counts = count_results(db, broadcast_id)
+    finally:
+        db.close()
+
+    async def report(done: bool = False) -> None:
+        if progress_message_id is None:
+            return
+        await scheduler.wait_turn(provider_chat_id)
+        try:
+            await bot.edit_message_text(
+                chat_id=provider_chat_id, message_id=progress_message_id,
+                text=_progress_text(counts, done), parse_mode=ParseMode.HTML
+            )
+        except TelegramError as e_edit:
+            logger.warning("Failed to update progress of broadcast %s: %s", broadcast_id, e_edit)
+
+    last_chat_id = None
+    last_report = time.monotonic()
+    while True:
+        db = next(get_read_db())
+        try:
+            query = db.query(BroadcastRecipient.client_telegram_id).filter(
+                BroadcastRecipient.broadcast_id == broadcast_id,
+                BroadcastRecipient.status == "pending"
+            )
+            if last_chat_id is not None: # Постраничный проход по ключу
+                query = query.filter(BroadcastRecipient.client_telegram_id > last_chat_id)
+            chunk = [row.client_telegram_id for row in
+                     query.order_by(BroadcastRecipient.client_telegram_id).limit(BROADCAST_CHUNK_SIZE)]
+        finally:
+            db.close()
+        if not chunk:
+            break
+
+        results = []
+        for chat_id in chunk:
+            status, error = await deliver(bot, scheduler, chat_id, text)
+            results.append((chat_id, status, error))
+            counts["pending"] -= 1
+            counts[status] += 1
+        await run_write(partial(save_results, broadcast_id=broadcast_id, results=results))
+        last_chat_id = chunk[-1]
+
+        if time.monotonic() - last_report >= BROADCAST_PROGRESS_INTERVAL:
+            await report()
+            last_report = time.monotonic()
+
+    counts = await run_write(partial(finish_broadcast, broadcast_id=broadcast_id))
+    await report(done=True)
+    if progress_message_id is None: # Сообщение с прогрессом не удалось создать - итог отдельным
+        await scheduler.wait_turn(provider_chat_id)
+        try:
+            await bot.send_message(chat_id=provider_chat_id, text=_progress_text(counts, done=True), parse_mode=ParseMode.HTML)
+        except TelegramError as e_notify:
+            logger.error("Failed to send broadcast %s summary to provider: %s", broadcast_id, e_notify)
+    logger.info("Broadcast %s finished: %s sent, %s failed", broadcast_id, counts["sent"], counts["failed"])
+
+
+async def resume_broadcasts(application: Application, created_before: int | None = None) -> None:
+    """Продолжает рассылки арендатора приложения, прерванные перезапуском бота.
+
+    created_before - только рассылки, созданные раньше (секунды UTC epoch): более новые
+    уже отправляются задачами, запущенными командой /broadcast.
+    """
+    tenant = application.bot_data.get("tenant", DEFAULT_TENANT)
+    db: Session = next(get_read_db())
+    try:
+        query = db.query(Broadcast.broadcast_id).join(Provider, Broadcast.provider_id == Provider.provider_id)\
+            .filter(Broadcast.status == "running", Provider.tenant == tenant)
+        if created_before is not None:
+            query = query.filter(Broadcast.created_at < created_before)
+        running = [row.broadcast_id for row in query]
+    finally:
+        db.close()
+    for broadcast_id in running:
+        application.create_task(
+            run_broadcast(application.bot, application.bot_data, broadcast_id), name=f"broadcast_{broadcast_id}"
+        )
+    if running:
+        logger.info("Resumed %s unfinished broadcasts", len(running))
+
+
+async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Рассылка сообщения поставщика всем клиентам с предстоящими бронированиями."""
+    user = update.effective_user
+    db: Session = update_session(context)
+
+    try:
+        current_provider = get_active_provider(context, user.id)
+        if not current_provider:
+            await update.message.reply_text(
+                "Эта команда доступна только для зарегистрированных и активных поставщиков услуг.",
+                parse_mode=ParseMode.HTML
+            )
+            return
+
+        parts = (update.message.text or "").split(maxsplit=1) # Сохраняем переносы строк текста
+        body = parts[1].strip() if len(parts) == 2 else ""
+        if not body:
+            await update.message.reply_text(
+                "Пожалуйста, укажите текст сообщения после команды.\n"
+                "Пример: `/broadcast Сегодня прием задерживается на 30 минут`",
+                parse_mode=ParseMode.HTML
+            )
+            return
+
+        in_progress = db.query(Broadcast.broadcast_id).filter(
+            Broadcast.provider_id == current_provider.provider_id,
+            Broadcast.status == "running"
+        ).first()
+        if in_progress:
+            await update.message.reply_text("Предыдущая рассылка еще не завершена. Дождитесь итогового отчета.")
+            return
+
+        text = f"📢 <b>Сообщение от {html.escape(current_provider.name)}</b>\n\n{html.escape(body)}"
+        broadcast_id, recipients = await run_write(partial(
+            create_broadcast, provider_id=current_provider.provider_id, text=text
+        ))
+        if not broadcast_id:
+            await update.message.reply_text("У вас нет клиентов с предстоящими бронированиями - отправлять некому.")
+            return
+
+        progress_message = await update.message.reply_text(
+            _progress_text({"pending": recipients, "sent": 0, "failed": 0}), parse_mode=ParseMode.HTML
+        )
+        await run_write(partial(save_progress_message, broadcast_id=broadcast_id, message_id=progress_message.message_id))
+        context.application.create_task(
+            run_broadcast(context.bot, context.bot_data, broadcast_id), name=f"broadcast_{broadcast_id}"
+        )
+        logger.info("Provider %s started broadcast %s to %s clients", current_provider.provider_id, broadcast_id, recipients)
+
+    except Exception as e:
+        logger.error("Error in broadcast for user %s (Provider ID: %s): %s", user.id, current_provider.provider_id if 'current_provider' in locals() and current_provider else 'N/A', e)
+        await update.message.reply_text(
+            "Произошла ошибка при запуске рассылки. Пожалуйста, попробуйте позже."
+        )
@@ -0,0 +1,229 @@
+# handlers_bulk_cancel.py
+import html
+import logging
+from datetime import datetime, timedelta
+from functools import partial
+from sqlalchemy import delete, exists, func, insert, literal, select, update as sql_update
+from sqlalchemy.orm import Session
+from telegram import Update
+from telegram.constants import ParseMode
+from telegram.ext import ContextTypes
+from database import Provider, Service, TimeSlot, Booking, WaitlistEntry, ScheduleRule, Broadcast, BroadcastRecipient
+from db_access import run_write, update_session, get_active_provider, current_tenant
+from handlers_broadcast import run_broadcast, save_progress_message, _progress_text
+from handlers_inline import invalidate_catalog_index
+from timeutil import now_ts, to_ts
+
+logger = logging.getLogger(__name__)
+
+# Массовая отмена (/cancel_day, /deactivate_provider) выполняется несколькими командами над
+# множествами строк в одной операции записи: число запросов не зависит от числа броней.
+# Уведомления клиентам не отправляются в хендлере - получатели записываются в рассылку
+# (broadcast_recipients) той же транзакцией, и ее отправляет run_broadcast с лимитами Telegram,
+# продолжая после перезапуска.
+DEACTIVATE_CONFIRM_WORD = "подтверждаю"
+CANCEL_DAY_USAGE = (
+    "Используйте: `/cancel_day <ГГГГ-ММ-ДД> [причина]`\n"
+    "Пример: `/cancel_day 2024-12-31 Болезнь мастера`"
+)
+
+
+def _affected_slots(provider_id: int, start_time: int, end_time: int | None):
+    """Подзапрос: будущие слоты поставщика с началом в [start_time, end_time), end_time None - без границы."""
+    query = select(TimeSlot.slot_id).join(Service, TimeSlot.service_id == Service.service_id).where(
+        Service.provider_id == provider_id,
+        TimeSlot.start_time >= start_time,
+        TimeSlot.start_time > now_ts()
+    )
+    if end_time is not None:
+        query = query.where(TimeSlot.start_time < end_time)
+    return query
+
+
+def cancel_bookings_in_range(db: Session, provider_id: int, start_time: int, end_time: int | None,
+                             notice: str, remove_slots: bool) -> dict:
+    """Операция записи: отменяет все подтвержденные брони будущих слотов поставщика в интервале.
+
+    Получатели уведомления (различные клиенты отменяемых броней) вставляются в новую рассылку
+    одним INSERT ... SELECT DISTINCT, удержания очереди ожидания на эти слоты снимаются (клиенты
+    остаются в очереди), брони удаляются одним DELETE. Слоты либо удаляются (remove_slots - день
+    не рабочий), либо освобождаются: booked_seats = 0. Свободные места очереди не предлагаются.
+    Возвращает {'cancelled', 'slots', 'broadcast_id', 'recipients'}; broadcast_id None, если уведомлять некого.
+    """
+    slots = _affected_slots(provider_id, start_time, end_time)
+    broadcast = Broadcast(provider_id=provider_id, text=notice)
+    db.add(broadcast)
+    db.flush()
+
+    recipients = select(literal(broadcast.broadcast_id), Booking.client_telegram_id, literal("pending"))\
+        .where(Booking.slot_id.in_(slots), Booking.status == "confirmed").distinct()
+    notified = db.execute(insert(BroadcastRecipient).from_select(
+        ["broadcast_id", "client_telegram_id", "status"], recipients
+    )).rowcount
+    broadcast_id = broadcast.broadcast_id
+    if not notified:
+        db.delete(broadcast)
+        broadcast_id = None
+
+    no_sync = {"synchronize_session": False} # Строки этих таблиц в сессию не загружались
+    db.execute(
+        sql_update(WaitlistEntry)
+        .where(WaitlistEntry.status == "offered", WaitlistEntry.offered_slot_id.in_(slots))
+        .values(status="waiting", offered_slot_id=None, hold_expires_at=None)
+        .execution_options(**no_sync)
+    )
+    cancelled = db.execute(
+        delete(Booking).where(Booking.slot_id.in_(slots), Booking.status == "confirmed").execution_options(**no_sync)
+    ).rowcount
+    if remove_slots:
+        # Строки отмененных броней из старых БД (cancelled_by_*) не должны ссылаться на удаленные слоты
+        db.execute(delete(Booking).where(Booking.slot_id.in_(slots)).execution_options(**no_sync))
+        statement = delete(TimeSlot).where(TimeSlot.slot_id.in_(slots))
+    else:
+        statement = sql_update(TimeSlot).where(TimeSlot.slot_id.in_(slots)).values(booked_seats=0, is_available=True)
+    affected_slots = db.execute(statement.execution_options(**no_sync)).rowcount
+    return {"cancelled": cancelled, "slots": affected_slots, "broadcast_id": broadcast_id, "recipients": notified}
+
+
+def close_day_in_rules(db: Session, provider_id: int, day_start: int, day_end: int) -> int:
+    """Операция записи: выходной ('closed') всем услугам поставщика с рабочим временем - одним INSERT ... SELECT.
+
+    Иначе слоты по правилам (virtual_slots.py) снова предлагались бы клиентам на отмененный день.
+    """
+    services = select(Service.service_id, literal("closed"), literal(day_start), literal(day_end)).where(
+        Service.provider_id == provider_id,
+        exists().where(ScheduleRule.service_id == Service.service_id, ScheduleRule.kind == "hours")
+    )
+    return db.execute(insert(ScheduleRule).from_select(
+        ["service_id", "kind", "start_time", "end_time"], services
+    )).rowcount
+
+
+def deactivate_provider_account(db: Session, provider_id: int, notice: str) -> dict:
+    """Операция записи: отменяет все будущие брони поставщика, освобождает слоты и деактивирует его."""
+    result = cancel_bookings_in_range(db, provider_id, now_ts(), None, notice, remove_slots=False)
+    db.execute(sql_update(Provider).where(Provider.provider_id == provider_id).values(is_active=False))
+    return result
+
+
+async def _require_provider(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    current_provider = get_active_provider(context, update.effective_user.id)
+    if not current_provider:
+        await update.message.reply_text(
+            "Эта команда доступна только для зарегистрированных и активных поставщиков услуг.",
+            parse_mode=ParseMode.HTML
+        )
+    return current_provider
+
+
+async def _start_notices(update: Update, context: ContextTypes.DEFAULT_TYPE, result: dict) -> None:
+    """Запускает рассылку уведомлений об отмене с сообщением о прогрессе (как /broadcast)."""
+    broadcast_id = result["broadcast_id"]
+    if not broadcast_id:
+        return
+    progress_message = await update.message.reply_text(
+        _progress_text({"pending": result["recipients"], "sent": 0, "failed": 0}), parse_mode=ParseMode.HTML
+    )
+    await run_write(partial(save_progress_message, broadcast_id=broadcast_id, message_id=progress_message.message_id))
+    context.application.create_task(
+        run_broadcast(context.bot, context.bot_data, broadcast_id), name=f"broadcast_{broadcast_id}"
+    )
+
+
+async def cancel_day(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Отменяет все бронирования поставщика на дату (болезнь, форс-мажор) и закрывает этот день."""
+    user = update.effective_user
+    update_session(context)
+
+    try:
+        current_provider = await _require_provider(update, context)
+        if not current_provider:
+            return
+
+        if not context.args:
+            await update.message.reply_text(CANCEL_DAY_USAGE, parse_mode=ParseMode.HTML)
+            return
+        try:
+            day = datetime.strptime(context.args[0], "%Y-%m-%d")
+        except ValueError:
+            await update.message.reply_text(f"Неверный формат даты. {CANCEL_DAY_USAGE}", parse_mode=ParseMode.HTML)
+            return
+        day_start = to_ts(day)
+        day_end = to_ts(day + timedelta(days=1))
+        if day_end <= now_ts():
+            await update.message.reply_text("Этот день уже прошел.")
+            return
+
+        reason = " ".join(context.args[1:])
+        day_text = day.strftime("%d.%m.%Y")
+        notice = (
+            f"⚠️ <b>{html.escape(current_provider.name)} отменяет прием {day_text}</b>\n\n"
+            f"Ваши бронирования на этот день отменены."
+            + (f"\nПричина: {html.escape(reason)}" if reason else "")
+            + "\nВыбрать другое время: /services"
+        )
+        provider_id = current_provider.provider_id
+
+        def cancel(write_db: Session) -> dict:
+            result = cancel_bookings_in_range(write_db, provider_id, day_start, day_end, notice, remove_slots=True)
+            result["closed_services"] = close_day_in_rules(write_db, provider_id, day_start, day_end)
+            return result
+
+        result = await run_write(cancel)
+
+        await update.message.reply_text(
+            f"<b>{day_text}</b>: отменено бронирований - {result['cancelled']}, удалено слотов - {result['slots']}.\n"
+            f"День закрыт в расписании услуг с рабочим временем: {result['closed_services']}.\n"
+            + (f"Уведомления получат клиентов: {result['recipients']}." if result["recipients"] else "Уведомлять некого."),
+            parse_mode=ParseMode.HTML
+        )
+        logger.info("Provider %s cancelled day %s: %s bookings, %s slots", provider_id, day_text, result["cancelled"], result["slots"])
+        await _start_notices(update, context, result)
+
+    except Exception as e:
+        logger.error("Error in cancel_day for user %s: %s", user.id, e)
+        await update.message.reply_text("Произошла ошибка при отмене дня. Пожалуйста, попробуйте позже.")
+
+
+async def deactivate_provider(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Деактивирует поставщика: все будущие бронирования отменяются, клиенты получают уведомления."""
+    user = update.effective_user
+    db: Session = update_session(context)
+
+    try:
+        current_provider = await _require_provider(update, context)
+        if not current_provider:
+            return
+        provider_id = current_provider.provider_id
+
+        if not context.args or context.args[0].lower() != DEACTIVATE_CONFIRM_WORD:
+            upcoming = db.query(func.count(Booking.booking_id))\
+                .filter(Booking.slot_id.in_(_affected_slots(provider_id, now_ts(), None)), Booking.status == "confirmed").scalar()
+            await update.message.reply_text(
+                f"Ваши услуги перестанут показываться клиентам, а все предстоящие бронирования "
+                f"(<b>{upcoming}</b>) будут отменены с уведомлением клиентов.\n"
+                f"Чтобы продолжить, отправьте: <code>/deactivate_provider {DEACTIVATE_CONFIRM_WORD}</code>\n"
+                f"Вернуться можно командой /register_provider.",
+                parse_mode=ParseMode.HTML
+            )
+            return
+
+        notice = (
+            f"⚠️ <b>{html.escape(current_provider.name)} прекращает прием</b>\n\n"
+            f"Все ваши предстоящие бронирования у этого поставщика отменены.\n"
+            f"Выбрать другую услугу: /services"
+        )
+        result = await run_write(partial(deactivate_provider_account, provider_id=provider_id, notice=notice))
+        invalidate_catalog_index(current_tenant(context)) # Услуги поставщика пропадают из inline-поиска
+
+        await update.message.reply_text(
+            f"Профиль поставщика деактивирован. Отменено бронирований: {result['cancelled']}.\n"
+            + (f"Уведомления получат клиентов: {result['recipients']}." if result["recipients"] else "Уведомлять некого."),
+            parse_mode=ParseMode.HTML
+        )
+        logger.info("Provider %s deactivated, %s bookings cancelled", provider_id, result["cancelled"])
+        await _start_notices(update, context, result)
+
+    except Exception as e:
+        logger.error("Error in deactivate_provider for user %s: %s", user.id, e)
+        await update.message.reply_text("Произошла ошибка при деактивации. Пожалуйста, попробуйте позже.")
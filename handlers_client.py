@@ -1,17 +1,40 @@
 # handlers_client.py
 import logging
-from datetime import datetime
+from functools import partial
+from sqlalchemy import exists
 from sqlalchemy.orm import Session
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup 
 from telegram.constants import ParseMode
 from telegram.ext import ContextTypes
-from database import get_db, Provider, Service, TimeSlot, Booking
+from database import Provider, Service, TimeSlot, Booking
+from db_access import run_write, update_session, current_tenant
+from handlers_waitlist import offer_freed_slot, send_offer, waitlist_callback, waitlist_join_keyboard
+from message_packer import MessagePacker
+from nav_cache import NavigationCache, NavView, NavHistory, nav_row
+from read_models import catalog_services, client_bookings
+from single_flight import SingleFlight
+from slot_seats import take_seat, free_seat
+from timeutil import now_ts, format_ts
+from virtual_slots import load_service_schedule, materialize_slot, upcoming_slots
 
 logger = logging.getLogger(__name__)
+view_logger = logging.getLogger(f"{__name__}.views") # Частые строки о просмотрах; их можно прореживать (LOG_SAMPLING)
+
+SLOTS_PER_VIEW = 10 # Сколько ближайших свободных слотов показывает кнопка услуги
+CALLBACK_RESULT_TTL = 3.0 # Сколько секунд поздние повторы изменяющего колбека получают уже готовый результат
+# Готовый результат отдается повторам только для колбеков, которые что-то меняют (повторная
+# бронь или отмена не нужна). Просмотр (view_slots_, nav_) всегда перерисовывает сообщение:
+# Назад -> Вперед -> Назад за пару секунд - три разных экрана, а не повтор. Одновременные
+# одинаковые нажатия склеиваются в обоих случаях.
+MUTATING_CALLBACK_PREFIXES = ("book_slot_", "book_vslot_", "cancel_booking_client_", "waitlist_")
+callback_flights = SingleFlight(result_ttl=CALLBACK_RESULT_TTL)
+view_flights = SingleFlight(result_ttl=0)
+navigation = NavigationCache() # Экраны каталога и слотов для кнопок "Назад"/"Вперед"
+
 
 async def list_available_services(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Показывает клиенту список доступных услуг с кнопками для просмотра слотов."""
-    db: Session = next(get_db())
+    db: Session = update_session(context)
     user = update.effective_user # Для логирования, если нужно
 
     try:
@@ -32,67 +55,25 @@ async def list_available_services(update: Update, context: ContextTypes.DEFAULT_
 
         # Для MVP: показываем все услуги от активных провайдеров.
         # Позже можно добавить фильтр, чтобы показывать только услуги с доступными слотами.
-        # И сразу подгружаем информацию о провайдере, чтобы не делать лишних запросов в цикле
-        services_with_providers = db.query(Service, Provider.name.label("provider_name"))\
-            .join(Provider, Service.provider_id == Provider.provider_id)\
-            .filter(Provider.is_active == True)\
-            .order_by(Provider.name, Service.name)\
-            .all()
+        # Имя провайдера приходит тем же запросом, описание обрезается в SQL (read_models.py)
+        services_with_providers = catalog_services(db, current_tenant(context))
 
         if not services_with_providers:
             await update.message.reply_text("К сожалению, на данный момент нет доступных услуг для бронирования.")
             return
 
-        response_text = "<b>Доступные услуги для бронирования:</b>\n\n"
-        keyboard = [] # Список для кнопок
-
-        
         if len(services_with_providers) > 30: # Произвольное ограничение для примера
             await update.message.reply_text(
                 "Найдено слишком много услуг. Пожалуйста, используйте фильтры (будут добавлены позже) "
                 "или свяжитесь с администратором для уточнения." # Заглушка для пагинации
             )
-            logger.warning(f"Too many services ({len(services_with_providers)}) to display without pagination for /services command.")
-            return
-
-        for service, provider_name_tuple in services_with_providers:
-            provider_name = provider_name_tuple # т.к. provider_name.label("provider_name") возвращает строку
-
-            price_str = f"{service.price:.2f} руб." if service.price is not None and service.price > 0 else "не указана"
-            response_text += (
-                f"<b>Услуга:</b> {service.name}\n"
-                f"<i>От:</i> {provider_name}\n"
-                f"<i>Длительность:</i> {service.duration_minutes} мин.\n"
-                f"<i>Цена:</i> {price_str}\n"
-            )
-            keyboard.append([
-                InlineKeyboardButton(
-                    f"➡️ Показать слоты для: {service.name} (от {provider_name})", 
-                    callback_data=f"view_slots_{service.service_id}"
-                )
-            ])
-            response_text += "--------------------\n"
-            
-        # Если клавиатура пуста (хотя мы проверили services_with_providers), на всякий случай
-        if not keyboard:
-             await update.message.reply_text("Не удалось сформировать список услуг с кнопками.")
-             return
-
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-
-        if len(response_text) > 4000 :
-            logger.warning(f"Long service list text for /services: {len(response_text)} chars. May be truncated.")
-
-        
-        if not services_with_providers:
-            await update.message.reply_text("К сожалению, на данный момент нет доступных услуг для бронирования.")
+            logger.warning("Too many services (%s) to display without pagination for /services command.", len(services_with_providers))
             return
 
-        await update.message.reply_text("<b>Доступные услуги для бронирования:</b>", parse_mode=ParseMode.HTML)
-
-        for service, provider_name_tuple in services_with_providers:
-            provider_name = provider_name_tuple
+        # Все услуги упаковываются в минимальное число сообщений, кнопки - в клавиатуру того же сообщения
+        packer = MessagePacker(header="<b>Доступные услуги для бронирования:</b>\n\n")
+        for service in services_with_providers:
+            provider_name = service.provider_name
             price_str = f"{service.price:.2f} руб." if service.price is not None and service.price > 0 else "не указана"
             
             service_details_text = (
@@ -102,77 +83,358 @@ async def list_available_services(update: Update, context: ContextTypes.DEFAULT_
                 f"<i>Цена:</i> {price_str}\n"
             )
             if service.description:
-                 service_details_text += f"<i>Описание:</i> {service.description[:100] + '...' if len(service.description) > 100 else service.description}\n"
+                 service_details_text += f"<i>Описание:</i> {service.description}\n"
+            service_details_text += "--------------------\n"
             
-            service_keyboard = InlineKeyboardMarkup([
-                [InlineKeyboardButton(
-                    f"🗓️ Показать слоты", 
-                    callback_data=f"view_slots_{service.service_id}"
-                )]
-            ])
-            await update.message.reply_text(service_details_text, reply_markup=service_keyboard, parse_mode=ParseMode.HTML)
+            packer.add(service_details_text, [[InlineKeyboardButton(
+                f"🗓️ Слоты: {service.name} (от {provider_name})",
+                callback_data=f"view_slots_{service.service_id}"
+            )]])
+        # Каждое сообщение каталога запоминает свой экран: к нему вернется кнопка "Назад" со списка слотов
+        for text, reply_markup in packer.messages():
+            sent = await update.message.reply_text(text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+            rows = reply_markup.inline_keyboard if reply_markup else ()
+            navigation.push((current_tenant(context), user.id), sent.message_id, NavView(text, rows))
         
-        logger.info(f"User {user.id if user else 'N/A'} viewed available services. Count: {len(services_with_providers)}")
+        view_logger.info("User %s viewed available services. Count: %s", user.id if user else 'N/A', len(services_with_providers))
 
 
     except Exception as e:
-        logger.error(f"Error in list_available_services for user {user.id if user else 'N/A'}: {e}")
+        logger.error("Error in list_available_services for user %s: %s", user.id if user else 'N/A', e)
         await update.message.reply_text(
             "Произошла ошибка при получении списка услуг. Пожалуйста, попробуйте позже."
         )
-    finally:
-        if 'db' in locals() and db: db.close()
 
 
 async def my_bookings_client(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Показывает клиенту список его активных бронирований."""
     user = update.effective_user
-    db: Session = next(get_db())
+    db: Session = update_session(context)
 
     try:
-        # Ищем активные (статус 'confirmed') и будущие бронирования для текущего клиента
-        now = datetime.now()
-        client_bookings = db.query(Booking).join(TimeSlot).filter(
-            Booking.client_telegram_id == user.id,
-            Booking.status == "confirmed", # Только подтвержденные
-            TimeSlot.start_time > now      # Только будущие
-        ).order_by(TimeSlot.start_time).all()
-
-        if not client_bookings:
+        # Ищем активные (статус 'confirmed') и будущие бронирования для текущего клиента в этом боте;
+        # услуга и поставщик приходят тем же запросом
+        bookings = client_bookings(db, user.id, current_tenant(context), after=now_ts())
+
+        if not bookings:
             await update.message.reply_text(
                 "У вас нет активных предстоящих бронирований.\n"
                 "Чтобы найти и забронировать услугу, используйте команду /services."
             )
             return
 
-        response_text = "<b>Ваши предстоящие бронирования:</b>\n\n"
-        
-        for booking in client_bookings:
-            slot = booking.slot
-            service = slot.service
-            provider = service.provider
-
-            response_text += (
+        packer = MessagePacker(header="<b>Ваши предстоящие бронирования:</b>\n\n")
+        for booking in bookings:
+            packer.add(
                 f"<b>ID Брони:</b> <code>{booking.booking_id}</code>\n"
-                f"<b>Услуга:</b> {service.name}\n"
-                f"<b>Мастер/Компания:</b> {provider.name}\n"
-                f"<b>Время:</b> {slot.start_time.strftime('%Y-%m-%d %H:%M')} - {slot.end_time.strftime('%H:%M')}\n"
-            )
-            keyboard_booking = InlineKeyboardMarkup([[
-                InlineKeyboardButton(
+                f"<b>Услуга:</b> {booking.service_name}\n"
+                f"<b>Мастер/Компания:</b> {booking.provider_name}\n"
+                f"<b>Время:</b> {format_ts(booking.start_time)} - {format_ts(booking.end_time, '%H:%M')}\n\n",
+                [[InlineKeyboardButton(
                     f"❌ Отменить бронь ID: {booking.booking_id}",
                     callback_data=f"cancel_booking_client_{booking.booking_id}"
-                )
-            ]])
-            await update.message.reply_text(response_text, reply_markup=keyboard_booking, parse_mode=ParseMode.HTML)
-            response_text = "" # Очищаем для следующего бронирования, чтобы каждое было отдельным сообщением с кнопкой
+                )]]
+            )
+        await packer.reply(update.message)
 
-        logger.info(f"User {user.id} viewed their bookings. Count: {len(client_bookings)}")
+        view_logger.info("User %s viewed their bookings. Count: %s", user.id, len(bookings))
 
     except Exception as e:
-        logger.error(f"Error in my_bookings_client for user {user.id}: {e}")
+        logger.error("Error in my_bookings_client for user %s: %s", user.id, e)
         await update.message.reply_text(
             "Произошла ошибка при получении списка ваших бронирований. Пожалуйста, попробуйте позже."
         )
-    finally:
-        if 'db' in locals() and db: db.close()
+
+
+def book_slot(db: Session, slot_id: int, client_telegram_id: int, tenant: str) -> dict | None:
+    """Операция записи: занимает место в слоте, если оно еще есть и слот не в прошлом.
+
+    Место списывается одним условным UPDATE (slot_seats.take_seat). Возвращает данные для
+    уведомлений или None, если мест нет, слот недоступен, принадлежит другому арендатору
+    или клиент уже записан на него.
+    """
+    bookable = db.query(TimeSlot.slot_id)\
+        .join(Service, TimeSlot.service_id == Service.service_id)\
+        .join(Provider, Service.provider_id == Provider.provider_id)\
+        .filter(
+            TimeSlot.slot_id == slot_id,
+            Provider.tenant == tenant,
+            ~exists().where(Booking.slot_id == slot_id, Booking.client_telegram_id == client_telegram_id)
+        ).first()
+    if not bookable or not take_seat(db, slot_id):
+        return None
+
+    # Создаем бронирование
+    new_booking = Booking(
+        slot_id=slot_id,
+        client_telegram_id=client_telegram_id,
+        status="confirmed"
+    )
+    db.add(new_booking)
+    db.flush()
+
+    # Информация об услуге и провайдере для уведомления - одним запросом
+    start_time, service_id, service_name, provider_name, provider_telegram_id = db.query(
+        TimeSlot.start_time, Service.service_id, Service.name, Provider.name, Provider.telegram_id
+    ).join(Service, TimeSlot.service_id == Service.service_id)\
+        .join(Provider, Service.provider_id == Provider.provider_id)\
+        .filter(TimeSlot.slot_id == slot_id).one()
+    return {
+        "booking_id": new_booking.booking_id,
+        "slot_id": slot_id,
+        "service_id": service_id,
+        "service_name": service_name,
+        "provider_name": provider_name,
+        "provider_telegram_id": provider_telegram_id,
+        "start_time": start_time,
+    }
+
+
+def book_virtual_slot(db: Session, service_id: int, start_time: int, client_telegram_id: int, tenant: str) -> dict | None:
+    """Операция записи: создает строку слота по правилам расписания и бронирует ее (как book_slot).
+
+    None, если такого времени нет в правилах, его уже заняли или услуга другого арендатора.
+    """
+    slot_id = materialize_slot(db, service_id, start_time, tenant)
+    if slot_id is None:
+        return None
+    return book_slot(db, slot_id, client_telegram_id, tenant)
+
+
+def cancel_booking_by_client(db: Session, booking_id: int, client_telegram_id: int, tenant: str) -> dict | None:
+    """Операция записи: удаляет бронь клиента и освобождает слот. None, если бронь не найдена.
+
+    Освободившийся слот сразу предлагается голове очереди ожидания услуги (waitlist_offer).
+    """
+    booking_to_cancel = db.query(Booking).filter(
+        Booking.booking_id == booking_id,
+        Booking.client_telegram_id == client_telegram_id,
+    ).first()
+    if not booking_to_cancel or booking_to_cancel.slot.service.provider.tenant != tenant:
+        return None
+
+    slot_to_free = booking_to_cancel.slot
+    cancelled = {
+        "service_name": slot_to_free.service.name,
+        "start_time": slot_to_free.start_time,
+        "provider_telegram_id": slot_to_free.service.provider.telegram_id,
+    }
+
+    # Удаляем бронирование и возвращаем место
+    db.delete(booking_to_cancel)
+    free_seat(db, slot_to_free)
+    cancelled["waitlist_offer"] = offer_freed_slot(db, slot_to_free)
+    return cancelled
+
+
+def _message_key(query) -> int | str:
+    """Сообщение с кнопкой: обычное (message_id) или отправленное через inline-режим (inline_message_id)."""
+    return query.message.message_id if query.message else query.inline_message_id
+
+
+def _view_markup(view: NavView, history: NavHistory) -> InlineKeyboardMarkup | None:
+    rows = list(view.rows)
+    nav = nav_row(history)
+    if nav:
+        rows.append(nav)
+    return InlineKeyboardMarkup(rows) if rows else None
+
+
+async def show_view(query, tenant: str, view: NavView, service_id: int | None = None) -> None:
+    """Показывает экран в сообщении колбека и делает его текущим в истории навигации."""
+    history = navigation.push((tenant, query.from_user.id), _message_key(query), view, service_id)
+    await query.edit_message_text(text=view.text, reply_markup=_view_markup(view, history), parse_mode=ParseMode.HTML)
+
+
+async def button_callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обрабатывает нажатия на инлайн-кнопки.
+
+    Одновременные одинаковые колбеки одного пользователя (двойное нажатие) выполняются один раз:
+    дубликаты дожидаются первого вызова и не трогают БД и сообщение. Изменяющим колбекам
+    (MUTATING_CALLBACK_PREFIXES) результат отдается и поздним повторам в течение CALLBACK_RESULT_TTL.
+    """
+    query = update.callback_query
+    await query.answer() # Важно ответить на колбек, чтобы кнопка перестала "грузиться"
+
+    flights = callback_flights if query.data.startswith(MUTATING_CALLBACK_PREFIXES) else view_flights
+    _, shared = await flights.run(
+        (current_tenant(context), query.from_user.id, query.data),
+        lambda: process_callback(update, context)
+    )
+    if shared:
+        logger.info("Duplicate callback %s from user %s coalesced", query.data, query.from_user.id)
+
+
+async def process_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Выполняет действие инлайн-кнопки (просмотр слотов, бронирование, отмена)."""
+    query = update.callback_query
+    callback_data = query.data
+    user_telegram_id = query.from_user.id
+    tenant = current_tenant(context)
+
+    try:
+        if callback_data.startswith("view_slots_"):
+            service_id = int(callback_data.split("_")[2]) # Извлекаем ID услуги
+            db: Session = update_session(context) # Сессия нужна только для чтения слотов
+
+            service_info, schedule = load_service_schedule(db, service_id, tenant)
+            if not service_info:
+                await query.edit_message_text(text="Ошибка: Услуга не найдена.") # Редактируем исходное сообщение кнопки
+                return
+
+            # Ищем доступные слоты для этой услуги
+            if schedule is None:
+                now = now_ts()
+                available_slots = db.query(
+                    TimeSlot.start_time, TimeSlot.end_time, TimeSlot.slot_id, TimeSlot.capacity - TimeSlot.booked_seats
+                ).filter(
+                    TimeSlot.service_id == service_id,
+                    TimeSlot.is_available == True,
+                    TimeSlot.start_time > now # Только будущие слоты
+                ).order_by(TimeSlot.start_time).limit(SLOTS_PER_VIEW).all()
+            else: # Есть правила расписания: свободное время вычисляется, строки есть только у броней
+                available_slots = upcoming_slots(db, service_id, schedule, SLOTS_PER_VIEW)
+            slots = [(start, end, seats_left, f"book_slot_{slot_id}" if slot_id else f"book_vslot_{service_id}_{start}")
+                     for start, end, slot_id, seats_left in available_slots]
+
+            if not slots:
+                await show_view(query, tenant, NavView(
+                    f"Для услуги '<b>{service_info.name}</b>' сейчас нет свободных слотов.\n"
+                    f"Встаньте в очередь ожидания - я сообщу, когда время освободится.",
+                    waitlist_join_keyboard(service_id).inline_keyboard
+                ), service_id)
+                return
+
+            slots_keyboard = []
+            slots_text = f"<b>Доступные слоты для '{service_info.name}':</b>\n\n"
+            
+            
+            for start_time, end_time, seats_left, book_data in slots:
+                slots_text += f"🗓️ {format_ts(start_time)} - {format_ts(end_time, '%H:%M')}"
+                slots_text += f" (свободно мест: {seats_left})\n" if seats_left > 1 else "\n"
+                slots_keyboard.append([
+                    InlineKeyboardButton(
+                        f"Забронировать на {format_ts(start_time, '%H:%M %d.%m')}",
+                        callback_data=book_data # book_slot_<ID слота> или book_vslot_<ID услуги>_<начало>
+                    )
+                ])
+
+            # Кнопка "Назад" к странице каталога появляется из истории навигации сообщения
+            await show_view(query, tenant, NavView(slots_text, tuple(slots_keyboard)), service_id)
+            view_logger.info("User %s viewed slots for service %s", user_telegram_id, service_id)
+
+        elif callback_data.startswith("nav_"):
+            # Переход по истории: экран берется из кэша навигации, БД не запрашивается
+            found = navigation.go((tenant, user_telegram_id), _message_key(query), int(callback_data.split("_")[1]))
+            if not found:
+                await query.edit_message_text(text="Этот список устарел. Отправьте /services, чтобы открыть каталог заново.")
+                return
+            view, history = found
+            await query.edit_message_text(text=view.text, reply_markup=_view_markup(view, history), parse_mode=ParseMode.HTML)
+            view_logger.info("User %s navigated to screen %s (service %s)", user_telegram_id, history.position,
+                             navigation.selected_service((tenant, user_telegram_id)))
+        
+        elif callback_data.startswith(("book_slot_", "book_vslot_")):
+            parts = callback_data.split("_")
+
+            # --- ЛОГИКА БРОНИРОВАНИЯ ---
+            if parts[1] == "vslot": # Слот по правилам расписания: строка TimeSlot создается только сейчас
+                booked = await run_write(partial(
+                    book_virtual_slot, service_id=int(parts[2]), start_time=int(parts[3]), client_telegram_id=user_telegram_id,
+                    tenant=tenant
+                ))
+            else:
+                booked = await run_write(partial(
+                    book_slot, slot_id=int(parts[2]), client_telegram_id=user_telegram_id, tenant=tenant
+                ))
+
+            if not booked:
+                await query.edit_message_text(text="К сожалению, в этом слоте не осталось мест, он недоступен или вы уже записаны на него. Пожалуйста, выберите другой.")
+                # Можно предложить вернуться к выбору слотов для этой услуги или к общему списку услуг
+                return
+
+            confirmation_text = (
+                f"🎉 <b>Вы успешно забронировали услугу!</b> 🎉\n\n"
+                f"<b>Услуга:</b> {booked['service_name']}\n"
+                f"<b>Мастер/Компания:</b> {booked['provider_name']}\n"
+                f"<b>Время:</b> {format_ts(booked['start_time'])}\n"
+                f"<b>ID вашего бронирования:</b> <code>{booked['booking_id']}</code> (сохраните его)\n\n"
+                f"Мы также уведомим поставщика услуг."
+            )
+            await query.edit_message_text(text=confirmation_text, parse_mode=ParseMode.HTML)
+            logger.info("User %s booked slot %s for service %s. Booking ID: %s", user_telegram_id, booked['slot_id'], booked['service_id'], booked['booking_id'])
+
+            # --- Отправка уведомления Поставщику ---
+            provider_telegram_id = booked['provider_telegram_id']
+            try:
+                await context.bot.send_message(
+                    chat_id=provider_telegram_id,
+                    text=f"🔔 <b>Новое бронирование!</b> 🔔\n\n"
+                         f"<b>Услуга:</b> {booked['service_name']}\n"
+                         f"<b>Время:</b> {format_ts(booked['start_time'])}\n"
+                         f"<b>Клиент Telegram ID:</b> <code>{user_telegram_id}</code>\n"
+                         f"<b>ID бронирования:</b> <code>{booked['booking_id']}</code>",
+                    parse_mode=ParseMode.HTML
+                )
+                logger.info("Notification sent to provider %s for booking %s", provider_telegram_id, booked['booking_id'])
+            except Exception as e_notify:
+                logger.error("Failed to send notification to provider %s for booking %s: %s", provider_telegram_id, booked['booking_id'], e_notify)
+
+        elif callback_data.startswith("cancel_booking_client_"):
+            booking_id_to_cancel = int(callback_data.split("_")[3]) 
+
+            cancelled = await run_write(partial(
+                cancel_booking_by_client, booking_id=booking_id_to_cancel, client_telegram_id=user_telegram_id, tenant=tenant
+            ))
+
+            if not cancelled:
+                await query.edit_message_text(text="Бронирование не найдено или вы не можете его отменить.")
+                return
+            
+            service_name_for_message = cancelled['service_name']
+            slot_time_for_message = format_ts(cancelled['start_time'])
+            provider_telegram_id_for_notify = cancelled['provider_telegram_id']
+            waitlist_offer = cancelled['waitlist_offer']
+            slot_status_text = "Слот предложен следующему в очереди ожидания." if waitlist_offer else "Слот снова доступен."
+
+            # Уведомляем клиента
+            await query.edit_message_text(
+                text=f"Бронирование ID <code>{booking_id_to_cancel}</code> на услугу "
+                     f"<b>{service_name_for_message}</b> ({slot_time_for_message}) "
+                     f"успешно отменено. {slot_status_text}",
+                parse_mode=ParseMode.HTML
+            )
+            logger.info("Client %s cancelled and deleted booking %s", user_telegram_id, booking_id_to_cancel)
+
+            # Уведомляем поставщика
+            try:
+                await context.bot.send_message(
+                    chat_id=provider_telegram_id_for_notify,
+                    text=f"ℹ️ <b>Отмена бронирования клиентом</b> ℹ️\n\n"
+                         f"Бронирование ID <code>{booking_id_to_cancel}</code> на услугу "
+                         f"<b>{service_name_for_message}</b>\n"
+                         f"Время: {slot_time_for_message}\n"
+                         f"было отменено клиентом (TG ID: <code>{user_telegram_id}</code>). {slot_status_text}",
+                    parse_mode=ParseMode.HTML
+                )
+            except Exception as e_notify:
+                logger.error("Failed to send cancellation notification to provider %s for booking %s: %s", provider_telegram_id_for_notify, booking_id_to_cancel, e_notify)
+
+            # Предлагаем слот первому в очереди ожидания
+            await send_offer(context.bot, context.job_queue, waitlist_offer)
+               
+        elif callback_data.startswith("waitlist_"):
+            await waitlist_callback(update, context)
+
+        else:
+            await query.edit_message_text(text=f"Неизвестный колбек: {callback_data}")
+            logger.warning("Received unknown callback_data: %s from user %s", callback_data, user_telegram_id)
+
+    except Exception as e:
+        logger.error("Error in button_callback_handler (callback_data: %s) for user %s: %s", query.data if query else 'N/A', user_telegram_id if query else 'N/A', e)
+        try:
+            await query.edit_message_text("Произошла непредвиденная ошибка при обработке вашего запроса.")
+        except Exception as e_edit_fallback:
+             logger.error("Fallback edit_message_text also failed: %s", e_edit_fallback)
+             if query and query.message:
+                 await context.bot.send_message(chat_id=query.message.chat_id, text="Произошла ошибка. Попробуйте снова.")
@@ -21,18 +21,28 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         f"/add_service <i>Название;Описание;Длительность_мин;Цена</i> - Добавить услугу\n"
         f"  <i>Пример: /add_service Стрижка;Модельная;60;500</i>\n"
         f"/my_services - Просмотреть ваши услуги\n"
-        f"/add_slot <i>ID_услуги ГГГГ-ММ-ДД ЧЧ:ММ</i> - Добавить временной слот\n"
+        f"/add_slot <i>ID_услуги ГГГГ-ММ-ДД ЧЧ:ММ [мест]</i> - Добавить временной слот (для группы - с числом мест)\n"
         f"  <i>Пример: /add_slot 123 2024-10-20 14:00</i>\n"
         f"/my_slots - Просмотреть ваши слоты и их бронирования\n"
         f"/cancel_booking_provider <i>ID_брони</i> - Отменить бронирование на вашу услугу\n"
-        f"  <i>Пример: /cancel_booking_provider 45</i>\n\n"
+        f"  <i>Пример: /cancel_booking_provider 45</i>\n"
+        f"/cancel_day <i>ГГГГ-ММ-ДД [причина]</i> - Отменить все бронирования на день и закрыть его\n"
+        f"/deactivate_provider - Прекратить прием: отменить все предстоящие бронирования\n"
+        f"/add_hours <i>ID_услуги дни ЧЧ:ММ-ЧЧ:ММ</i> - Рабочее время: слоты предлагаются автоматически\n"
+        f"  <i>Пример: /add_hours 123 пн-пт 09:00-18:00</i>\n"
+        f"/add_break, /add_day_off, /my_schedule, /delete_rule - Перерывы, выходные и просмотр правил\n"
+        f"Отправьте файл .csv/.json - массовый импорт услуг и слотов\n"
+        f"/export_ics, /export_csv <i>[ГГГГ-ММ-ДД ГГГГ-ММ-ДД]</i> - Выгрузить расписание в календарь/таблицу\n"
+        f"/broadcast <i>Текст</i> - Сообщение всем клиентам с предстоящими бронированиями\n\n"
         
         f"<b>Для Клиентов:</b>\n"
         f"/services - Посмотреть доступные услуги и забронировать\n"
         f"/my_bookings - Посмотреть ваши бронирования (и отменить их)\n"
+        f"@имя_бота <i>запрос</i> в любом чате - Быстрый поиск услуги с ближайшим временем\n"
+        f"Нет свободного времени? Встаньте в очередь ожидания кнопкой в списке слотов\n"
     )
     await update.message.reply_text(welcome_message, parse_mode=ParseMode.HTML)
-    logger.info(f"User {user.id} ({user.username}) started the bot.")
+    logger.info("User %s (%s) started the bot.", user.id, user.username)
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Отправляет сообщение с помощью по командам с HTML форматированием."""
@@ -55,10 +65,11 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         f"<b>/my_services</b>\n"
         f"  <i>Показывает список ваших услуг и их ID.</i>\n\n"
         
-        f"<b>/add_slot</b> <i>ID_услуги ГГГГ-ММ-ДД ЧЧ:ММ</i>\n"
+        f"<b>/add_slot</b> <i>ID_услуги ГГГГ-ММ-ДД ЧЧ:ММ [мест]</i>\n"
         f"  <i>Добавляет временной слот. Укажите ID услуги, дату и время через пробел.</i>\n"
+        f"  <i>Для группового занятия добавьте число мест - на слот смогут записаться несколько клиентов.</i>\n"
         f"  <i>ID услуги можно узнать из /my_services.</i>\n"
-        f"  <i>Пример: /add_slot 123 2024-10-20 14:00</i>\n\n"
+        f"  <i>Пример: /add_slot 123 2024-10-20 14:00, группа: /add_slot 123 2024-10-20 18:00 12</i>\n\n"
         
         f"<b>/my_slots</b>\n"
         f"  <i>Показывает ваши слоты, сгруппированные по услугам, и кто их забронировал.</i>\n\n"
@@ -67,12 +78,52 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         f"  <i>Отменяет бронирование на вашу услугу. Укажите ID брони после команды.</i>\n"
         f"  <i>ID брони можно увидеть в /my_slots.</i>\n"
         f"  <i>Пример: /cancel_booking_provider 45</i>\n\n"
+        f"<b>/cancel_day</b> <i>ГГГГ-ММ-ДД [причина]</i>\n"
+        f"  <i>Отменяет все бронирования на дату (например, при болезни) и убирает слоты этого дня.</i>\n"
+        f"  <i>Клиенты получат уведомление. Пример: /cancel_day 2024-12-31 Болезнь мастера</i>\n\n"
+        f"<b>/deactivate_provider</b>\n"
+        f"  <i>Скрывает ваши услуги и отменяет все предстоящие бронирования с уведомлением клиентов.</i>\n"
+        f"  <i>Вернуться можно командой /register_provider.</i>\n\n"
+        f"<b>/add_hours</b> <i>ID_услуги дни ЧЧ:ММ-ЧЧ:ММ</i>\n"
+        f"  <i>Рабочее время услуги: свободные слоты в этом окне предлагаются клиентам без /add_slot.</i>\n"
+        f"  <i>Дни: пн-пт, пн,ср,пт или все. Пример: /add_hours 123 пн-пт 09:00-18:00</i>\n\n"
+        
+        f"<b>/add_break</b> <i>ID_услуги дни ЧЧ:ММ-ЧЧ:ММ</i>\n"
+        f"  <i>Перерыв в рабочем времени. Пример: /add_break 123 все 13:00-14:00</i>\n\n"
+        
+        f"<b>/add_day_off</b> <i>ID_услуги ГГГГ-ММ-ДД [ЧЧ:ММ-ЧЧ:ММ]</i>\n"
+        f"  <i>Закрывает день или часть дня. Пример: /add_day_off 123 2024-12-31</i>\n\n"
+        
+        f"<b>/my_schedule</b> <i>ID_услуги</i>, <b>/delete_rule</b> <i>ID_правила</i>\n"
+        f"  <i>Просмотр и удаление правил расписания.</i>\n\n"
+        
+        
+        f"<b>Массовый импорт</b>\n"
+        f"  <i>Отправьте боту файл .csv, .json (массив объектов) или .jsonl до 20 МБ. Поле type: service или slot.</i>\n"
+        f"  <i>Услуга: name, description, duration_minutes, price. Слот: service (ID или название), start (ГГГГ-ММ-ДД ЧЧ:ММ), capacity (мест, необязательно).</i>\n"
+        f"  <i>В ответ придет сводка и файл с ошибками по строкам.</i>\n\n"
+        
+        f"<b>/export_ics</b>, <b>/export_csv</b> <i>[ГГГГ-ММ-ДД] [ГГГГ-ММ-ДД]</i>\n"
+        f"  <i>Выгружает ваши слоты и бронирования за период в файл для календаря (.ics) или таблицы (.csv).</i>\n"
+        f"  <i>Без дат - ближайшие 30 дней. Пример: /export_ics 2024-07-01 2024-07-31</i>\n\n"
+        
+        f"<b>/broadcast</b> <i>Текст сообщения</i>\n"
+        f"  <i>Отправляет сообщение (например, о задержке или закрытии) всем клиентам с предстоящими бронированиями.</i>\n"
+        f"  <i>Рассылка идет с учетом лимитов Telegram, в ответ придет прогресс и итог: доставлено/не доставлено.</i>\n\n"
         
         f"<b>Для Клиентов:</b>\n"
         f"<b>/services</b>\n"
         f"  <i>Показывает список доступных услуг. Выберите услугу кнопками, чтобы увидеть слоты и забронировать.</i>\n\n"
         
         f"<b>/my_bookings</b>\n"
-        f"  <i>Показывает ваши предстоящие бронирования. Кнопками можно отменить бронь.</i>\n"
+        f"  <i>Показывает ваши предстоящие бронирования. Кнопками можно отменить бронь.</i>\n\n"
+        
+        f"<b>Inline-поиск</b>\n"
+        f"  <i>Наберите в любом чате @имя_бота и начало названия услуги или имени поставщика.</i>\n"
+        f"  <i>В подсказках - услуги с ближайшим свободным временем, кнопка ведет к выбору слота.</i>\n\n"
+        
+        f"<b>Очередь ожидания</b>\n"
+        f"  <i>Если у услуги нет свободных слотов, встаньте в очередь кнопкой. Освободившийся слот</i>\n"
+        f"  <i>предлагается первому в очереди и удерживается для него ограниченное время.</i>\n"
     )
     await update.message.reply_text(help_text, parse_mode=ParseMode.HTML)
\ No newline at end of file
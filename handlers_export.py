@@ -0,0 +1,215 @@
+# handlers_export.py
+import asyncio
+import codecs
+import csv
+import io
+import logging
+import tempfile
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import and_, select
+from sqlalchemy.orm import Session
+from telegram import Update, InputFile
+from telegram.constants import ParseMode
+from telegram.ext import ContextTypes
+from database import Provider, Service, TimeSlot, Booking
+from db_access import get_read_db, update_session, get_active_provider
+from timeutil import now_ts, to_ts, format_ts
+
+logger = logging.getLogger(__name__)
+
+EXPORT_DEFAULT_DAYS = 30 # Период по умолчанию, если даты не указаны
+EXPORT_YIELD_PER = 500 # Сколько строк курсора держим в памяти одновременно
+EXPORT_SPOOL_SIZE = 1024 * 1024 # До этого размера файл собирается в памяти, дальше - на диске
+CSV_HEADER = [
+    "slot_id", "service_id", "service_name", "start_time", "end_time", "is_available",
+    "capacity", "booked_seats", "booking_id", "client_telegram_id", "booking_status",
+]
+
+
+def parse_export_range(args: list[str]) -> tuple[datetime, datetime]:
+    """Разбирает период ГГГГ-ММ-ДД [ГГГГ-ММ-ДД]; конечная дата включается. ValueError при ошибке."""
+    if not args:
+        start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        return start, start + timedelta(days=EXPORT_DEFAULT_DAYS)
+    if len(args) > 2:
+        raise ValueError("Укажите не более двух дат: начало и конец периода.")
+    try:
+        start = datetime.strptime(args[0], "%Y-%m-%d")
+        end = datetime.strptime(args[1], "%Y-%m-%d") if len(args) == 2 else start
+    except ValueError:
+        raise ValueError("Неверный формат даты. Используйте `ГГГГ-ММ-ДД`.")
+    if end < start:
+        raise ValueError("Дата окончания периода раньше даты начала.")
+    return start, end + timedelta(days=1)
+
+
+def iter_schedule_rows(db: Session, provider_id: int, period_start: datetime, period_end: datetime):
+    """Потоково отдает строки расписания за период через серверный курсор, не загружая их разом.
+
+    Выбираются только нужные колонки (без ORM-объектов), поэтому identity map сессии не растет.
+    У группового слота по строке на каждую подтвержденную бронь, строки одного слота идут подряд.
+    Статус проверяется в условии соединения: слот с одной отмененной бронью выгружается свободным.
+    """
+    query = select(
+        TimeSlot.slot_id, TimeSlot.service_id, TimeSlot.start_time, TimeSlot.end_time, TimeSlot.is_available,
+        TimeSlot.capacity, TimeSlot.booked_seats, Service.name.label("service_name"),
+        Booking.booking_id, Booking.client_telegram_id, Booking.status.label("booking_status"),
+    ).join(Service, TimeSlot.service_id == Service.service_id)\
+        .outerjoin(Booking, and_(Booking.slot_id == TimeSlot.slot_id, Booking.status == "confirmed"))\
+        .where(
+            Service.provider_id == provider_id,
+            TimeSlot.start_time >= to_ts(period_start),
+            TimeSlot.start_time < to_ts(period_end)
+        )\
+        .order_by(TimeSlot.start_time, TimeSlot.slot_id)\
+        .execution_options(yield_per=EXPORT_YIELD_PER)
+    yield from db.execute(query)
+
+
+def _ics_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+
+def _ics_fold(line: str) -> str:
+    """Переносит строку iCalendar по 75 октетов (RFC 5545, 3.1)."""
+    encoded = line.encode("utf-8")
+    if len(encoded) <= 75:
+        return line + "\r\n"
+    parts = []
+    current = ""
+    for char in line:
+        limit = 75 if not parts else 74 # У строк-продолжений первый октет занят пробелом
+        if len((current + char).encode("utf-8")) > limit:
+            parts.append(current)
+            current = ""
+        current += char
+    parts.append(current)
+    return "\r\n ".join(parts) + "\r\n"
+
+
+def _ics_time(ts: int) -> str:
+    # В БД хранятся секунды UTC epoch; в календарь отдаем UTC
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+
+def iter_ics_lines(rows, provider_name: str):
+    """Генератор строк календаря iCalendar для строк расписания."""
+    stamp = _ics_time(now_ts())
+    yield "BEGIN:VCALENDAR\r\n"
+    yield "VERSION:2.0\r\n"
+    yield "PRODID:-//BookBotBoss//Schedule export//RU\r\n"
+    yield _ics_fold(f"X-WR-CALNAME:{_ics_escape(provider_name)}")
+    for row in rows:
+        booked = row.booking_id is not None
+        status = "Забронирован" if booked else ("Свободен" if row.is_available else "Недоступен")
+        description = f"Статус: {status}"
+        if row.capacity > 1:
+            description += f"\nЗанято мест: {row.booked_seats} из {row.capacity}"
+        if booked:
+            description += f"\nID брони: {row.booking_id}\nКлиент TG ID: {row.client_telegram_id}"
+        yield "BEGIN:VEVENT\r\n"
+        # У группового слота несколько броней - UID должен различаться для каждой
+        uid = f"slot-{row.slot_id}-booking-{row.booking_id}" if booked else f"slot-{row.slot_id}"
+        yield f"UID:{uid}@bookbotboss\r\n"
+        yield f"DTSTAMP:{stamp}\r\n"
+        yield f"DTSTART:{_ics_time(row.start_time)}\r\n"
+        yield f"DTEND:{_ics_time(row.end_time)}\r\n"
+        yield _ics_fold(f"SUMMARY:{_ics_escape(f'{row.service_name} ({status})')}")
+        yield _ics_fold(f"DESCRIPTION:{_ics_escape(description)}")
+        yield "TRANSP:OPAQUE\r\n" if booked else "TRANSP:TRANSPARENT\r\n"
+        yield "END:VEVENT\r\n"
+    yield "END:VCALENDAR\r\n"
+
+
+def iter_csv_lines(rows):
+    """Генератор строк CSV для строк расписания."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_HEADER)
+    for row in rows:
+        writer.writerow([
+            row.slot_id, row.service_id, row.service_name,
+            format_ts(row.start_time), format_ts(row.end_time),
+            int(bool(row.is_available)), row.capacity, row.booked_seats,
+            row.booking_id if row.booking_id is not None else "",
+            row.client_telegram_id if row.client_telegram_id is not None else "",
+            row.booking_status or "",
+        ])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def write_schedule_file(output, provider_id: int, provider_name: str, file_format: str,
+                        period_start: datetime, period_end: datetime) -> None:
+    """Пишет выгрузку в output (синхронно, вызывается в отдельном потоке) через собственную сессию чтения.
+
+    Большая выгрузка не задерживает event loop: остальные апдейты обрабатываются, пока идет запись.
+    """
+    db: Session = next(get_read_db())
+    try:
+        rows = iter_schedule_rows(db, provider_id, period_start, period_end)
+        lines = iter_ics_lines(rows, provider_name) if file_format == "ics" else iter_csv_lines(rows)
+        if file_format == "csv":
+            output.write(codecs.BOM_UTF8) # BOM, чтобы Excel понял кириллицу
+        for line in lines:
+            output.write(line.encode("utf-8"))
+    finally:
+        db.close()
+    output.seek(0)
+
+
+async def _export_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE, file_format: str) -> None:
+    """Общая часть /export_ics и /export_csv."""
+    user = update.effective_user
+    update_session(context)
+
+    try:
+        current_provider = get_active_provider(context, user.id)
+        if not current_provider:
+            await update.message.reply_text(
+                "Эта команда доступна только для зарегистрированных и активных поставщиков услуг.",
+                parse_mode=ParseMode.HTML
+            )
+            return
+
+        try:
+            period_start, period_end = parse_export_range(context.args or [])
+        except ValueError as e_parse:
+            await update.message.reply_text(
+                f"{e_parse}\nПример: `/export_{file_format} 2024-07-01 2024-07-31`",
+                parse_mode=ParseMode.HTML
+            )
+            return
+
+        with tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE) as output:
+            await asyncio.to_thread(
+                write_schedule_file, output, current_provider.provider_id, current_provider.name,
+                file_format, period_start, period_end
+            )
+
+            period_label = f"{period_start:%Y-%m-%d}_{(period_end - timedelta(days=1)):%Y-%m-%d}"
+            # read_file_handle=False: файл передается в запрос как есть и отправляется частями,
+            # а не читается целиком в память перед загрузкой
+            await update.message.reply_document(
+                document=InputFile(output, filename=f"schedule_{period_label}.{file_format}", read_file_handle=False),
+                caption=f"Расписание за период {period_label.replace('_', ' - ')}."
+            )
+        logger.info("Provider %s exported schedule (%s) for %s..%s", current_provider.provider_id, file_format,
+                    period_start.date(), period_end.date())
+
+    except Exception as e:
+        logger.error("Error in export_%s for user %s (Provider ID: %s): %s", file_format, user.id, current_provider.provider_id if 'current_provider' in locals() and current_provider else 'N/A', e)
+        await update.message.reply_text(
+            "Произошла ошибка при выгрузке расписания. Пожалуйста, попробуйте позже."
+        )
+
+
+async def export_ics(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Выгружает слоты и бронирования поставщика за период в файл iCalendar (.ics)."""
+    await _export_schedule(update, context, "ics")
+
+
+async def export_csv(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Выгружает слоты и бронирования поставщика за период в файл CSV."""
+    await _export_schedule(update, context, "csv")
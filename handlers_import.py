@@ -0,0 +1,348 @@
+# handlers_import.py
+import asyncio
+import bisect
+import csv
+import io
+import json
+import logging
+import re
+import tempfile
+from functools import partial
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+from telegram import Update, InputFile
+from telegram.constants import ParseMode
+from telegram.ext import ContextTypes
+from database import Service, TimeSlot
+from db_access import get_read_db, run_write_from_thread, update_session, get_active_provider
+from handlers_inline import invalidate_catalog_index
+from handlers_provider import parse_service_fields, parse_slot_start, parse_slot_capacity
+from timeutil import format_ts
+
+logger = logging.getLogger(__name__)
+
+IMPORT_BATCH_SIZE = 500 # Сколько строк вставляется в одной транзакции
+IMPORT_MAX_FILE_SIZE = 20 * 1024 * 1024 # Лимит Bot API на скачивание файлов ботом
+IMPORT_EXTENSIONS = ("csv", "json", "jsonl")
+IMPORT_JSON_CHUNK = 64 * 1024 # Сколько символов JSON-массива читается за раз
+JSON_WHITESPACE = re.compile(r"[ \t\n\r]*")
+JSON_NUMBER_CHARS = "0123456789.eE+-" # Если за элементом идет такой символ, число могло оборваться на границе куска
+
+
+def iter_json_array(text):
+    """Потоково отдает элементы JSON-массива из текстового потока.
+
+    Массив не разбирается целиком через json.load: в памяти только текущий элемент и
+    непрочитанный остаток куска файла. Ошибка формата - ValueError (json.JSONDecodeError).
+    """
+    decoder = json.JSONDecoder()
+    buffer, pos, eof = "", 0, False
+    state = "start" # start -> first -> value -> separator -> value ... -> конец на "]"
+    while True:
+        pos = JSON_WHITESPACE.match(buffer, pos).end()
+        if state in ("first", "value") and pos < len(buffer) and (state == "value" or buffer[pos] != "]"):
+            try:
+                row, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                end = None
+            if end is not None and (eof or (end < len(buffer) and buffer[end] not in JSON_NUMBER_CHARS)):
+                yield row
+                pos, state = end, "separator"
+                continue
+            # Элемент мог оборваться на границе куска - дочитываем
+        elif pos < len(buffer):
+            char = buffer[pos]
+            if state == "start":
+                if char != "[":
+                    raise ValueError("JSON-файл должен содержать массив объектов.")
+                state = "first"
+            elif char == "]":
+                return
+            elif state == "separator" and char == ",":
+                state = "value"
+            else:
+                raise ValueError(f"Ожидалась ',' или ']' после элемента массива, получено {buffer[pos:pos + 20]!r}.")
+            pos += 1
+            continue
+        if eof:
+            raise ValueError("Неожиданный конец JSON: массив не закрыт.")
+        chunk = text.read(IMPORT_JSON_CHUNK)
+        eof = not chunk
+        buffer, pos = buffer[pos:] + chunk, 0
+
+
+def iter_document_rows(raw, extension: str):
+    """Построчно отдает (номер_строки, словарь_полей) из CSV, JSON-массива или JSON Lines.
+
+    Все три формата разбираются потоково; для JSON-массива номер строки - номер элемента.
+    """
+    if extension == "csv":
+        text = io.TextIOWrapper(raw, encoding="utf-8-sig", newline="")
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, row
+    elif extension == "jsonl":
+        text = io.TextIOWrapper(raw, encoding="utf-8-sig")
+        for line_num, line in enumerate(text, start=1):
+            if line.strip():
+                yield line_num, json.loads(line)
+    else:
+        for index, row in enumerate(iter_json_array(io.TextIOWrapper(raw, encoding="utf-8-sig")), start=1):
+            yield index, row
+
+
+def _field(row: dict, name: str) -> str:
+    value = row.get(name)
+    return "" if value is None else str(value).strip()
+
+
+class SlotIntervals:
+    """Отсортированные интервалы слотов по услугам для проверки пересечений без запросов к БД."""
+
+    def __init__(self):
+        self._starts = {} # service_id -> отсортированный список начал
+        self._ends = {}   # service_id -> концы в том же порядке
+
+    def add(self, service_id: int, start, end) -> None:
+        starts = self._starts.setdefault(service_id, [])
+        ends = self._ends.setdefault(service_id, [])
+        index = bisect.bisect_left(starts, start)
+        starts.insert(index, start)
+        ends.insert(index, end)
+
+    def conflict(self, service_id: int, start, end):
+        """Возвращает (начало, конец) пересекающегося слота или None."""
+        starts = self._starts.get(service_id)
+        if not starts:
+            return None
+        ends = self._ends[service_id]
+        index = bisect.bisect_left(starts, start)
+        # Слоты одной услуги не пересекаются, поэтому достаточно проверить соседей
+        for neighbour in (index - 1, index):
+            if 0 <= neighbour < len(starts) and starts[neighbour] < end and ends[neighbour] > start:
+                return starts[neighbour], ends[neighbour]
+        return None
+
+
+def insert_services(db: Session, rows: list[dict]) -> list[int]:
+    """Операция записи: вставляет пачку услуг одним executemany и возвращает их ID по порядку."""
+    return db.scalars(
+        insert(Service).returning(Service.service_id, sort_by_parameter_order=True), rows
+    ).all()
+
+
+def insert_slots(db: Session, batch: list[tuple]) -> tuple[int, list[tuple[int, str]]]:
+    """Операция записи: проверяет пачку слотов на пересечения и вставляет подходящие.
+
+    batch - список (номер строки, service_id, начало, конец, мест), время - секунды UTC epoch.
+    Возвращает (вставлено, ошибки по строкам).
+    """
+    # Один запрос на все существующие слоты затронутых услуг в диапазоне пачки
+    service_ids = {service_id for _, service_id, _, _, _ in batch}
+    range_start = min(start for _, _, start, _, _ in batch)
+    range_end = max(end for _, _, _, end, _ in batch)
+    intervals = SlotIntervals()
+    for service_id, start, end in db.query(TimeSlot.service_id, TimeSlot.start_time, TimeSlot.end_time).filter(
+        TimeSlot.service_id.in_(service_ids),
+        TimeSlot.start_time < range_end,
+        TimeSlot.end_time > range_start
+    ):
+        intervals.add(service_id, start, end)
+
+    rows, errors = [], []
+    for line_num, service_id, start, end, capacity in batch:
+        conflict = intervals.conflict(service_id, start, end)
+        if conflict:
+            if conflict[0] == start:
+                errors.append((line_num, f"Слот на {format_ts(start)} уже существует."))
+            else:
+                errors.append((line_num, f"Слот пересекается с существующим слотом "
+                                         f"{format_ts(conflict[0], '%H:%M')} - {format_ts(conflict[1], '%H:%M')}."))
+            continue
+        intervals.add(service_id, start, end) # Строки файла тоже не должны пересекаться между собой
+        rows.append({"service_id": service_id, "start_time": start, "end_time": end, "is_available": True, "capacity": capacity})
+
+    if rows:
+        db.execute(insert(TimeSlot), rows)
+    return len(rows), errors
+
+
+class BulkImporter:
+    """Проверяет строки импорта по правилам /add_service и /add_slot и вставляет их пачками.
+
+    Работает в рабочем потоке (см. import_rows): изменения выполняются через run_write_from_thread.
+    """
+
+    def __init__(self, db: Session, provider_id: int, tenant: str, loop: asyncio.AbstractEventLoop):
+        self.provider_id = provider_id
+        self.tenant = tenant
+        self.loop = loop
+        self.services_by_name = {}
+        self.service_durations = {}
+        for service_id, name, duration in db.query(Service.service_id, Service.name, Service.duration_minutes)\
+                .filter(Service.provider_id == provider_id):
+            self.services_by_name[name] = service_id
+            self.service_durations[service_id] = duration
+        self.pending_services = [] # (номер строки, словарь полей для INSERT)
+        self.pending_names = set()
+        self.pending_slots = []    # (номер строки, service_id, start, end, capacity)
+        self.errors = []           # (номер строки, текст ошибки)
+        self.services_added = 0
+        self.slots_added = 0
+
+    def add_row(self, line_num: int, row: dict) -> None:
+        if not isinstance(row, dict):
+            self.errors.append((line_num, "Строка должна быть объектом с полями."))
+            return
+        row_type = _field(row, "type").lower()
+        try:
+            if row_type == "service":
+                self._add_service_row(line_num, row)
+            elif row_type == "slot":
+                self._add_slot_row(line_num, row)
+            else:
+                raise ValueError("Поле type должно быть 'service' или 'slot'.")
+        except ValueError as e_row:
+            self.errors.append((line_num, str(e_row)))
+
+        if len(self.pending_services) >= IMPORT_BATCH_SIZE:
+            self.flush_services()
+        if len(self.pending_slots) >= IMPORT_BATCH_SIZE:
+            self.flush_slots()
+
+    def _add_service_row(self, line_num: int, row: dict) -> None:
+        # Полная форма "Название; Описание; Длительность; Цена" - те же проверки, что и у /add_service
+        parts = [_field(row, "name"), _field(row, "description"), _field(row, "duration_minutes"), _field(row, "price") or "0"]
+        name, description, duration_minutes, price = parse_service_fields(parts)
+        if name in self.services_by_name or name in self.pending_names:
+            raise ValueError(f"Услуга '{name}' уже существует.")
+        self.pending_names.add(name)
+        self.pending_services.append((line_num, {
+            "provider_id": self.provider_id,
+            "name": name,
+            "description": description,
+            "duration_minutes": duration_minutes,
+            "price": price,
+        }))
+
+    def _resolve_service(self, reference: str) -> int:
+        if not reference:
+            raise ValueError("Не указана услуга (поле service: ID или название).")
+        if reference.isdigit() and int(reference) in self.service_durations:
+            return int(reference)
+        if reference in self.pending_names:
+            self.flush_services() # Услуга объявлена выше в этом же файле
+        if reference in self.services_by_name:
+            return self.services_by_name[reference]
+        raise ValueError(f"Услуга '{reference}' не найдена или не принадлежит вам.")
+
+    def _add_slot_row(self, line_num: int, row: dict) -> None:
+        service_id = self._resolve_service(_field(row, "service"))
+        start_str = _field(row, "start") or f"{_field(row, 'date')} {_field(row, 'time')}"
+        start_ts = parse_slot_start(start_str)
+        capacity = parse_slot_capacity(_field(row, "capacity"))
+        end_ts = start_ts + self.service_durations[service_id] * 60
+        self.pending_slots.append((line_num, service_id, start_ts, end_ts, capacity))
+
+    def flush_services(self) -> None:
+        if not self.pending_services:
+            return
+        rows = [values for _, values in self.pending_services]
+        new_ids = run_write_from_thread(partial(insert_services, rows=rows), self.loop)
+        self.loop.call_soon_threadsafe(invalidate_catalog_index, self.tenant)
+        for values, service_id in zip(rows, new_ids):
+            self.services_by_name[values["name"]] = service_id
+            self.service_durations[service_id] = values["duration_minutes"]
+        self.services_added += len(rows)
+        self.pending_services = []
+        self.pending_names.clear()
+
+    def flush_slots(self) -> None:
+        if not self.pending_slots:
+            return
+        batch, self.pending_slots = self.pending_slots, []
+        inserted, errors = run_write_from_thread(partial(insert_slots, batch=batch), self.loop)
+        self.slots_added += inserted
+        self.errors.extend(errors)
+
+    def finish(self) -> None:
+        self.flush_services()
+        self.flush_slots()
+
+    def error_report(self) -> bytes:
+        report = io.StringIO()
+        writer = csv.writer(report)
+        writer.writerow(["row", "error"])
+        writer.writerows(sorted(self.errors))
+        return report.getvalue().encode("utf-8-sig")
+
+
+def import_rows(raw, extension: str, provider_id: int, tenant: str, loop: asyncio.AbstractEventLoop) -> BulkImporter:
+    """Разбирает файл и вставляет строки пачками. Выполняется в рабочем потоке (asyncio.to_thread)."""
+    db: Session = next(get_read_db()) # Сессия апдейта принадлежит event loop, здесь - своя
+    try:
+        importer = BulkImporter(db, provider_id, tenant, loop)
+    finally:
+        db.close()
+    try:
+        for line_num, row in iter_document_rows(raw, extension):
+            importer.add_row(line_num, row)
+    except (ValueError, csv.Error) as e_parse: # Битый JSON/CSV: сохраняем то, что успели разобрать
+        importer.errors.append((0, f"Ошибка разбора файла: {e_parse}"))
+    importer.finish()
+    return importer
+
+
+async def import_document(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Массовый импорт услуг и слотов поставщика из присланного CSV/JSON документа."""
+    user = update.effective_user
+    document = update.message.document
+    db: Session = update_session(context)
+
+    try:
+        current_provider = get_active_provider(context, user.id)
+        if not current_provider:
+            await update.message.reply_text(
+                "Импорт доступен только для зарегистрированных и активных поставщиков услуг.",
+                parse_mode=ParseMode.HTML
+            )
+            return
+
+        extension = (document.file_name or "").rsplit(".", 1)[-1].lower()
+        if extension not in IMPORT_EXTENSIONS:
+            await update.message.reply_text("Поддерживаются файлы .csv, .json и .jsonl.")
+            return
+        if document.file_size and document.file_size > IMPORT_MAX_FILE_SIZE:
+            await update.message.reply_text("Файл слишком большой. Максимальный размер - 20 МБ.")
+            return
+
+        # Файл - во временном файле на диске, разбор и вставка - в потоке: event loop не ждет импорт
+        with tempfile.TemporaryFile() as raw:
+            telegram_file = await document.get_file()
+            await telegram_file.download_to_memory(raw)
+            raw.seek(0)
+            importer = await asyncio.to_thread(import_rows, raw, extension, current_provider.provider_id,
+                                               current_provider.tenant, asyncio.get_running_loop())
+
+        await update.message.reply_text(
+            f"<b>Импорт завершен.</b>\n"
+            f"Добавлено услуг: {importer.services_added}\n"
+            f"Добавлено слотов: {importer.slots_added}\n"
+            f"Строк с ошибками: {len(importer.errors)}",
+            parse_mode=ParseMode.HTML
+        )
+        if importer.errors:
+            await update.message.reply_document(
+                document=InputFile(importer.error_report(), filename="import_errors.csv"),
+                caption="Отчет об ошибках по строкам файла."
+            )
+        logger.info("Provider %s imported %s: %s services, %s slots, %s errors", current_provider.provider_id, document.file_name, importer.services_added, importer.slots_added, len(importer.errors))
+
+    except Exception as e:
+        logger.error("Error in import_document for user %s (Provider ID: %s): %s", user.id, current_provider.provider_id if 'current_provider' in locals() and current_provider else 'N/A', e)
+        db.rollback()
+        await update.message.reply_text(
+            "Произошла ошибка при импорте файла. Пожалуйста, проверьте формат данных или попробуйте позже."
+        )
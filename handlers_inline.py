@@ -0,0 +1,134 @@
+# handlers_inline.py
+import asyncio
+import html
+import logging
+import time
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InlineQueryResultArticle, InputTextMessageContent
+from telegram.constants import ParseMode
+from telegram.ext import ContextTypes
+from catalog_index import CatalogEntry, CatalogIndex
+from database import Provider, Service, TimeSlot
+from db_access import get_read_db, update_session, current_tenant
+from single_flight import SingleFlight
+from timeutil import now_ts, format_ts
+from virtual_slots import next_virtual_starts
+
+logger = logging.getLogger(__name__)
+
+INLINE_RESULTS_LIMIT = 20 # Результатов на страницу (Telegram допускает до 50)
+INLINE_CACHE_TIME = 60 # Сколько секунд серверы Telegram отдают сохраненный ответ на тот же запрос
+CATALOG_INDEX_TTL = 300 # Не реже чем раз в столько секунд индекс перестраивается из БД
+
+# Индекс общий для всех пользователей бота и перестраивается целиком: каталог меняется редко,
+# а запросы идут на каждое нажатие клавиши. Одновременные перестроения объединяются.
+# Боты одного процесса (multibot.py) делят этот кэш, но у каждого арендатора свой индекс.
+_catalog_indexes: dict[str, tuple[CatalogIndex, float]] = {} # арендатор -> (индекс, когда построен)
+_index_flights = SingleFlight(result_ttl=0)
+
+
+def load_catalog_entries(db: Session, tenant: str) -> list[CatalogEntry]:
+    """Услуги активных поставщиков арендатора - одним запросом, только нужные индексу колонки."""
+    rows = db.query(Service.service_id, Service.name, Provider.name, Service.duration_minutes, Service.price)\
+        .join(Provider, Service.provider_id == Provider.provider_id)\
+        .filter(Provider.tenant == tenant, Provider.is_active == True)
+    return [CatalogEntry(*row) for row in rows]
+
+
+def rebuild_catalog_index(tenant: str) -> CatalogIndex:
+    """Строит индекс арендатора заново (синхронно, вызывается в отдельном потоке) и делает его текущим."""
+    started = time.perf_counter()
+    db: Session = next(get_read_db())
+    try:
+        index = CatalogIndex(load_catalog_entries(db, tenant))
+    finally:
+        db.close()
+    _catalog_indexes[tenant] = (index, time.monotonic())
+    logger.info("Catalog index of %s rebuilt: %s services in %.3fs", tenant, len(index), time.perf_counter() - started)
+    return index
+
+
+def invalidate_catalog_index(tenant: str) -> None:
+    """Помечает индекс арендатора устаревшим; следующий inline-запрос перестроит его. Вызывать после изменения каталога."""
+    if tenant in _catalog_indexes:
+        _catalog_indexes[tenant] = (_catalog_indexes[tenant][0], 0.0)
+
+
+async def get_catalog_index(tenant: str) -> CatalogIndex:
+    cached = _catalog_indexes.get(tenant)
+    if cached is not None and time.monotonic() - cached[1] < CATALOG_INDEX_TTL:
+        return cached[0]
+    index, _ = await _index_flights.run(("catalog", tenant), lambda: asyncio.to_thread(rebuild_catalog_index, tenant))
+    return index
+
+
+def next_free_slots(db: Session, service_ids: list[int]) -> dict[int, int]:
+    """service_id -> начало ближайшего свободного будущего слота, одним запросом на страницу результатов."""
+    if not service_ids:
+        return {}
+    rows = db.query(TimeSlot.service_id, func.min(TimeSlot.start_time)).filter(
+        TimeSlot.service_id.in_(service_ids),
+        TimeSlot.is_available == True,
+        TimeSlot.start_time > now_ts()
+    ).group_by(TimeSlot.service_id)
+    return dict(rows.all())
+
+
+def _price_text(price: float | None) -> str:
+    return f"{price:.2f} руб." if price is not None and price > 0 else "цена не указана"
+
+
+def build_result(entry: CatalogEntry, next_start: int | None) -> InlineQueryResultArticle:
+    """Карточка услуги для inline-ответа; кнопка ведет к выбору времени, как в /services."""
+    next_text = f"ближайшее: {format_ts(next_start)}" if next_start else "нет свободного времени"
+    name = html.escape(entry.name)
+    provider_name = html.escape(entry.provider_name)
+    message = (
+        f"<b>Услуга:</b> {name}\n"
+        f"<i>От:</i> {provider_name}\n"
+        f"<i>Длительность:</i> {entry.duration_minutes} мин.\n"
+        f"<i>Цена:</i> {_price_text(entry.price)}\n"
+    )
+    return InlineQueryResultArticle(
+        id=str(entry.service_id),
+        title=entry.name,
+        description=f"{entry.provider_name} · {entry.duration_minutes} мин. · {_price_text(entry.price)} · {next_text}",
+        input_message_content=InputTextMessageContent(message, parse_mode=ParseMode.HTML),
+        reply_markup=InlineKeyboardMarkup([[
+            InlineKeyboardButton("🗓️ Выбрать время", callback_data=f"view_slots_{entry.service_id}")
+        ]]),
+    )
+
+
+async def inline_search(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Inline-режим (@bot запрос): услуги, подходящие под запрос, с ближайшим свободным временем.
+
+    Поиск идет по индексу в памяти, БД запрашивается только за ближайшими слотами текущей
+    страницы (хранимыми и вычисленными по правилам расписания). Ответ одинаков для всех
+    пользователей (is_personal=False), поэтому Telegram кэширует популярные запросы на своей
+    стороне и они до нас не доходят.
+    """
+    inline_query = update.inline_query
+    try:
+        offset = int(inline_query.offset or 0)
+    except ValueError:
+        offset = 0
+
+    try:
+        index = await get_catalog_index(current_tenant(context))
+        entries, next_offset = index.search(inline_query.query, offset, INLINE_RESULTS_LIMIT)
+        db: Session = update_session(context)
+        next_starts = next_free_slots(db, [entry.service_id for entry in entries])
+        # Услуги с правилами расписания: ближайшее время по правилам, если оно раньше хранимых слотов
+        for service_id, start in next_virtual_starts(db, {entry.service_id: entry.duration_minutes for entry in entries}).items():
+            if service_id not in next_starts or start < next_starts[service_id]:
+                next_starts[service_id] = start
+        await inline_query.answer(
+            [build_result(entry, next_starts.get(entry.service_id)) for entry in entries],
+            cache_time=INLINE_CACHE_TIME,
+            is_personal=False,
+            next_offset=str(next_offset) if next_offset is not None else "",
+        )
+    except Exception as e:
+        logger.error("Error in inline_search for query %r (offset %s): %s", inline_query.query, offset, e)
@@ -1,13 +1,127 @@
 # handlers_provider.py
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime
 from sqlalchemy.orm import Session
 from telegram import Update
 from telegram.constants import ParseMode
 from telegram.ext import ContextTypes
-from database import get_db, Provider, Service, TimeSlot, Booking
+from database import Provider, Service, TimeSlot, Booking
+from db_access import run_write, update_session, get_active_provider, current_tenant
+from handlers_inline import invalidate_catalog_index
+from handlers_waitlist import offer_freed_slot, send_offer
+from message_packer import MessagePacker
+from read_models import provider_services, provider_slots
+from slot_seats import free_seat
+from timeutil import now_ts, to_ts, format_ts
 
 logger = logging.getLogger(__name__)
+view_logger = logging.getLogger(f"{__name__}.views") # Частые строки о просмотрах; их можно прореживать (LOG_SAMPLING)
+
+SLOT_DATETIME_FORMAT = "%Y-%m-%d %H:%M"
+MAX_SLOT_CAPACITY = 500 # Мест в одном слоте (групповом занятии)
+
+
+def parse_service_fields(parts: list[str]) -> tuple[str, str, int, float]:
+    """Разбирает поля услуги: Название; [Описание]; Длительность (мин); [Цена].
+
+    Общие правила проверки для /add_service и массового импорта.
+    Возвращает (название, описание, длительность, цена), при ошибке бросает ValueError
+    с текстом для пользователя.
+    """
+    if len(parts) < 2 or len(parts) > 4 : # Минимум: Название, Длительность. Максимум + Описание, Цена
+        raise ValueError(
+            "Неверный формат. Используйте: `/add_service Название; [Описание]; Длительность (мин); [Цена]`\n"
+            "Описание и цена - необязательные поля. Разделяйте данные точкой с запятой ';'.\n"
+            "Пример только с обязательными полями: `/add_service Экспресс-маникюр; 30` (описание пустое, цена 0)\n"
+            "Пример со всеми полями: `/add_service Полный уход; Спа-процедуры для рук; 90; 1500`"
+        )
+
+    service_name = parts[0]
+
+    # Длительность должна быть в предпоследней или последней позиции
+    try:
+        duration_minutes_str = ""
+        if len(parts) == 2: # Название; Длительность
+            duration_minutes_str = parts[1]
+        elif len(parts) == 3: # Название; Описание; Длительность ИЛИ Название; Длительность; Цена
+            # Пытаемся предпоследний как длительность
+            try:
+                int(parts[1]) # Название; Длительность; Цена
+                duration_minutes_str = parts[1]
+            except ValueError: # Значит это Название; Описание; Длительность
+                duration_minutes_str = parts[2]
+        elif len(parts) == 4: # Название; Описание; Длительность; Цена
+            duration_minutes_str = parts[2]
+
+        duration_minutes = int(duration_minutes_str)
+    except ValueError:
+        raise ValueError("Неверный формат длительности. Укажите количество минут (целое число).")
+    if duration_minutes <= 0:
+        raise ValueError("Длительность услуги должна быть положительным числом минут.")
+
+    # Определение описания и цены на основе количества аргументов
+    description = ""
+    price_str = None
+
+    if len(parts) == 3:
+        # Это может быть (Название; Описание; Длительность) или (Название; Длительность; Цена)
+        try: # Проверяем, является ли второй аргумент (parts[1]) числом (длительностью)
+            int(parts[1]) # Если да, то это (Название; Длительность; Цена)
+            price_str = parts[2]
+        except ValueError: # Если второй аргумент не число, то это (Название; Описание; Длительность)
+            description = parts[1]
+    elif len(parts) == 4: # Название; Описание; Длительность; Цена
+        description = parts[1]
+        price_str = parts[3]
+
+    price = 0.0
+    if price_str is not None:
+        try:
+            price = float(price_str)
+        except ValueError:
+            raise ValueError("Неверный формат цены. Укажите число.")
+        if price < 0:
+            raise ValueError("Цена не может быть отрицательной.")
+
+    if not service_name:
+        raise ValueError("Название услуги не может быть пустым.")
+
+    return service_name, description, duration_minutes, price
+
+
+def parse_slot_start(datetime_str: str) -> int:
+    """Разбирает время начала слота в формате ГГГГ-ММ-ДД ЧЧ:ММ (местное время) и проверяет, что оно в будущем.
+
+    Общие правила для /add_slot и массового импорта. Возвращает секунды UTC epoch;
+    при ошибке бросает ValueError.
+    """
+    try:
+        start_time_dt = datetime.strptime(datetime_str, SLOT_DATETIME_FORMAT)
+    except ValueError:
+        raise ValueError(
+            "Неверный формат даты или времени. Используйте `ГГГГ-ММ-ДД ЧЧ:ММ`.\n"
+            "Пример: `2024-07-15 10:00`"
+        )
+
+    start_ts = to_ts(start_time_dt)
+    # Проверка, что время не в прошлом
+    if start_ts < now_ts():
+        raise ValueError("Нельзя добавлять слоты на прошедшее время.")
+    return start_ts
+
+
+def parse_slot_capacity(capacity_str: str) -> int:
+    """Разбирает число мест слота (пусто - одно место). Общие правила для /add_slot и импорта; ValueError при ошибке."""
+    if not capacity_str:
+        return 1
+    try:
+        capacity = int(capacity_str)
+    except ValueError:
+        capacity = 0
+    if capacity < 1 or capacity > MAX_SLOT_CAPACITY:
+        raise ValueError(f"Число мест должно быть целым числом от 1 до {MAX_SLOT_CAPACITY}.")
+    return capacity
+
 
 async def register_provider(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Регистрирует нового поставщика услуг."""
@@ -23,11 +137,27 @@ async def register_provider(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return
 
     provider_name = " ".join(args) # Объединяем все аргументы в одну строку - это имя провайдера
-    db: Session = next(get_db()) # Получаем сессию БД
+    db: Session = update_session(context) # Сессия апдейта (только чтение, изменения - через run_write)
 
     try:
         # Проверяем, не зарегистрирован ли уже такой пользователь
-        existing_provider = db.query(Provider).filter(Provider.telegram_id == user.id).first()
+        tenant = current_tenant(context)
+        existing_provider = db.query(Provider).filter(Provider.tenant == tenant, Provider.telegram_id == user.id).first()
+        if existing_provider and not existing_provider.is_active: # Деактивирован (/deactivate_provider) - возвращаем
+            provider_id = existing_provider.provider_id
+
+            def reactivate_provider(write_db: Session) -> None:
+                write_db.query(Provider).filter(Provider.provider_id == provider_id).update({"is_active": True})
+
+            await run_write(reactivate_provider)
+            invalidate_catalog_index(tenant)
+            await update.message.reply_text(
+                f"С возвращением, <b>{existing_provider.name}</b>! Ваш профиль поставщика снова активен.\n"
+                f"Отмененные бронирования не восстанавливаются, свободные слоты снова видны клиентам.",
+                parse_mode=ParseMode.HTML
+            )
+            logger.info("Provider %s reactivated", provider_id)
+            return
         if existing_provider:
             await update.message.reply_text(
                 f"Вы уже зарегистрированы как поставщик услуг под именем: <b>{existing_provider.name}</b>.",
@@ -36,37 +166,38 @@ async def register_provider(update: Update, context: ContextTypes.DEFAULT_TYPE)
             return
 
         # Создаем нового поставщика
-        new_provider = Provider(telegram_id=user.id, name=provider_name)
-        db.add(new_provider)
-        db.commit()
-        db.refresh(new_provider) # Обновляем объект, чтобы получить provider_id
+        def create_provider(write_db: Session) -> int:
+            new_provider = Provider(tenant=tenant, telegram_id=user.id, name=provider_name)
+            write_db.add(new_provider)
+            write_db.flush() # Получаем provider_id до commit
+            return new_provider.provider_id
+
+        new_provider_id = await run_write(create_provider)
 
         await update.message.reply_text(
             f"Поздравляем, <b>{provider_name}</b>! Вы успешно зарегистрированы как поставщик услуг.\n"
-            f"Ваш ID поставщика: <code>{new_provider.provider_id}</code> (он может понадобиться позже).\n"
+            f"Ваш ID поставщика: <code>{new_provider_id}</code> (он может понадобиться позже).\n"
             f"Теперь вы можете добавлять свои услуги и временные слоты.",
             parse_mode=ParseMode.HTML
         )
-        logger.info(f"Provider registered: {provider_name} (Telegram ID: {user.id}, Provider ID: {new_provider.provider_id})")
+        logger.info("Provider registered: %s (Telegram ID: %s, Provider ID: %s)", provider_name, user.id, new_provider_id)
 
     except Exception as e:
-        logger.error(f"Error during provider registration for user {user.id}: {e}")
+        logger.error("Error during provider registration for user %s: %s", user.id, e)
         db.rollback() # Откатываем изменения в БД в случае ошибки
         await update.message.reply_text(
             "Произошла ошибка при регистрации. Пожалуйста, попробуйте позже."
         )
-    finally:
-        if 'db' in locals() and db: db.close()
 
 
 async def add_service(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Добавляет новую услугу для зарегистрированного поставщика."""
     user = update.effective_user
-    db: Session = next(get_db())
+    db: Session = update_session(context)
 
     try:
         # 1. Проверяем, является ли пользователь зарегистрированным поставщиком
-        current_provider = db.query(Provider).filter(Provider.telegram_id == user.id, Provider.is_active == True).first()
+        current_provider = get_active_provider(context, user.id)
         if not current_provider:
             await update.message.reply_text(
                 "Эта команда доступна только для зарегистрированных и активных поставщиков услуг.\n"
@@ -91,120 +222,55 @@ async def add_service(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         full_args_str = " ".join(context.args)
         parts = [p.strip() for p in full_args_str.split(';')]
 
-        if len(parts) < 2 or len(parts) > 4 : # Минимум: Название, Длительность. Максимум + Описание, Цена
-            await update.message.reply_text(
-                "Неверный формат. Используйте: `/add_service Название; [Описание]; Длительность (мин); [Цена]`\n"
-                "Описание и цена - необязательные поля. Разделяйте данные точкой с запятой ';'.\n"
-                "Пример только с обязательными полями: `/add_service Экспресс-маникюр; 30` (описание пустое, цена 0)\n"
-                "Пример со всеми полями: `/add_service Полный уход; Спа-процедуры для рук; 90; 1500`",
-                parse_mode=ParseMode.HTML
-            )
-            return
-
-        service_name = parts[0]
-
-        # Длительность должна быть в предпоследней или последней позиции
         try:
-            duration_minutes_str = ""
-            if len(parts) == 2: # Название; Длительность
-                duration_minutes_str = parts[1]
-            elif len(parts) == 3: # Название; Описание; Длительность ИЛИ Название; Длительность; Цена
-                # Пытаемся предпоследний как длительность
-                try:
-                    duration_minutes = int(parts[1]) # Название; Длительность; Цена
-                    duration_minutes_str = parts[1]
-                except ValueError: # Значит это Название; Описание; Длительность
-                    duration_minutes_str = parts[2]
-            elif len(parts) == 4: # Название; Описание; Длительность; Цена
-                duration_minutes_str = parts[2]
-
-            duration_minutes = int(duration_minutes_str)
-            if duration_minutes <= 0:
-                await update.message.reply_text("Длительность услуги должна быть положительным числом минут.")
-                return
-        except ValueError:
-            await update.message.reply_text("Неверный формат длительности. Укажите количество минут (целое число).")
-            return
-        except IndexError:
-            await update.message.reply_text("Ошибка при разборе аргументов. Проверьте формат ввода.")
-            return
-
-        # Определение описания и цены на основе количества аргументов
-        description = ""
-        price = 0.0
-
-        if len(parts) == 2: # Название; Длительность
-            pass # description и price остаются по умолчанию
-        elif len(parts) == 3:
-            # Это может быть (Название; Описание; Длительность) или (Название; Длительность; Цена)
-            try: # Проверяем, является ли второй аргумент (parts[1]) числом (длительностью)
-                int(parts[1]) # Если да, то это (Название; Длительность; Цена)
-                price_str = parts[2]
-                try:
-                    price = float(price_str)
-                    if price < 0:
-                        await update.message.reply_text("Цена не может быть отрицательной.")
-                        return
-                except ValueError:
-                    await update.message.reply_text("Неверный формат цены. Укажите число.")
-                    return
-            except ValueError: # Если второй аргумент не число, то это (Название; Описание; Длительность)
-                description = parts[1]
-        elif len(parts) == 4: # Название; Описание; Длительность; Цена
-            description = parts[1]
-            price_str = parts[3]
-            try:
-                price = float(price_str)
-                if price < 0:
-                    await update.message.reply_text("Цена не может быть отрицательной.")
-                    return
-            except ValueError:
-                await update.message.reply_text("Неверный формат цены. Укажите число.")
-                return
-
-        if not service_name:
-            await update.message.reply_text("Название услуги не может быть пустым.")
+            service_name, description, duration_minutes, price = parse_service_fields(parts)
+        except ValueError as e_parse:
+            await update.message.reply_text(str(e_parse), parse_mode=ParseMode.HTML)
             return
 
         # 3. Создаем и сохраняем услугу
-        new_service = Service(
-            provider_id=current_provider.provider_id,
-            name=service_name,
-            description=description,
-            duration_minutes=duration_minutes,
-            price=price
-        )
-        db.add(new_service)
-        db.commit()
-        db.refresh(new_service)
+        provider_id = current_provider.provider_id
+
+        def create_service(write_db: Session) -> int:
+            new_service = Service(
+                provider_id=provider_id,
+                name=service_name,
+                description=description,
+                duration_minutes=duration_minutes,
+                price=price
+            )
+            write_db.add(new_service)
+            write_db.flush()
+            return new_service.service_id
+
+        new_service_id = await run_write(create_service)
+        invalidate_catalog_index(current_tenant(context)) # Новая услуга должна находиться в inline-поиске
 
         await update.message.reply_text(
-            f"Услуга '<b>{new_service.name}</b>' успешно добавлена!\n"
-            f"ID услуги: <code>{new_service.service_id}</code>\n"
-            f"Длительность: {new_service.duration_minutes} мин.\n"
-            f"Описание: {new_service.description if new_service.description else 'не указано'}\n"
-            f"Цена: {new_service.price if new_service.price is not None else 'не указана'}",
+            f"Услуга '<b>{service_name}</b>' успешно добавлена!\n"
+            f"ID услуги: <code>{new_service_id}</code>\n"
+            f"Длительность: {duration_minutes} мин.\n"
+            f"Описание: {description if description else 'не указано'}\n"
+            f"Цена: {price if price is not None else 'не указана'}",
             parse_mode=ParseMode.HTML
         )
-        logger.info(f"Service added by provider {current_provider.provider_id}: {new_service.name} (Service ID: {new_service.service_id})")
+        logger.info("Service added by provider %s: %s (Service ID: %s)", provider_id, service_name, new_service_id)
 
     except Exception as e:
-        logger.error(f"Error during service addition for user {user.id} (Provider ID: {current_provider.provider_id if 'current_provider' in locals() and current_provider else 'N/A'}): {e}")
+        logger.error("Error during service addition for user %s (Provider ID: %s): %s", user.id, current_provider.provider_id if 'current_provider' in locals() and current_provider else 'N/A', e)
         db.rollback()
         await update.message.reply_text(
             "Произошла ошибка при добавлении услуги. Пожалуйста, проверьте формат данных или попробуйте позже."
         )
-    finally:
-        if 'db' in locals() and db: db.close()
 
 async def my_services(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Показывает список услуг, добавленных текущим поставщиком."""
     user = update.effective_user
-    db: Session = next(get_db())
+    db: Session = update_session(context)
 
     try:
         # 1. Проверяем, является ли пользователь зарегистрированным поставщиком
-        current_provider = db.query(Provider).filter(Provider.telegram_id == user.id, Provider.is_active == True).first()
+        current_provider = get_active_provider(context, user.id)
         if not current_provider:
             await update.message.reply_text(
                 "Эта команда доступна только для зарегистрированных и активных поставщиков услуг.\n"
@@ -214,7 +280,7 @@ async def my_services(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
             return
 
         # 2. Получаем все услуги этого поставщика
-        services = db.query(Service).filter(Service.provider_id == current_provider.provider_id).all()
+        services = provider_services(db, current_provider.provider_id, current_provider.name)
 
         if not services:
             await update.message.reply_text(
@@ -224,11 +290,10 @@ async def my_services(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
             )
             return
 
-        response_text = f"<b>Ваши услуги ({current_provider.name}):</b>\n\n"
+        packer = MessagePacker(header=f"<b>Ваши услуги ({current_provider.name}):</b>\n\n")
         for service in services:
             price_str = f"{service.price:.2f} руб." if service.price is not None and service.price > 0 else "не указана"
-            description_str = f" - <i>{service.description}</i>" if service.description else ""
-            response_text += (
+            packer.add(
                 f"<b>ID:</b> <code>{service.service_id}</code>\n"
                 f"<b>Название:</b> {service.name}\n"
                 f"<b>Длительность:</b> {service.duration_minutes} мин.\n"
@@ -237,31 +302,27 @@ async def my_services(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
                 f"--------------------\n"
             )
         
-        # Ограничение на длину сообщения в Telegram (4096 символов)
-        # Если список очень длинный, нужно будет разбивать на несколько сообщений
-        if len(response_text) > 4090: # Небольшой запас
-            logger.warning(f"Response text for my_services is too long ({len(response_text)} chars) for provider {current_provider.provider_id}. May be truncated by Telegram.")
-
-
-        await update.message.reply_text(response_text, parse_mode=ParseMode.HTML)
-        logger.info(f"Provider {current_provider.provider_id} viewed their services. Count: {len(services)}")
+        # Длинный список разбивается на сообщения в пределах лимита Telegram (4096 символов)
+        await packer.reply(update.message)
+        view_logger.info("Provider %s viewed their services. Count: %s", current_provider.provider_id, len(services))
 
     except Exception as e:
-        logger.error(f"Error in my_services for user {user.id} (Provider ID: {current_provider.provider_id if 'current_provider' in locals() and current_provider else 'N/A'}): {e}")
+        logger.error("Error in my_services for user %s (Provider ID: %s): %s", user.id, current_provider.provider_id if 'current_provider' in locals() and current_provider else 'N/A', e)
         await update.message.reply_text(
             "Произошла ошибка при получении списка ваших услуг. Пожалуйста, попробуйте позже."
         )
-    finally:
-        if 'db' in locals() and db: db.close()
 
 async def add_slot(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Добавляет временной слот для указанной услуги поставщика."""
+    """Добавляет временной слот для указанной услуги поставщика.
+
+    Необязательный последний аргумент - число мест: групповое занятие хранится одной строкой.
+    """
     user = update.effective_user
-    db: Session = next(get_db())
+    db: Session = update_session(context)
 
     try:
         # 1. Проверяем, является ли пользователь зарегистрированным поставщиком
-        current_provider = db.query(Provider).filter(Provider.telegram_id == user.id, Provider.is_active == True).first()
+        current_provider = get_active_provider(context, user.id)
         if not current_provider:
             await update.message.reply_text(
                 "Эта команда доступна только для зарегистрированных и активных поставщиков услуг.",
@@ -269,11 +330,11 @@ async def add_slot(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             )
             return
 
-        # 2. Парсим аргументы: ID_услуги и ДатаВремя начала слота
+        # 2. Парсим аргументы: ID_услуги, ДатаВремя начала слота и, необязательно, число мест
         if len(context.args) < 2: # Ожидаем ID и как минимум дату, время может быть через пробел
             await update.message.reply_text(
-                "Неверный формат. Используйте: `/add_slot <ID_услуги> <ГГГГ-ММ-ДД> <ЧЧ:ММ>`\n"
-                "Пример: `/add_slot 123 2024-07-15 10:00`",
+                "Неверный формат. Используйте: `/add_slot <ID_услуги> <ГГГГ-ММ-ДД> <ЧЧ:ММ> [мест]`\n"
+                "Пример: `/add_slot 123 2024-07-15 10:00` или `/add_slot 123 2024-07-15 18:00 12` для группы",
                 parse_mode=ParseMode.HTML
             )
             return
@@ -285,8 +346,8 @@ async def add_slot(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             return
 
         # Собираем дату и время из оставшихся аргументов
-        datetime_str_parts = context.args[1:]
-        if len(datetime_str_parts) != 2: # Ожидаем отдельно дату и отдельно время
+        datetime_str_parts = context.args[1:3]
+        if len(datetime_str_parts) != 2 or len(context.args) > 4: # Ожидаем отдельно дату и отдельно время
              await update.message.reply_text(
                 "Неверный формат даты и времени. Укажите дату и время раздельно.\n"
                 "Пример: `2024-07-15 10:00`",
@@ -297,21 +358,10 @@ async def add_slot(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         datetime_str = f"{datetime_str_parts[0]} {datetime_str_parts[1]}" # "ГГГГ-ММ-ДД ЧЧ:ММ"
 
         try:
-            start_time_dt = datetime.strptime(datetime_str, "%Y-%m-%d %H:%M")
-        except ValueError:
-            await update.message.reply_text(
-                "Неверный формат даты или времени. Используйте `ГГГГ-ММ-ДД ЧЧ:ММ`.\n"
-                "Пример: `2024-07-15 10:00`",
-                parse_mode=ParseMode.HTML
-            )
-            return
-        
-        # Проверка, что время не в прошлом
-        if start_time_dt < datetime.now():
-            await update.message.reply_text(
-                "Нельзя добавлять слоты на прошедшее время.",
-                parse_mode=ParseMode.HTML
-            )
+            start_ts = parse_slot_start(datetime_str)
+            capacity = parse_slot_capacity(context.args[3] if len(context.args) == 4 else "")
+        except ValueError as e_parse:
+            await update.message.reply_text(str(e_parse), parse_mode=ParseMode.HTML)
             return
 
         # 3. Проверяем, существует ли услуга с таким ID у этого поставщика
@@ -329,73 +379,82 @@ async def add_slot(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             return
 
         # 4. Рассчитываем время окончания слота
-        end_time_dt = start_time_dt + timedelta(minutes=service_for_slot.duration_minutes)
+        end_ts = start_ts + service_for_slot.duration_minutes * 60
+        service_id = service_for_slot.service_id
+
+        # 5-6. Проверка пересечений и вставка выполняются одной операцией записи,
+        # чтобы между проверкой и вставкой никто не занял это время
+        def create_slot(write_db: Session):
+            existing_slot_at_time = write_db.query(TimeSlot).filter(
+                TimeSlot.service_id == service_id,
+                TimeSlot.start_time == start_ts
+            ).first()
+            if existing_slot_at_time:
+                return "exists", existing_slot_at_time.is_available, None
+
+            overlapping_slot = write_db.query(TimeSlot).filter(
+                TimeSlot.service_id == service_id,
+                TimeSlot.start_time < end_ts,
+                TimeSlot.end_time > start_ts
+            ).first()
+            if overlapping_slot:
+                return "overlap", overlapping_slot.start_time, overlapping_slot.end_time
+
+            new_slot = TimeSlot(
+                service_id=service_id,
+                start_time=start_ts,
+                end_time=end_ts,
+                is_available=True,
+                capacity=capacity
+            )
+            write_db.add(new_slot)
+            write_db.flush()
+            return "created", new_slot.slot_id, None
 
-        existing_slot_at_time = db.query(TimeSlot).filter(
-            TimeSlot.service_id == service_for_slot.service_id,
-            TimeSlot.start_time == start_time_dt
-        ).first()
+        outcome, value, extra = await run_write(create_slot)
 
-        if existing_slot_at_time:
-            status_msg = "забронирован" if not existing_slot_at_time.is_available else "уже существует"
+        if outcome == "exists":
+            status_msg = "забронирован" if not value else "уже существует"
             await update.message.reply_text(
-                f"Слот для услуги '<b>{service_for_slot.name}</b>' на <i>{start_time_dt.strftime('%Y-%m-%d %H:%M')}</i> {status_msg}.",
+                f"Слот для услуги '<b>{service_for_slot.name}</b>' на <i>{format_ts(start_ts)}</i> {status_msg}.",
                 parse_mode=ParseMode.HTML
             )
             return
-        
-        overlapping_slots = db.query(TimeSlot).filter(
-            TimeSlot.service_id == service_for_slot.service_id,
-            TimeSlot.start_time < end_time_dt,
-            TimeSlot.end_time > start_time_dt
-        ).first()
 
-        if overlapping_slots:
+        if outcome == "overlap":
             await update.message.reply_text(
                 f"Новый слот пересекается с существующим слотом для услуги '<b>{service_for_slot.name}</b>'.\n"
-                f"Существующий слот: {overlapping_slots.start_time.strftime('%H:%M')} - {overlapping_slots.end_time.strftime('%H:%M')}",
+                f"Существующий слот: {format_ts(value, '%H:%M')} - {format_ts(extra, '%H:%M')}",
                 parse_mode=ParseMode.HTML
             )
             return
 
-
-        # 6. Создаем и сохраняем слот
-        new_slot = TimeSlot(
-            service_id=service_for_slot.service_id,
-            start_time=start_time_dt,
-            end_time=end_time_dt,
-            is_available=True
-        )
-        db.add(new_slot)
-        db.commit()
-        db.refresh(new_slot)
-
+        new_slot_id = value
         await update.message.reply_text(
             f"Временной слот для услуги '<b>{service_for_slot.name}</b>' успешно добавлен!\n"
-            f"ID слота: <code>{new_slot.slot_id}</code>\n"
-            f"Время: {new_slot.start_time.strftime('%Y-%m-%d %H:%M')} - {new_slot.end_time.strftime('%H:%M')}",
+            f"ID слота: <code>{new_slot_id}</code>\n"
+            f"Время: {format_ts(start_ts)} - {format_ts(end_ts, '%H:%M')}"
+            + (f"\nМест: {capacity}" if capacity > 1 else ""),
             parse_mode=ParseMode.HTML
         )
-        logger.info(f"Slot added by provider {current_provider.provider_id} for service {service_for_slot.service_id}: {new_slot.start_time} (Slot ID: {new_slot.slot_id})")
+        logger.info("Slot added by provider %s for service %s: %s (Slot ID: %s, capacity %s)", current_provider.provider_id, service_id, format_ts(start_ts), new_slot_id, capacity)
 
     except Exception as e:
-        logger.error(f"Error in add_slot for user {user.id} (Provider ID: {current_provider.provider_id if 'current_provider' in locals() and current_provider else 'N/A'}): {e}")
+        logger.error("Error in add_slot for user %s (Provider ID: %s): %s", user.id, current_provider.provider_id if 'current_provider' in locals() and current_provider else 'N/A', e)
         db.rollback()
         await update.message.reply_text(
             "Произошла ошибка при добавлении временного слота. Пожалуйста, проверьте формат данных или попробуйте позже."
         )
-    finally:
-        if 'db' in locals() and db: db.close()
 
 
 async def my_slots(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Показывает список временных слотов, добавленных поставщиком, с их статусом."""
     user = update.effective_user
-    db: Session = next(get_db())
+    db: Session = update_session(context)
 
     try:
         # 1. Проверяем, является ли пользователь зарегистрированным поставщиком
-        current_provider = db.query(Provider).filter(Provider.telegram_id == user.id, Provider.is_active == True).first()
+        current_provider = get_active_provider(context, user.id)
         if not current_provider:
             await update.message.reply_text(
                 "Эта команда доступна только для зарегистрированных и активных поставщиков услуг.",
@@ -403,12 +462,9 @@ async def my_slots(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             )
             return
 
-        # 2. Получаем все услуги этого поставщика, чтобы потом получить их слоты
-        slots_query = db.query(TimeSlot).join(Service).filter(Service.provider_id == current_provider.provider_id)
-        
-        slots_query = slots_query.order_by(TimeSlot.start_time) # Сортируем по времени начала
-        
-        all_slots = slots_query.all()
+        # 2. Получаем все слоты услуг этого поставщика по времени начала; название услуги и брони
+        # приходят теми же двумя запросами, а не отдельным запросом на каждый слот
+        all_slots = provider_slots(db, current_provider.provider_id)
 
 
         if not all_slots:
@@ -419,72 +475,65 @@ async def my_slots(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             )
             return
 
-        response_text = f"<b>Ваши временные слоты ({current_provider.name}):</b>\n\n"
+        packer = MessagePacker(header=f"<b>Ваши временные слоты ({current_provider.name}):</b>\n\n")
         
         # Группировка по услугам для лучшей читаемости (опционально, но красиво)
         slots_by_service = {}
         for slot in all_slots:
-            if slot.service.name not in slots_by_service:
-                slots_by_service[slot.service.name] = {"service_id": slot.service_id, "slots": []}
-            slots_by_service[slot.service.name]["slots"].append(slot)
+            if slot.service_name not in slots_by_service:
+                slots_by_service[slot.service_name] = {"service_id": slot.service_id, "slots": []}
+            slots_by_service[slot.service_name]["slots"].append(slot)
         
-        service_chunks = [] # Будем собирать текст по услугам, чтобы не превысить лимит
-
         for service_name, data in slots_by_service.items():
             service_id = data["service_id"]
-            current_service_text = f"<u><b>Услуга: {service_name} (ID: {service_id})</b></u>\n"
+            packer.add(f"<u><b>Услуга: {service_name} (ID: {service_id})</b></u>\n")
             
             if not data["slots"]:
-                current_service_text += "  <i>Нет доступных слотов для этой услуги.</i>\n\n"
-                service_chunks.append(current_service_text)
+                packer.add("  <i>Нет доступных слотов для этой услуги.</i>\n\n")
                 continue
 
             for slot in data["slots"]:
                 status_emoji = "✅" if slot.is_available else "❌"
                 status_text = "Свободен" if slot.is_available else "Забронирован"
-                
-                booking_info = ""
-                if not slot.is_available and slot.booking: # Если есть бронирование
-                    booking_info = f" (ID брони: <code>{slot.booking.booking_id}</code>, Клиент TG ID: <code>{slot.booking.client_telegram_id}</code>)"
-                
-                current_service_text += (
+                if slot.capacity > 1:
+                    status_text = f"Занято мест: {slot.booked_seats} из {slot.capacity}"
+                if slot.booked_seats > len(slot.bookings): # Место удерживается для клиента из очереди
+                    status_emoji = "⏳"
+                    status_text = (f"{status_text}, одно удерживается для очереди ожидания" if slot.capacity > 1
+                                   else "Удерживается для очереди ожидания")
+
+                booking_info = "".join( # Брони слота (у группового занятия их несколько)
+                    f"\n    ID брони: <code>{booking_id}</code>, Клиент TG ID: <code>{client_telegram_id}</code>"
+                    for booking_id, client_telegram_id in slot.bookings
+                )
+
+                packer.add(
                     f"  <b>ID слота:</b> <code>{slot.slot_id}</code>\n"
-                    f"  <b>Время:</b> {slot.start_time.strftime('%Y-%m-%d %H:%M')} - {slot.end_time.strftime('%H:%M')}\n"
+                    f"  <b>Время:</b> {format_ts(slot.start_time)} - {format_ts(slot.end_time, '%H:%M')}\n"
                     f"  <b>Статус:</b> {status_emoji} {status_text}{booking_info}\n"
                     f"  --------------------\n"
                 )
-            service_chunks.append(current_service_text + "\n") # Добавляем отступ между услугами
+            packer.add("\n") # Добавляем отступ между услугами
             
-        # Сборка и отправка сообщений
-        current_message = response_text
-        for chunk in service_chunks:
-            if len(current_message) + len(chunk) > 4090: # Проверяем перед добавлением нового чанка
-                await update.message.reply_text(current_message, parse_mode=ParseMode.HTML)
-                current_message = "" # Начинаем новое сообщение
-            current_message += chunk
-        
-        if current_message: # Отправляем остаток, если есть
-            await update.message.reply_text(current_message, parse_mode=ParseMode.HTML)
+        await packer.reply(update.message)
 
-        logger.info(f"Provider {current_provider.provider_id} viewed their slots. Total slots: {len(all_slots)}")
+        view_logger.info("Provider %s viewed their slots. Total slots: %s", current_provider.provider_id, len(all_slots))
 
     except Exception as e:
-        logger.error(f"Error in my_slots for user {user.id} (Provider ID: {current_provider.provider_id if 'current_provider' in locals() and current_provider else 'N/A'}): {e}")
+        logger.error("Error in my_slots for user %s (Provider ID: %s): %s", user.id, current_provider.provider_id if 'current_provider' in locals() and current_provider else 'N/A', e)
         await update.message.reply_text(
             "Произошла ошибка при получении списка ваших слотов. Пожалуйста, попробуйте позже."
         )
-    finally:
-        if 'db' in locals() and db: db.close()
 
 
 async def cancel_booking_provider(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Позволяет поставщику отменить бронирование по его ID."""
     user = update.effective_user
-    db: Session = next(get_db())
+    db: Session = update_session(context)
 
     try:
         # 1. Проверяем, является ли пользователь зарегистрированным поставщиком
-        current_provider = db.query(Provider).filter(Provider.telegram_id == user.id, Provider.is_active == True).first()
+        current_provider = get_active_provider(context, user.id)
         if not current_provider:    
             await update.message.reply_text(
                 "Эта команда доступна только для зарегистрированных и активных поставщиков услуг.",
@@ -513,13 +562,28 @@ async def cancel_booking_provider(update: Update, context: ContextTypes.DEFAULT_
             return
 
         # 3. Ищем бронирование и проверяем, что оно принадлежит услуге этого поставщика
-        # и что оно еще не отменено
-        booking_to_cancel = db.query(Booking).join(TimeSlot).join(Service).filter(
-            Booking.booking_id == booking_id_to_cancel,
-            Service.provider_id == current_provider.provider_id,
-        ).first()
+        # и что оно еще не отменено; 4. освобождаем слот и удаляем бронь - одной операцией записи
+        provider_id = current_provider.provider_id
+
+        def cancel_booking(write_db: Session):
+            booking_to_cancel = write_db.query(Booking).join(TimeSlot).join(Service).filter(
+                Booking.booking_id == booking_id_to_cancel,
+                Service.provider_id == provider_id,
+            ).first()
+            if not booking_to_cancel:
+                return None
+
+            slot_of_booking = booking_to_cancel.slot
+            details = (slot_of_booking.service.name, slot_of_booking.start_time, booking_to_cancel.client_telegram_id)
 
-        if not booking_to_cancel:
+            # Удаляем бронирование, возвращаем место и предлагаем его голове очереди ожидания
+            write_db.delete(booking_to_cancel)
+            free_seat(write_db, slot_of_booking)
+            return details + (offer_freed_slot(write_db, slot_of_booking),)
+
+        cancelled = await run_write(cancel_booking)
+
+        if not cancelled:
             await update.message.reply_text(
                 f"Бронирование с ID <code>{booking_id_to_cancel}</code> не найдено, уже отменено, "
                 "или не относится к вашим услугам.",
@@ -527,26 +591,17 @@ async def cancel_booking_provider(update: Update, context: ContextTypes.DEFAULT_
             )
             return
         
-        slot_of_booking = booking_to_cancel.slot
-        service_of_booking = slot_of_booking.service
-        client_telegram_id_for_notify = booking_to_cancel.client_telegram_id
-
-        # Освобождаем слот
-        slot_of_booking.is_available = True
-        db.add(slot_of_booking)
-
-        # Удаляем бронирование
-        db.delete(booking_to_cancel)
-        db.commit()
+        service_name, slot_start_time, client_telegram_id_for_notify, waitlist_offer = cancelled
+        slot_status_text = "Слот предложен следующему в очереди ожидания." if waitlist_offer else "Слот снова доступен."
 
         # 5. Уведомляем поставщика об успехе
         await update.message.reply_text(
             f"Бронирование ID <code>{booking_id_to_cancel}</code> на услугу "
-            f"<b>{service_of_booking.name}</b> ({slot_of_booking.start_time.strftime('%Y-%m-%d %H:%M')}) "
-            f"успешно отменено вами и удалено. Слот снова доступен.",
+            f"<b>{service_name}</b> ({format_ts(slot_start_time)}) "
+            f"успешно отменено вами и удалено. {slot_status_text}",
             parse_mode=ParseMode.HTML
         )
-        logger.info(f"Provider {current_provider.provider_id} cancelled and deleted booking {booking_id_to_cancel}")
+        logger.info("Provider %s cancelled and deleted booking %s", current_provider.provider_id, booking_id_to_cancel)
 
         # 6. Уведомляем клиента об отмене
         try:
@@ -554,21 +609,22 @@ async def cancel_booking_provider(update: Update, context: ContextTypes.DEFAULT_
                 chat_id=client_telegram_id_for_notify,
                 text=f"⚠️ <b>Ваше бронирование было отменено поставщиком</b> ⚠️\n\n"
                      f"Бронирование ID <code>{booking_id_to_cancel}</code> на услугу "
-                     f"<b>{service_of_booking.name}</b>\n"
-                     f"Время: {slot_of_booking.start_time.strftime('%Y-%m-%d %H:%M')}\n"
+                     f"<b>{service_name}</b>\n"
+                     f"Время: {format_ts(slot_start_time)}\n"
                      f"Поставщик: {current_provider.name}\n\n"
                      f"К сожалению, это бронирование было отменено. "
                      f"Пожалуйста, свяжитесь с поставщиком для уточнения причин или выберите другое время/услугу.",
                 parse_mode=ParseMode.HTML
             )
         except Exception as e_notify:
-            logger.error(f"Failed to send provider cancellation notification to client {client_telegram_id_for_notify} for booking {booking_id_to_cancel}: {e_notify}")
+            logger.error("Failed to send provider cancellation notification to client %s for booking %s: %s", client_telegram_id_for_notify, booking_id_to_cancel, e_notify)
+
+        # 7. Предлагаем слот первому в очереди ожидания
+        await send_offer(context.bot, context.job_queue, waitlist_offer)
 
     except Exception as e:
-        logger.error(f"Error in cancel_booking_provider for user {user.id} (Provider ID: {current_provider.provider_id if 'current_provider' in locals() and current_provider else 'N/A'}): {e}")
+        logger.error("Error in cancel_booking_provider for user %s (Provider ID: %s): %s", user.id, current_provider.provider_id if 'current_provider' in locals() and current_provider else 'N/A', e)
         db.rollback()
         await update.message.reply_text(
             "Произошла ошибка при отмене бронирования. Пожалуйста, попробуйте позже."
         )
-    finally:
-        if 'db' in locals() and db: db.close()
@@ -0,0 +1,319 @@
+# handlers_schedule.py
+import logging
+from datetime import datetime, timedelta
+from functools import partial
+from sqlalchemy.orm import Session
+from telegram import Update
+from telegram.constants import ParseMode
+from telegram.ext import ContextTypes
+from database import Service, ScheduleRule
+from db_access import run_write, update_session, get_active_provider
+from timeutil import to_ts, format_ts
+from virtual_slots import WEEKDAY_NAMES
+
+logger = logging.getLogger(__name__)
+
+RULE_KIND_TITLES = {"hours": "рабочее время", "break": "перерыв", "closed": "выходной/исключение"}
+ALL_DAYS_WORDS = ("все", "ежедневно")
+
+HOURS_USAGE = (
+    "Используйте: `/add_hours <ID_услуги> <дни> <ЧЧ:ММ-ЧЧ:ММ>`\n"
+    "Дни: пн-пт, пн,ср,пт или все. Пример: `/add_hours 12 пн-пт 09:00-18:00`"
+)
+BREAK_USAGE = (
+    "Используйте: `/add_break <ID_услуги> <дни> <ЧЧ:ММ-ЧЧ:ММ>`\n"
+    "Пример: `/add_break 12 все 13:00-14:00`"
+)
+DAY_OFF_USAGE = (
+    "Используйте: `/add_day_off <ID_услуги> <ГГГГ-ММ-ДД> [ЧЧ:ММ-ЧЧ:ММ]`\n"
+    "Без времени закрывается весь день. Пример: `/add_day_off 12 2024-12-31`"
+)
+
+
+def parse_weekdays(text: str) -> list[int]:
+    """'пн-пт', 'пн,ср,пт' или 'все' -> номера дней недели (0 - понедельник). При ошибке - ValueError."""
+    text = text.lower()
+    if text in ALL_DAYS_WORDS:
+        return list(range(7))
+    days = set()
+    for part in text.split(","):
+        first, _, last = part.partition("-")
+        if first not in WEEKDAY_NAMES or (last and last not in WEEKDAY_NAMES):
+            raise ValueError(f"Неизвестный день недели: {part}. Используйте {', '.join(WEEKDAY_NAMES)}.")
+        start, end = WEEKDAY_NAMES.index(first), WEEKDAY_NAMES.index(last or first)
+        if start > end:
+            raise ValueError(f"Неверный диапазон дней: {part}.")
+        days.update(range(start, end + 1))
+    return sorted(days)
+
+
+def parse_minutes_window(text: str) -> tuple[int, int]:
+    """'ЧЧ:ММ-ЧЧ:ММ' -> (начало, конец) в минутах от полуночи. При ошибке - ValueError."""
+    try:
+        start_text, end_text = text.split("-")
+        start = datetime.strptime(start_text, "%H:%M")
+        end = datetime.strptime(end_text, "%H:%M")
+    except ValueError:
+        raise ValueError("Неверный формат времени. Используйте `ЧЧ:ММ-ЧЧ:ММ`, например `09:00-18:00`.")
+    start_minute, end_minute = start.hour * 60 + start.minute, end.hour * 60 + end.minute
+    if end_minute <= start_minute:
+        raise ValueError("Время окончания должно быть позже времени начала (в пределах одного дня).")
+    return start_minute, end_minute
+
+
+def _minutes_text(minute: int) -> str:
+    return f"{minute // 60:02d}:{minute % 60:02d}"
+
+
+def add_weekly_rules(db: Session, service_id: int, kind: str, weekdays: list[int],
+                     start_minute: int, end_minute: int) -> tuple[str, list[int]]:
+    """Операция записи: правило 'hours' или 'break' на каждый из дней недели.
+
+    Рабочие окна одного дня не должны пересекаться, иначе слоты задвоятся.
+    Возвращает ('created', ID правил) или ('overlap', [день недели]).
+    """
+    if kind == "hours":
+        clash = db.query(ScheduleRule.weekday).filter(
+            ScheduleRule.service_id == service_id,
+            ScheduleRule.kind == "hours",
+            ScheduleRule.weekday.in_(weekdays),
+            ScheduleRule.start_minute < end_minute,
+            ScheduleRule.end_minute > start_minute
+        ).first()
+        if clash:
+            return "overlap", [clash.weekday]
+
+    rules = [ScheduleRule(service_id=service_id, kind=kind, weekday=weekday,
+                          start_minute=start_minute, end_minute=end_minute) for weekday in weekdays]
+    db.add_all(rules)
+    db.flush()
+    return "created", [rule.rule_id for rule in rules]
+
+
+def add_closed_rule(db: Session, service_id: int, start_time: int, end_time: int) -> int:
+    """Операция записи: закрытый интервал (выходной, отпуск, часть дня)."""
+    rule = ScheduleRule(service_id=service_id, kind="closed", start_time=start_time, end_time=end_time)
+    db.add(rule)
+    db.flush()
+    return rule.rule_id
+
+
+def delete_rule(db: Session, rule_id: int, provider_id: int) -> bool:
+    """Операция записи: удаляет правило, если оно относится к услуге поставщика."""
+    rule = db.query(ScheduleRule).join(Service).filter(
+        ScheduleRule.rule_id == rule_id,
+        Service.provider_id == provider_id
+    ).first()
+    if not rule:
+        return False
+    db.delete(rule)
+    return True
+
+
+def _provider_service(db: Session, service_id: int, provider_id: int) -> Service | None:
+    return db.query(Service).filter(Service.service_id == service_id, Service.provider_id == provider_id).first()
+
+
+async def _require_provider(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    current_provider = get_active_provider(context, update.effective_user.id)
+    if not current_provider:
+        await update.message.reply_text(
+            "Эта команда доступна только для зарегистрированных и активных поставщиков услуг.",
+            parse_mode=ParseMode.HTML
+        )
+    return current_provider
+
+
+async def _add_weekly(update: Update, context: ContextTypes.DEFAULT_TYPE, kind: str) -> None:
+    """Общая часть /add_hours и /add_break."""
+    user = update.effective_user
+    usage = HOURS_USAGE if kind == "hours" else BREAK_USAGE
+    db: Session = update_session(context)
+
+    try:
+        current_provider = await _require_provider(update, context)
+        if not current_provider:
+            return
+
+        if len(context.args) != 3:
+            await update.message.reply_text(f"Неверный формат. {usage}", parse_mode=ParseMode.HTML)
+            return
+        try:
+            service_id = int(context.args[0])
+        except ValueError:
+            await update.message.reply_text("ID услуги должен быть числом.")
+            return
+        try:
+            weekdays = parse_weekdays(context.args[1])
+            start_minute, end_minute = parse_minutes_window(context.args[2])
+        except ValueError as e_parse:
+            await update.message.reply_text(str(e_parse), parse_mode=ParseMode.HTML)
+            return
+
+        service = _provider_service(db, service_id, current_provider.provider_id)
+        if not service:
+            await update.message.reply_text(
+                f"Услуга с ID <code>{service_id}</code> не найдена или не принадлежит вам.",
+                parse_mode=ParseMode.HTML
+            )
+            return
+
+        outcome, values = await run_write(partial(
+            add_weekly_rules, service_id=service_id, kind=kind, weekdays=weekdays,
+            start_minute=start_minute, end_minute=end_minute
+        ))
+        if outcome == "overlap":
+            await update.message.reply_text(
+                f"Рабочее время пересекается с уже заданным на {WEEKDAY_NAMES[values[0]]}. "
+                f"Посмотреть правила: `/my_schedule {service_id}`",
+                parse_mode=ParseMode.HTML
+            )
+            return
+
+        days_text = ", ".join(WEEKDAY_NAMES[weekday] for weekday in weekdays)
+        await update.message.reply_text(
+            f"Правило для услуги '<b>{service.name}</b>' добавлено: {RULE_KIND_TITLES[kind]} "
+            f"{_minutes_text(start_minute)}-{_minutes_text(end_minute)} ({days_text}).\n"
+            f"Свободные слоты по {service.duration_minutes} мин. будут показаны клиентам автоматически.",
+            parse_mode=ParseMode.HTML
+        )
+        logger.info("Provider %s added %s rules %s for service %s", current_provider.provider_id, kind, values, service_id)
+
+    except Exception as e:
+        logger.error("Error in add_%s for user %s: %s", kind, user.id, e)
+        await update.message.reply_text("Произошла ошибка при добавлении правила. Пожалуйста, попробуйте позже.")
+
+
+async def add_hours(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Рабочее время услуги по дням недели: слоты в этом окне предлагаются без /add_slot."""
+    await _add_weekly(update, context, "hours")
+
+
+async def add_break(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Перерыв по дням недели: слоты, пересекающие его, не предлагаются."""
+    await _add_weekly(update, context, "break")
+
+
+async def add_day_off(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Исключение из расписания: весь день или интервал конкретной даты."""
+    user = update.effective_user
+    db: Session = update_session(context)
+
+    try:
+        current_provider = await _require_provider(update, context)
+        if not current_provider:
+            return
+
+        if len(context.args) not in (2, 3):
+            await update.message.reply_text(f"Неверный формат. {DAY_OFF_USAGE}", parse_mode=ParseMode.HTML)
+            return
+        try:
+            service_id = int(context.args[0])
+        except ValueError:
+            await update.message.reply_text("ID услуги должен быть числом.")
+            return
+        try:
+            day = datetime.strptime(context.args[1], "%Y-%m-%d")
+        except ValueError:
+            await update.message.reply_text("Неверный формат даты. Используйте `ГГГГ-ММ-ДД`.", parse_mode=ParseMode.HTML)
+            return
+        try:
+            start_minute, end_minute = parse_minutes_window(context.args[2]) if len(context.args) == 3 else (0, 24 * 60)
+        except ValueError as e_parse:
+            await update.message.reply_text(str(e_parse), parse_mode=ParseMode.HTML)
+            return
+
+        service = _provider_service(db, service_id, current_provider.provider_id)
+        if not service:
+            await update.message.reply_text(
+                f"Услуга с ID <code>{service_id}</code> не найдена или не принадлежит вам.",
+                parse_mode=ParseMode.HTML
+            )
+            return
+
+        start_time = to_ts(day + timedelta(minutes=start_minute))
+        end_time = to_ts(day + timedelta(minutes=end_minute))
+        rule_id = await run_write(partial(add_closed_rule, service_id=service_id, start_time=start_time, end_time=end_time))
+        await update.message.reply_text(
+            f"Для услуги '<b>{service.name}</b>' закрыто время {format_ts(start_time)} - {format_ts(end_time)}.\n"
+            f"Уже сделанные бронирования на это время не отменяются.",
+            parse_mode=ParseMode.HTML
+        )
+        logger.info("Provider %s added closed rule %s for service %s", current_provider.provider_id, rule_id, service_id)
+
+    except Exception as e:
+        logger.error("Error in add_day_off for user %s: %s", user.id, e)
+        await update.message.reply_text("Произошла ошибка при добавлении исключения. Пожалуйста, попробуйте позже.")
+
+
+async def my_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Показывает правила расписания услуги с их ID."""
+    user = update.effective_user
+    db: Session = update_session(context)
+
+    try:
+        current_provider = await _require_provider(update, context)
+        if not current_provider:
+            return
+
+        if len(context.args) != 1 or not context.args[0].isdigit():
+            await update.message.reply_text("Используйте: `/my_schedule <ID_услуги>`", parse_mode=ParseMode.HTML)
+            return
+        service = _provider_service(db, int(context.args[0]), current_provider.provider_id)
+        if not service:
+            await update.message.reply_text(
+                f"Услуга с ID <code>{context.args[0]}</code> не найдена или не принадлежит вам.",
+                parse_mode=ParseMode.HTML
+            )
+            return
+
+        rules = db.query(ScheduleRule).filter(ScheduleRule.service_id == service.service_id)\
+            .order_by(ScheduleRule.kind.desc(), ScheduleRule.weekday, ScheduleRule.start_minute, ScheduleRule.start_time).all()
+        if not rules:
+            await update.message.reply_text(
+                f"У услуги '<b>{service.name}</b>' нет правил расписания.\n{HOURS_USAGE}",
+                parse_mode=ParseMode.HTML
+            )
+            return
+
+        lines = [f"<b>Расписание услуги '{service.name}':</b>\n"]
+        for rule in rules:
+            if rule.kind == "closed":
+                when = f"{format_ts(rule.start_time)} - {format_ts(rule.end_time)}"
+            else:
+                when = f"{WEEKDAY_NAMES[rule.weekday]} {_minutes_text(rule.start_minute)}-{_minutes_text(rule.end_minute)}"
+            lines.append(f"<code>{rule.rule_id}</code> {RULE_KIND_TITLES[rule.kind]}: {when}")
+        lines.append("\nУдалить правило: `/delete_rule <ID_правила>`")
+        await update.message.reply_text("\n".join(lines), parse_mode=ParseMode.HTML)
+
+    except Exception as e:
+        logger.error("Error in my_schedule for user %s: %s", user.id, e)
+        await update.message.reply_text("Произошла ошибка при получении расписания. Пожалуйста, попробуйте позже.")
+
+
+async def delete_schedule_rule(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Удаляет правило расписания по ID."""
+    user = update.effective_user
+
+    try:
+        current_provider = await _require_provider(update, context)
+        if not current_provider:
+            return
+
+        if len(context.args) != 1 or not context.args[0].isdigit():
+            await update.message.reply_text("Используйте: `/delete_rule <ID_правила>`", parse_mode=ParseMode.HTML)
+            return
+        rule_id = int(context.args[0])
+        deleted = await run_write(partial(delete_rule, rule_id=rule_id, provider_id=current_provider.provider_id))
+        if not deleted:
+            await update.message.reply_text(
+                f"Правило <code>{rule_id}</code> не найдено или относится не к вашей услуге.",
+                parse_mode=ParseMode.HTML
+            )
+            return
+        await update.message.reply_text(f"Правило <code>{rule_id}</code> удалено.", parse_mode=ParseMode.HTML)
+        logger.info("Provider %s deleted schedule rule %s", current_provider.provider_id, rule_id)
+
+    except Exception as e:
+        logger.error("Error in delete_rule for user %s: %s", user.id, e)
+        await update.message.reply_text("Произошла ошибка при удалении правила. Пожалуйста, попробуйте позже.")
@@ -0,0 +1,331 @@
+# handlers_waitlist.py
+import logging
+from functools import partial
+from sqlalchemy import exists, or_, and_
+from sqlalchemy.orm import Session
+from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.constants import ParseMode
+from telegram.ext import Application, ContextTypes, JobQueue
+from database import DEFAULT_TENANT, Provider, Service, TimeSlot, Booking, WaitlistEntry
+from db_access import get_read_db, run_write, current_tenant
+from slot_seats import free_seat, hold_seat
+from timeutil import now_ts, format_ts
+
+logger = logging.getLogger(__name__)
+
+WAITLIST_HOLD_SECONDS = 15 * 60 # Сколько освободившийся слот удерживается для клиента из очереди
+WAITLIST_WINDOW_DAYS = 7 # Окно "ближайшие N дней" для кнопки записи в очередь
+
+
+def waitlist_join_keyboard(service_id: int) -> InlineKeyboardMarkup:
+    """Кнопки записи в очередь ожидания услуги: на любое время или на ближайшие дни."""
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("🔔 Ждать любое время", callback_data=f"waitlist_join_{service_id}_0")],
+        [InlineKeyboardButton(
+            f"🔔 Ждать ближайшие {WAITLIST_WINDOW_DAYS} дн.",
+            callback_data=f"waitlist_join_{service_id}_{WAITLIST_WINDOW_DAYS}"
+        )],
+    ])
+
+
+def join_waitlist(db: Session, service_id: int, client_telegram_id: int, window_days: int, tenant: str) -> tuple[str, int]:
+    """Операция записи: ставит клиента в конец очереди услуги.
+
+    Возвращает (статус, позиция), статус: 'joined', 'already' или 'no_service' (нет такой услуги у арендатора).
+    """
+    if not db.query(Service.service_id).join(Provider, Service.provider_id == Provider.provider_id)\
+            .filter(Service.service_id == service_id, Provider.tenant == tenant).first():
+        return "no_service", 0
+
+    now = now_ts()
+    # Заодно убираем записи, окно которых уже прошло: до них очередь все равно не дойдет
+    db.query(WaitlistEntry).filter(
+        WaitlistEntry.service_id == service_id,
+        WaitlistEntry.status == "waiting",
+        WaitlistEntry.window_end < now
+    ).delete(synchronize_session=False)
+
+    entry = db.query(WaitlistEntry).filter(
+        WaitlistEntry.service_id == service_id,
+        WaitlistEntry.client_telegram_id == client_telegram_id
+    ).first()
+    status = "already"
+    if not entry:
+        entry = WaitlistEntry(
+            service_id=service_id,
+            client_telegram_id=client_telegram_id,
+            window_start=now if window_days else None,
+            window_end=now + window_days * 86400 if window_days else None,
+        )
+        db.add(entry)
+        db.flush()
+        status = "joined"
+
+    position = db.query(WaitlistEntry).filter(
+        WaitlistEntry.service_id == service_id,
+        WaitlistEntry.status == "waiting",
+        WaitlistEntry.entry_id <= entry.entry_id
+    ).count()
+    return status, position
+
+
+def offer_freed_slot(db: Session, slot: TimeSlot) -> dict | None:
+    """Вызывается внутри операции записи, вернувшей место в slot (slot_seats.free_seat).
+
+    Отдает место голове очереди услуги: запись помечается 'offered', а место удерживается
+    (hold_seat) до ответа клиента или истечения WAITLIST_HOLD_SECONDS. Клиенты, уже
+    записанные на этот слот, пропускаются. Голова находится одним запросом по индексу ix_waitlist_queue.
+    Возвращает данные предложения для send_offer или None, если очередь пуста.
+    """
+    now = now_ts()
+    if slot.start_time <= now:
+        return None
+
+    entry = db.query(WaitlistEntry).filter(
+        WaitlistEntry.service_id == slot.service_id,
+        WaitlistEntry.status == "waiting",
+        or_(
+            WaitlistEntry.window_start.is_(None),
+            and_(WaitlistEntry.window_start <= slot.start_time, WaitlistEntry.window_end >= slot.start_time)
+        ),
+        ~exists().where(
+            Booking.slot_id == slot.slot_id,
+            Booking.client_telegram_id == WaitlistEntry.client_telegram_id
+        )
+    ).order_by(WaitlistEntry.entry_id).first()
+    if not entry:
+        return None
+
+    entry.status = "offered"
+    entry.offered_slot_id = slot.slot_id
+    entry.hold_expires_at = now + WAITLIST_HOLD_SECONDS
+    hold_seat(db, slot) # Удерживаем место, чтобы его не забрал кто-то вне очереди
+    return {
+        "entry_id": entry.entry_id,
+        "client_telegram_id": entry.client_telegram_id,
+        "service_name": slot.service.name,
+        "start_time": slot.start_time,
+        "hold_seconds": WAITLIST_HOLD_SECONDS,
+    }
+
+
+def release_offer(db: Session, entry_id: int, client_telegram_id: int | None = None,
+                  expired_only: bool = False) -> dict | None:
+    """Операция записи: снимает предложение (отказ клиента или истечение удержания).
+
+    Запись удаляется из очереди, а слот предлагается следующему. Возвращает
+    {'client_telegram_id', 'service_name', 'next_offer'} или None, если предложения уже нет
+    (клиент успел забронировать, отказаться или удержание еще не истекло при expired_only).
+    """
+    query = db.query(WaitlistEntry).filter(
+        WaitlistEntry.entry_id == entry_id,
+        WaitlistEntry.status == "offered"
+    )
+    if client_telegram_id is not None:
+        query = query.filter(WaitlistEntry.client_telegram_id == client_telegram_id)
+    entry = query.first()
+    if not entry or (expired_only and entry.hold_expires_at > now_ts()):
+        return None
+
+    slot = entry.offered_slot
+    released = {"client_telegram_id": entry.client_telegram_id, "service_name": slot.service.name}
+    db.delete(entry)
+    db.flush() # Чтобы запись не попала в выборку головы очереди ниже
+    free_seat(db, slot)
+    released["next_offer"] = offer_freed_slot(db, slot)
+    return released
+
+
+def accept_offer(db: Session, entry_id: int, client_telegram_id: int) -> dict | None:
+    """Операция записи: бронирует удерживаемое для клиента место. None, если удержание истекло.
+
+    Место уже учтено в booked_seats при удержании, поэтому создается только бронь. Если клиент
+    успел записаться на этот слот сам, удержание снимается и место возвращается.
+    """
+    entry = db.query(WaitlistEntry).filter(
+        WaitlistEntry.entry_id == entry_id,
+        WaitlistEntry.client_telegram_id == client_telegram_id,
+        WaitlistEntry.status == "offered",
+        WaitlistEntry.hold_expires_at > now_ts()
+    ).first()
+    if not entry:
+        return None
+
+    slot = entry.offered_slot
+    if db.query(Booking.booking_id).filter(
+        Booking.slot_id == slot.slot_id,
+        Booking.client_telegram_id == client_telegram_id
+    ).first():
+        db.delete(entry)
+        free_seat(db, slot)
+        return None
+    new_booking = Booking(slot_id=slot.slot_id, client_telegram_id=client_telegram_id, status="confirmed")
+    db.add(new_booking)
+    db.delete(entry)
+    db.flush()
+
+    service = slot.service
+    return {
+        "booking_id": new_booking.booking_id,
+        "service_name": service.name,
+        "provider_name": service.provider.name,
+        "provider_telegram_id": service.provider.telegram_id,
+        "start_time": slot.start_time,
+    }
+
+
+def _hold_job_name(entry_id: int) -> str:
+    return f"waitlist_hold_{entry_id}"
+
+
+def schedule_hold_expiry(job_queue: JobQueue | None, entry_id: int, delay: float) -> None:
+    """Ставит в job queue снятие удержания через delay секунд."""
+    if job_queue is None:
+        logger.warning("Job queue is not available, waitlist hold %s will not expire automatically", entry_id)
+        return
+    job_queue.run_once(expire_hold, max(0.0, delay), data=entry_id, name=_hold_job_name(entry_id))
+
+
+def cancel_hold_expiry(job_queue: JobQueue | None, entry_id: int) -> None:
+    if job_queue is None:
+        return
+    for job in job_queue.get_jobs_by_name(_hold_job_name(entry_id)):
+        job.schedule_removal()
+
+
+async def send_offer(bot: Bot, job_queue: JobQueue | None, offer: dict | None) -> None:
+    """Отправляет клиенту из очереди предложение слота и запускает таймер удержания."""
+    if not offer:
+        return
+    entry_id = offer["entry_id"]
+    try:
+        await bot.send_message(
+            chat_id=offer["client_telegram_id"],
+            text=f"🔔 <b>Освободилось время!</b>\n\n"
+                 f"<b>Услуга:</b> {offer['service_name']}\n"
+                 f"<b>Время:</b> {format_ts(offer['start_time'])}\n\n"
+                 f"Слот удерживается для вас {offer['hold_seconds'] // 60} мин.",
+            reply_markup=InlineKeyboardMarkup([[
+                InlineKeyboardButton("✅ Забронировать", callback_data=f"waitlist_accept_{entry_id}"),
+                InlineKeyboardButton("Отказаться", callback_data=f"waitlist_decline_{entry_id}"),
+            ]]),
+            parse_mode=ParseMode.HTML
+        )
+        schedule_hold_expiry(job_queue, entry_id, offer["hold_seconds"])
+        logger.info("Waitlist entry %s offered a slot to client %s", entry_id, offer['client_telegram_id'])
+    except Exception as e_notify:
+        # Клиент недоступен (например, заблокировал бота) - сразу передаем слот следующему
+        logger.error("Failed to send waitlist offer %s to client %s: %s", entry_id, offer['client_telegram_id'], e_notify)
+        released = await run_write(partial(release_offer, entry_id=entry_id))
+        if released:
+            await send_offer(bot, job_queue, released["next_offer"])
+
+
+async def expire_hold(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Задача job queue: удержание истекло - слот переходит к следующему в очереди."""
+    entry_id = context.job.data
+    released = await run_write(partial(release_offer, entry_id=entry_id, expired_only=True))
+    if not released:
+        return
+    logger.info("Waitlist hold %s expired", entry_id)
+    try:
+        await context.bot.send_message(
+            chat_id=released["client_telegram_id"],
+            text=f"Время удержания слота на услугу <b>{released['service_name']}</b> истекло, "
+                 f"он передан следующему в очереди.",
+            parse_mode=ParseMode.HTML
+        )
+    except Exception as e_notify:
+        logger.error("Failed to notify client %s about expired hold %s: %s", released['client_telegram_id'], entry_id, e_notify)
+    await send_offer(context.bot, context.job_queue, released["next_offer"])
+
+
+async def restore_holds(application: Application) -> None:
+    """Восстанавливает таймеры удержаний после перезапуска (job queue хранится в памяти).
+
+    Только удержания арендатора приложения: истечение обрабатывает job queue того бота,
+    через который клиенту пришло предложение.
+    """
+    tenant = application.bot_data.get("tenant", DEFAULT_TENANT)
+    db: Session = next(get_read_db())
+    try:
+        offered = db.query(WaitlistEntry.entry_id, WaitlistEntry.hold_expires_at)\
+            .join(Service, WaitlistEntry.service_id == Service.service_id)\
+            .join(Provider, Service.provider_id == Provider.provider_id)\
+            .filter(WaitlistEntry.status == "offered", Provider.tenant == tenant).all()
+    finally:
+        db.close()
+    now = now_ts()
+    for entry_id, hold_expires_at in offered:
+        schedule_hold_expiry(application.job_queue, entry_id, hold_expires_at - now)
+    if offered:
+        logger.info("Restored %s waitlist hold timers", len(offered))
+
+
+async def waitlist_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Кнопки очереди ожидания: waitlist_join_, waitlist_accept_, waitlist_decline_."""
+    query = update.callback_query
+    callback_data = query.data
+    user_telegram_id = query.from_user.id
+
+    if callback_data.startswith("waitlist_join_"):
+        _, _, service_id, window_days = callback_data.split("_")
+        status, position = await run_write(partial(
+            join_waitlist, service_id=int(service_id), client_telegram_id=user_telegram_id,
+            window_days=int(window_days), tenant=current_tenant(context)
+        ))
+        if status == "no_service":
+            await query.edit_message_text(text="Ошибка: Услуга не найдена.")
+            return
+        prefix = "Вы уже в очереди ожидания" if status == "already" else "Вы добавлены в очередь ожидания"
+        await query.edit_message_text(
+            text=f"{prefix}. Ваше место: <b>{position}</b>.\n"
+                 f"Когда освободится подходящий слот, я пришлю предложение.",
+            parse_mode=ParseMode.HTML
+        )
+        logger.info("User %s joined waitlist for service %s (%s, position %s)", user_telegram_id, service_id, status, position)
+
+    elif callback_data.startswith("waitlist_accept_"):
+        entry_id = int(callback_data.split("_")[2])
+        booked = await run_write(partial(accept_offer, entry_id=entry_id, client_telegram_id=user_telegram_id))
+        if not booked:
+            await query.edit_message_text(text="К сожалению, время удержания истекло и слот передан следующему в очереди.")
+            return
+        cancel_hold_expiry(context.job_queue, entry_id)
+
+        await query.edit_message_text(
+            text=f"🎉 <b>Вы успешно забронировали услугу!</b> 🎉\n\n"
+                 f"<b>Услуга:</b> {booked['service_name']}\n"
+                 f"<b>Мастер/Компания:</b> {booked['provider_name']}\n"
+                 f"<b>Время:</b> {format_ts(booked['start_time'])}\n"
+                 f"<b>ID вашего бронирования:</b> <code>{booked['booking_id']}</code> (сохраните его)",
+            parse_mode=ParseMode.HTML
+        )
+        logger.info("User %s accepted waitlist offer %s. Booking ID: %s", user_telegram_id, entry_id, booked['booking_id'])
+        try:
+            await context.bot.send_message(
+                chat_id=booked['provider_telegram_id'],
+                text=f"🔔 <b>Новое бронирование из очереди ожидания!</b> 🔔\n\n"
+                     f"<b>Услуга:</b> {booked['service_name']}\n"
+                     f"<b>Время:</b> {format_ts(booked['start_time'])}\n"
+                     f"<b>Клиент Telegram ID:</b> <code>{user_telegram_id}</code>\n"
+                     f"<b>ID бронирования:</b> <code>{booked['booking_id']}</code>",
+                parse_mode=ParseMode.HTML
+            )
+        except Exception as e_notify:
+            logger.error("Failed to send notification to provider %s for booking %s: %s", booked['provider_telegram_id'], booked['booking_id'], e_notify)
+
+    elif callback_data.startswith("waitlist_decline_"):
+        entry_id = int(callback_data.split("_")[2])
+        released = await run_write(partial(release_offer, entry_id=entry_id, client_telegram_id=user_telegram_id))
+        if not released:
+            await query.edit_message_text(text="Это предложение уже неактуально.")
+            return
+        cancel_hold_expiry(context.job_queue, entry_id)
+        await query.edit_message_text(text="Вы отказались от слота и удалены из очереди ожидания.")
+        logger.info("User %s declined waitlist offer %s", user_telegram_id, entry_id)
+        await send_offer(context.bot, context.job_queue, released["next_offer"])
+
+    else:
+        await query.edit_message_text(text=f"Неизвестный колбек: {callback_data}")
+        logger.warning("Received unknown waitlist callback_data: %s from user %s", callback_data, user_telegram_id)
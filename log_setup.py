@@ -0,0 +1,154 @@
+# log_setup.py
+import json
+import logging
+import numbers
+import queue
+import random
+import sys
+import time
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# Поля текущего апдейта: выставляются оберткой хендлера (bind_update) и попадают во все
+# записи, сделанные во время его обработки, включая код в asyncio.to_thread.
+_update_context: ContextVar[dict | None] = ContextVar("update_context", default=None)
+
+# Аргументы сообщения этих типов неизменяемы, их можно передать в поток QueueListener как есть.
+# Точные типы проверяются быстро; прочие числа (Decimal, Fraction) - через isinstance.
+PRIMITIVE_ARG_TYPES = frozenset((str, int, float, bool, type(None)))
+
+# Поля записи, которые JsonFormatter выводит помимо стандартных (можно передавать через extra=)
+CONTEXT_FIELDS = ("update_id", "handler", "user_id", "tenant", "elapsed_ms", "duration_ms", "metrics")
+
+
+def bind_update(update_id: int | None, handler: str, user_id: int | None, tenant: str | None = None):
+    """Привязывает поля апдейта к текущему контексту. Возвращает токен для unbind_update."""
+    return _update_context.set({
+        "update_id": update_id,
+        "handler": handler,
+        "user_id": user_id,
+        "tenant": tenant, # Арендатор бота (задан только в multibot.py)
+        "started": time.perf_counter(),
+    })
+
+
+def unbind_update(token) -> None:
+    _update_context.reset(token)
+
+
+class UpdateContextFilter(logging.Filter):
+    """Копирует поля апдейта в запись в момент логирования (в потоке, где она сделана)."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        bound = _update_context.get()
+        if bound:
+            record.update_id = bound["update_id"]
+            record.handler = bound["handler"]
+            record.user_id = bound["user_id"]
+            record.tenant = bound["tenant"]
+            record.elapsed_ms = round((time.perf_counter() - bound["started"]) * 1000, 3)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает только долю записей уровня ниже WARNING для заданных логгеров.
+
+    rates: имя логгера -> доля (0..1). Правило действует и на дочерние логгеры;
+    предупреждения и ошибки не отбрасываются никогда.
+    """
+
+    def __init__(self, rates: dict | None = None, rng=random.random):
+        super().__init__()
+        self.rates = dict(rates or {})
+        self.rng = rng
+        self._resolved = {} # имя логгера -> доля (кэш поиска по иерархии)
+
+    def _rate(self, name: str) -> float:
+        rate = self._resolved.get(name)
+        if rate is None:
+            rate = 1.0
+            candidate = name
+            while candidate:
+                if candidate in self.rates:
+                    rate = self.rates[candidate]
+                    break
+                candidate = candidate.rpartition(".")[0]
+            self._resolved[name] = rate
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        rate = self._rate(record.name)
+        return rate >= 1.0 or self.rng() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись. Сообщение форматируется здесь, т.е. в потоке QueueListener."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def _snapshot_arg(value):
+    if type(value) in PRIMITIVE_ARG_TYPES or isinstance(value, (str, numbers.Number)):
+        return value
+    return str(value)
+
+
+class LazyQueueHandler(QueueHandler):
+    """QueueHandler без полного форматирования на месте.
+
+    Стандартный prepare() подставляет аргументы в сообщение в потоке логирования (т.е. в event
+    loop). Здесь в этом потоке аргументы только фиксируются: неизменяемые (строки, числа, None)
+    передаются как есть, остальные заменяются на str() - иначе поток QueueListener увидел бы
+    уже измененный объект или обратился бы к ленивому атрибуту ORM из чужого потока. Подстановка
+    в сообщение и сериализация в JSON выполняются в потоке QueueListener.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if not isinstance(record.msg, str):
+            record.msg = str(record.msg)
+        if isinstance(record.args, dict):
+            record.args = {key: _snapshot_arg(value) for key, value in record.args.items()}
+        elif record.args and not PRIMITIVE_ARG_TYPES.issuperset(map(type, record.args)):
+            record.args = tuple([_snapshot_arg(arg) for arg in record.args])
+        return record
+
+
+def setup_logging(level=logging.INFO, sampling: dict | None = None, stream=None) -> QueueListener:
+    """Настраивает корневой логгер: фильтры -> очередь -> поток QueueListener -> JSON в stream.
+
+    Возвращает запущенный QueueListener; остановите его (listener.stop()) перед выходом,
+    чтобы дописать оставшиеся в очереди записи.
+    """
+    log_queue = queue.SimpleQueue()
+    queue_handler = LazyQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(sampling)) # Сначала отбрасываем, потом обогащаем
+    queue_handler.addFilter(UpdateContextFilter())
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = QueueListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -1,242 +1,264 @@
 # main.py
+import time
+
+_PROCESS_START = time.perf_counter() # Точка отсчета для замера холодного старта
+
+import asyncio
+import importlib
 import logging
+import sys
+from collections import Counter
 from telegram import Update
-from telegram.constants import ParseMode
-from telegram.ext import Application, CommandHandler, ContextTypes
-from datetime import datetime
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup 
-from telegram.ext import CallbackQueryHandler 
-
-# Импортируем хендлеры
-from handlers_common import start, help_command
-from handlers_provider import (
-    register_provider, add_service, my_services, 
-    add_slot, my_slots, cancel_booking_provider
-)
-from handlers_client import list_available_services, my_bookings_client
-# Импортируем токен из config.py
-from config import BOT_TOKEN
-# Импортируем функции для работы с БД и сами модели (пока не используем, но понадобятся)
-from sqlalchemy.orm import Session
-from database import SessionLocal, engine, Provider, Service, TimeSlot, Booking, create_db_tables, get_db
-# Настройка логирования для отладки
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
-)
+from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes, InlineQueryHandler, MessageHandler, TypeHandler, filters
+
+# Токен (или список ботов BOTS для multibot.py) - в config.py
+import config
+from log_setup import setup_logging, bind_update, unbind_update
+from timeutil import now_ts
+from rate_limit import TokenBucketLimiter, build_rate_limit_guard
+
+# Модули с хендлерами и database.py (а вместе с ним SQLAlchemy) импортируются лениво:
+# при первом обращении к хендлеру или в фоновом прогреве после старта.
+# Логирование: JSON-строки, запись в поток вне event loop (см. log_setup.py)
+log_listener = setup_logging(getattr(config, "LOG_LEVEL", logging.INFO), getattr(config, "LOG_SAMPLING", None))
 logger = logging.getLogger(__name__)
-
-
-async def button_callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Обрабатывает нажатия на инлайн-кнопки."""
-    query = update.callback_query
-    await query.answer() # Важно ответить на колбек, чтобы кнопка перестала "грузиться"
-
-    callback_data = query.data
-    user_telegram_id = query.from_user.id
-    db: Session = next(get_db())
-
-    try:
-        if callback_data.startswith("view_slots_"):
-            service_id = int(callback_data.split("_")[2]) # Извлекаем ID услуги
-            
-            service_info = db.query(Service).filter(Service.service_id == service_id).first()
-            if not service_info:
-                await query.edit_message_text(text="Ошибка: Услуга не найдена.") # Редактируем исходное сообщение кнопки
-                return
-
-            # Ищем доступные слоты для этой услуги
-            now = datetime.now()
-            available_slots = db.query(TimeSlot).filter(
-                TimeSlot.service_id == service_id,
-                TimeSlot.is_available == True,
-                TimeSlot.start_time > now # Только будущие слоты
-            ).order_by(TimeSlot.start_time).limit(10).all() 
-
-            if not available_slots:
-                await query.edit_message_text(
-                    text=f"Для услуги '<b>{service_info.name}</b>' сейчас нет свободных слотов.\n"
-                         f"Попробуйте проверить позже или выберите другую услугу.",
-                    parse_mode=ParseMode.HTML
-                )
-                return
-
-            slots_keyboard = []
-            slots_text = f"<b>Доступные слоты для '{service_info.name}':</b>\n\n"
-            
-            
-            for slot in available_slots:
-                slots_text += f"🗓️ {slot.start_time.strftime('%Y-%m-%d %H:%M')} - {slot.end_time.strftime('%H:%M')}\n"
-                slots_keyboard.append([
-                    InlineKeyboardButton(
-                        f"Забронировать на {slot.start_time.strftime('%H:%M %d.%m')}",
-                        callback_data=f"book_slot_{slot.slot_id}" # Новый callback_data для бронирования
-                    )
-                ])
-            
-            # Кнопка "Назад к списку услуг"
-            # slots_keyboard.append([InlineKeyboardButton("⬅️ Назад к услугам", callback_data="back_to_services")])
-            # Добавить сохранить состояние или вызывать /services снова
-
-            reply_markup_slots = InlineKeyboardMarkup(slots_keyboard)
-            await query.edit_message_text(text=slots_text, reply_markup=reply_markup_slots, parse_mode=ParseMode.HTML)
-            logger.info(f"User {user_telegram_id} viewed slots for service {service_id}")
-        
-        elif callback_data.startswith("book_slot_"):
-            slot_id_to_book = int(callback_data.split("_")[2])
-            
-            # --- ЛОГИКА БРОНИРОВАНИЯ ---
-            slot_to_book = db.query(TimeSlot).filter(
-                TimeSlot.slot_id == slot_id_to_book,
-                TimeSlot.is_available == True, # Убедимся, что слот все еще доступен
-                TimeSlot.start_time > datetime.now() # И что он не в прошлом
-            ).first()
-
-            if not slot_to_book:
-                await query.edit_message_text(text="К сожалению, этот слот уже занят или недоступен. Пожалуйста, выберите другой.")
-                # Можно предложить вернуться к выбору слотов для этой услуги или к общему списку услуг
-                return
-
-
-            # Создаем бронирование
-            new_booking = Booking(
-                slot_id=slot_to_book.slot_id,
-                client_telegram_id=user_telegram_id,
-                status="confirmed"
-            )
-            slot_to_book.is_available = False # Делаем слот недоступным
-
-            db.add(new_booking)
-            db.add(slot_to_book)
-            db.commit()
-            db.refresh(new_booking)
-
-            # Получаем информацию об услуге и провайдере для уведомления
-            service_booked = slot_to_book.service # Через relationship
-            provider_of_service = service_booked.provider # Через relationship
-
-            confirmation_text = (
-                f"🎉 <b>Вы успешно забронировали услугу!</b> 🎉\n\n"
-                f"<b>Услуга:</b> {service_booked.name}\n"
-                f"<b>Мастер/Компания:</b> {provider_of_service.name}\n"
-                f"<b>Время:</b> {slot_to_book.start_time.strftime('%Y-%m-%d %H:%M')}\n"
-                f"<b>ID вашего бронирования:</b> <code>{new_booking.booking_id}</code> (сохраните его)\n\n"
-                f"Мы также уведомим поставщика услуг."
-            )
-            await query.edit_message_text(text=confirmation_text, parse_mode=ParseMode.HTML)
-            logger.info(f"User {user_telegram_id} booked slot {slot_id_to_book} for service {service_booked.service_id}. Booking ID: {new_booking.booking_id}")
-
-            # --- Отправка уведомления Поставщику ---
-            provider_telegram_id = provider_of_service.telegram_id
-            try:
-                await context.bot.send_message(
-                    chat_id=provider_telegram_id,
-                    text=f"🔔 <b>Новое бронирование!</b> 🔔\n\n"
-                         f"<b>Услуга:</b> {service_booked.name}\n"
-                         f"<b>Время:</b> {slot_to_book.start_time.strftime('%Y-%m-%d %H:%M')}\n"
-                         f"<b>Клиент Telegram ID:</b> <code>{user_telegram_id}</code>\n"
-                         f"<b>ID бронирования:</b> <code>{new_booking.booking_id}</code>",
-                    parse_mode=ParseMode.HTML
-                )
-                logger.info(f"Notification sent to provider {provider_telegram_id} for booking {new_booking.booking_id}")
-            except Exception as e_notify:
-                logger.error(f"Failed to send notification to provider {provider_telegram_id} for booking {new_booking.booking_id}: {e_notify}")
-
-        elif callback_data.startswith("cancel_booking_client_"):
-            booking_id_to_cancel = int(callback_data.split("_")[3]) 
-
-            booking_to_cancel = db.query(Booking).filter(
-                Booking.booking_id == booking_id_to_cancel,
-                Booking.client_telegram_id == user_telegram_id,
-            ).first()
-
-            if not booking_to_cancel:
-                await query.edit_message_text(text="Бронирование не найдено или вы не можете его отменить.")
-                return
-            
-            slot_to_free = booking_to_cancel.slot
-            service_name_for_message = slot_to_free.service.name
-            slot_time_for_message = slot_to_free.start_time.strftime('%Y-%m-%d %H:%M')
-            provider_telegram_id_for_notify = slot_to_free.service.provider.telegram_id
-
-
-            # Освобождаем слот
-            slot_to_free.is_available = True
-            db.add(slot_to_free) # Отмечаем слот как измененный
-
-            # Удаляем бронирование
-            db.delete(booking_to_cancel) 
-            db.commit()
-
-            # Уведомляем клиента
-            await query.edit_message_text(
-                text=f"Бронирование ID <code>{booking_id_to_cancel}</code> на услугу "
-                     f"<b>{service_name_for_message}</b> ({slot_time_for_message}) "
-                     f"успешно отменено. Слот снова доступен.",
-                parse_mode=ParseMode.HTML
-            )
-            logger.info(f"Client {user_telegram_id} cancelled and deleted booking {booking_id_to_cancel}")
-
-            # Уведомляем поставщика
-            try:
-                await context.bot.send_message(
-                    chat_id=provider_telegram_id_for_notify,
-                    text=f"ℹ️ <b>Отмена бронирования клиентом</b> ℹ️\n\n"
-                         f"Бронирование ID <code>{booking_id_to_cancel}</code> на услугу "
-                         f"<b>{service_name_for_message}</b>\n"
-                         f"Время: {slot_time_for_message}\n"
-                         f"было отменено клиентом (TG ID: <code>{user_telegram_id}</code>). Слот снова доступен.",
-                    parse_mode=ParseMode.HTML
-                )
-            except Exception as e_notify:
-                logger.error(f"Failed to send cancellation notification to provider {provider_telegram_id_for_notify} for booking {booking_id_to_cancel}: {e_notify}")
-               
-        else:
-            await query.edit_message_text(text=f"Неизвестный колбек: {callback_data}")
-            logger.warning(f"Received unknown callback_data: {callback_data} from user {user_telegram_id}")
-
-    except Exception as e:
-        logger.error(f"Error in button_callback_handler (callback_data: {query.data if query else 'N/A'}) for user {user_telegram_id if query else 'N/A'}: {e}")
+timing_logger = logging.getLogger("updates") # Строка с длительностью на каждый апдейт
+
+HANDLER_MODULES = ("handlers_common", "handlers_provider", "handlers_client", "handlers_import", "handlers_export", "handlers_waitlist",
+                   "handlers_broadcast", "handlers_inline", "handlers_schedule", "handlers_bulk_cancel")
+
+# Сколько апдейтов одного бота обрабатывается одновременно. Пока хендлер ждет ответа Telegram,
+# идут другие апдейты, а одинаковые одновременные колбеки склеивает SingleFlight (handlers_client.py).
+# Пул соединений чтения start_process рассчитывает по числу ботов и этому значению.
+CONCURRENT_UPDATES = 4
+
+_first_update_seen = False
+
+
+class BotMetrics:
+    """Счетчики апдейтов одного бота (bot_data["metrics"]): сколько, с ошибкой, суммарное и максимальное время."""
+
+    def __init__(self):
+        self.updates = Counter() # хендлер -> число апдейтов
+        self.failed = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, handler: str, duration_ms: float, failed: bool) -> None:
+        self.updates[handler] += 1
+        self.failed += failed
+        self.total_ms += duration_ms
+        self.max_ms = max(self.max_ms, duration_ms)
+
+    def stats(self) -> dict:
+        count = sum(self.updates.values())
+        return {
+            "updates": count,
+            "failed": self.failed,
+            "avg_ms": round(self.total_ms / count, 3) if count else 0.0,
+            "max_ms": round(self.max_ms, 3),
+            "top_handlers": dict(self.updates.most_common(3)),
+        }
+
+
+def lazy_handler(module_name: str, func_name: str):
+    """Возвращает колбек, который импортирует модуль хендлера только при первом вызове.
+
+    На время вызова поля апдейта (update_id, хендлер, пользователь) привязываются к контексту
+    логирования, а по завершении пишется строка с длительностью обработки. Сессия апдейта
+    (db_access.update_session) закрывается здесь же: commit, либо rollback, если хендлер упал.
+    """
+    async def handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        func = getattr(importlib.import_module(module_name), func_name)
+        user = update.effective_user
+        token = bind_update(update.update_id, func_name, user.id if user else None, context.bot_data.get("tenant"))
+        started = time.perf_counter()
+        failed = False
         try:
-            await query.edit_message_text("Произошла непредвиденная ошибка при обработке вашего запроса.")
-        except Exception as e_edit_fallback:
-             logger.error(f"Fallback edit_message_text also failed: {e_edit_fallback}")
-             if query and query.message:
-                 await context.bot.send_message(chat_id=query.message.chat_id, text="Произошла ошибка. Попробуйте снова.")
-    except Exception as e:
+            await func(update, context)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            db_access = sys.modules.get("db_access") # Не импортирован - значит, сессий еще не было
+            if db_access is not None:
+                db_access.finish_update(context, failed)
+            duration_ms = round((time.perf_counter() - started) * 1000, 3)
+            metrics = context.bot_data.get("metrics")
+            if metrics is not None:
+                metrics.record(func_name, duration_ms, failed)
+            timing_logger.info("Update handled by %s in %.3f ms", func_name, duration_ms, extra={"duration_ms": duration_ms})
+            unbind_update(token)
+
+    handler.__name__ = func_name
+    return handler
+
+
+async def record_first_update(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Один раз логирует время от запуска процесса до первого обработанного апдейта."""
+    global _first_update_seen
+    if _first_update_seen:
+        return
+    _first_update_seen = True
+    elapsed = time.perf_counter() - _PROCESS_START
+    logger.info("Startup benchmark: first update %s handled %.3fs after process start.", update.update_id, elapsed)
+
+
+def prepare_database() -> None:
+    """Проверяет версию схемы БД вместо безусловного create_all."""
+    from database import ensure_schema
+    if ensure_schema():
+        logger.info("Database schema created/updated.")
+    else:
+        logger.info("Database schema is up to date.")
+
+
+def warm_up() -> None:
+    """Прогревает кэши: импорт хендлеров, конфигурация мапперов SQLAlchemy и пул соединений."""
+    started = time.perf_counter()
+    for module_name in HANDLER_MODULES:
+        importlib.import_module(module_name)
+
+    from sqlalchemy.orm import configure_mappers
+    from database import engine
+    configure_mappers()
+    with engine.connect():
         pass
-    finally:
-        db.close()
+    logger.info("Warm-up finished in %.3fs.", time.perf_counter() - started)
 
 
-def main() -> None:
-    """Запуск бота."""
-    create_db_tables()
-    logger.info("Database tables checked/created.")
+def concurrent_updates() -> int:
+    """Сколько апдейтов каждый бот обрабатывает одновременно (config.CONCURRENT_UPDATES)."""
+    return getattr(config, "CONCURRENT_UPDATES", CONCURRENT_UPDATES)
+
+
+def use_writer_queue() -> bool:
+    """Нужна ли очередь писателя: режим single writer или групповой commit (он работает только через нее)."""
+    return getattr(config, "SINGLE_WRITER", False) or getattr(config, "GROUP_COMMIT_MS", 0) > 0
+
+
+async def start_process(bots: int = 1) -> None:
+    """Общая для всех ботов процесса подготовка: схема БД, пул чтения и очередь писателя.
+
+    Пул чтения рассчитан на все одновременные апдейты bots ботов: иначе апдейт, не получивший
+    соединения, заблокировал бы event loop (см. db_access.read_pool_size_for).
+    """
+    await asyncio.to_thread(prepare_database)
+    from db_access import READ_POOL_SIZE, read_pool_size_for, configure_read_pool, enable_single_writer
+    pool_size = read_pool_size_for(bots * concurrent_updates())
+    if use_writer_queue():
+        enable_single_writer(max(getattr(config, "READ_POOL_SIZE", READ_POOL_SIZE), pool_size), getattr(config, "GROUP_COMMIT_MS", 0))
+    else:
+        configure_read_pool(pool_size)
+
+
+async def stop_process() -> None:
+    """Дожидаемся очереди писателя перед выходом и закрываем пул чтения."""
+    from db_access import disable_single_writer, reset_read_pool
+    if use_writer_queue():
+        await disable_single_writer()
+    else:
+        reset_read_pool()
+
+
+async def start_bot(application: Application, started_at: int | None = None) -> None:
+    """Подготовка одного бота: таймеры удержаний очереди ожидания и прерванные рассылки его арендатора.
 
-    application = Application.builder().token(BOT_TOKEN).build()
+    started_at - момент запуска процесса: если start_bot идет уже во время опроса, рассылки,
+    начатые после него, отправляет их собственная задача и продолжать их не нужно.
+    """
+    from handlers_waitlist import restore_holds
+    from handlers_broadcast import resume_broadcasts
+    await restore_holds(application)
+    await resume_broadcasts(application, started_at)
+
+
+async def post_init(application: Application) -> None:
+    """Хук Application: проверка схемы до начала опроса, остальное - в фоне.
+
+    Схема проверяется до опроса намеренно: хендлеры не должны работать со старой схемой.
+    Таймеры удержаний и прерванные рассылки (модули очереди ожидания и рассылок) восстанавливаются
+    уже во время опроса, как и прогрев кэшей, - первый апдейт их не ждет.
+    """
+    await start_process()
+    application.create_task(start_bot(application, now_ts()), name="start_bot")
+    application.create_task(asyncio.to_thread(warm_up), name="warm_up")
+    logger.info("Startup benchmark: ready to poll %.3fs after process start.", time.perf_counter() - _PROCESS_START)
+
+
+async def post_shutdown(application: Application) -> None:
+    """Хук Application: дожидаемся очереди писателя перед выходом."""
+    await stop_process()
+
+
+def build_application(token: str, tenant: str | None = None, post_init=None, post_shutdown=None) -> Application:
+    """Создает Application бота со всеми хендлерами.
+
+    tenant - арендатор бота (bot_data["tenant"]); None - арендатор по умолчанию (один бот на процесс).
+    Лимитер флуда и метрики у каждого бота свои, engine и кэши модулей - общие для процесса.
+    """
+    builder = Application.builder().token(token).concurrent_updates(concurrent_updates())
+    if post_init:
+        builder = builder.post_init(post_init)
+    if post_shutdown:
+        builder = builder.post_shutdown(post_shutdown)
+    application = builder.build()
+    if tenant is not None:
+        application.bot_data["tenant"] = tenant
+    application.bot_data["metrics"] = BotMetrics() # Метрики: metrics.stats()
+
+    # Защита от флуда: отсекает лишние апдейты раньше всех остальных хендлеров
+    rate_limiter = TokenBucketLimiter(getattr(config, "RATE_LIMITS", None))
+    application.bot_data["rate_limiter"] = rate_limiter # Метрики: rate_limiter.stats()
+    application.add_handler(TypeHandler(Update, build_rate_limit_guard(rate_limiter)), group=-2)
+
+    # Замер времени до первого апдейта (отдельная группа, не мешает остальным хендлерам)
+    application.add_handler(TypeHandler(Update, record_first_update), group=-1)
 
     # Общие команды
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(CommandHandler("start", lazy_handler("handlers_common", "start")))
+    application.add_handler(CommandHandler("help", lazy_handler("handlers_common", "help_command")))
 
     # Команды Поставщика
-    application.add_handler(CommandHandler("register_provider", register_provider))
-    application.add_handler(CommandHandler("add_service", add_service))
-    application.add_handler(CommandHandler("my_services", my_services))
-    application.add_handler(CommandHandler("add_slot", add_slot))
-    application.add_handler(CommandHandler("my_slots", my_slots))
-    application.add_handler(CommandHandler("cancel_booking_provider", cancel_booking_provider))
+    application.add_handler(CommandHandler("register_provider", lazy_handler("handlers_provider", "register_provider")))
+    application.add_handler(CommandHandler("add_service", lazy_handler("handlers_provider", "add_service")))
+    application.add_handler(CommandHandler("my_services", lazy_handler("handlers_provider", "my_services")))
+    application.add_handler(CommandHandler("add_slot", lazy_handler("handlers_provider", "add_slot")))
+    application.add_handler(CommandHandler("my_slots", lazy_handler("handlers_provider", "my_slots")))
+    application.add_handler(CommandHandler("cancel_booking_provider", lazy_handler("handlers_provider", "cancel_booking_provider")))
+    application.add_handler(CommandHandler("cancel_day", lazy_handler("handlers_bulk_cancel", "cancel_day")))
+    application.add_handler(CommandHandler("deactivate_provider", lazy_handler("handlers_bulk_cancel", "deactivate_provider")))
+    application.add_handler(CommandHandler("add_hours", lazy_handler("handlers_schedule", "add_hours")))
+    application.add_handler(CommandHandler("add_break", lazy_handler("handlers_schedule", "add_break")))
+    application.add_handler(CommandHandler("add_day_off", lazy_handler("handlers_schedule", "add_day_off")))
+    application.add_handler(CommandHandler("my_schedule", lazy_handler("handlers_schedule", "my_schedule")))
+    application.add_handler(CommandHandler("delete_rule", lazy_handler("handlers_schedule", "delete_schedule_rule")))
+    application.add_handler(MessageHandler(
+        filters.Document.FileExtension("csv") | filters.Document.FileExtension("json") | filters.Document.FileExtension("jsonl"),
+        lazy_handler("handlers_import", "import_document")
+    ))
+    application.add_handler(CommandHandler("export_ics", lazy_handler("handlers_export", "export_ics")))
+    application.add_handler(CommandHandler("export_csv", lazy_handler("handlers_export", "export_csv")))
+    application.add_handler(CommandHandler("broadcast", lazy_handler("handlers_broadcast", "broadcast")))
 
     # Команды Клиента
-    application.add_handler(CommandHandler("services", list_available_services))
-    application.add_handler(CommandHandler("my_bookings", my_bookings_client))
-    
+    application.add_handler(CommandHandler("services", lazy_handler("handlers_client", "list_available_services")))
+    application.add_handler(CommandHandler("my_bookings", lazy_handler("handlers_client", "my_bookings_client")))
+    application.add_handler(InlineQueryHandler(lazy_handler("handlers_inline", "inline_search"))) # @bot запрос
+
     # Обработчик колбеков
-    application.add_handler(CallbackQueryHandler(button_callback_handler))
+    application.add_handler(CallbackQueryHandler(lazy_handler("handlers_client", "button_callback_handler")))
+    return application
+
+
+def main() -> None:
+    """Запуск бота."""
+    application = build_application(config.BOT_TOKEN, post_init=post_init, post_shutdown=post_shutdown)
 
     logger.info("Bot is starting...")
     application.run_polling()
     logger.info("Bot has stopped.")
+    log_listener.stop() # Дописываем оставшиеся в очереди записи
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,131 @@
+# message_packer.py
+import html
+import re
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Message
+from telegram.constants import MessageLimit, ParseMode
+
+MESSAGE_TEXT_LIMIT = MessageLimit.MAX_TEXT_LENGTH # 4096 символов видимого текста
+MAX_BUTTONS_PER_MESSAGE = 100 # Ограничение Telegram на число кнопок в инлайн-клавиатуре
+
+# Тег, HTML-сущность или кусок обычного текста (строки режем с сохранением \n)
+_HTML_TOKEN_RE = re.compile(r"<[^>]+>|&#?\w+;|[^<&\n]+\n?|\n|[<&]")
+_TAG_NAME_RE = re.compile(r"</?\s*([a-zA-Z0-9-]+)")
+
+
+def visible_length(text: str) -> int:
+    """Длина текста так, как ее считает Telegram: без тегов, с раскрытыми сущностями, в UTF-16."""
+    plain = html.unescape(re.sub(r"<[^>]+>", "", text))
+    return len(plain.encode("utf-16-le")) // 2
+
+
+def split_html(text: str, limit: int = MESSAGE_TEXT_LIMIT) -> list[str]:
+    """Режет HTML-текст на части не длиннее limit, не разрывая теги и сущности.
+
+    Открытые на месте разреза теги закрываются в конце части и открываются заново в следующей.
+    """
+    if visible_length(text) <= limit:
+        return [text]
+
+    chunks = []
+    current = ""
+    current_len = 0
+    open_tags = [] # [(имя, открывающий тег)]
+
+    def flush():
+        nonlocal current, current_len
+        closing = "".join(f"</{name}>" for name, _ in reversed(open_tags))
+        chunks.append(current + closing)
+        current = "".join(tag for _, tag in open_tags)
+        current_len = 0
+
+    for token in _HTML_TOKEN_RE.findall(text):
+        if token.startswith("<") and len(token) > 1:
+            name_match = _TAG_NAME_RE.match(token)
+            name = name_match.group(1).lower() if name_match else ""
+            if token.startswith("</"):
+                for index in range(len(open_tags) - 1, -1, -1):
+                    if open_tags[index][0] == name:
+                        del open_tags[index]
+                        break
+            elif not token.endswith("/>"):
+                open_tags.append((name, token))
+            current += token
+            continue
+
+        token_len = visible_length(token)
+        if current_len + token_len > limit and current_len > 0:
+            flush()
+        while token_len > limit: # Одна строка длиннее лимита - режем по символам
+            cut = limit
+            while visible_length(token[:cut]) > limit:
+                cut -= 1
+            current += token[:cut]
+            current_len = limit
+            flush()
+            token = token[cut:]
+            token_len = visible_length(token)
+        current += token
+        current_len += token_len
+
+    if current_len > 0:
+        flush()
+    return chunks
+
+
+class MessagePacker:
+    """Упаковывает поток HTML-блоков в минимальное число сообщений.
+
+    Каждый блок - законченный HTML-фрагмент (все теги закрыты) с необязательными рядами кнопок.
+    Кнопки блока попадают в клавиатуру того сообщения, в котором оказался сам блок.
+    """
+
+    def __init__(self, header: str = "", limit: int = MESSAGE_TEXT_LIMIT,
+                 max_buttons: int = MAX_BUTTONS_PER_MESSAGE):
+        self.limit = limit
+        self.max_buttons = max_buttons
+        self._messages = [] # [(текст, ряды кнопок)]
+        self._text = ""
+        self._text_len = 0
+        self._rows = []
+        self._buttons = 0
+        if header:
+            self.add(header)
+
+    def add(self, block: str, buttons: list[list[InlineKeyboardButton]] | None = None) -> None:
+        rows = buttons or []
+        button_count = sum(len(row) for row in rows)
+        pieces = split_html(block, self.limit)
+        for index, piece in enumerate(pieces):
+            piece_len = visible_length(piece)
+            piece_rows = rows if index == len(pieces) - 1 else [] # Кнопки - к последней части блока
+            piece_buttons = button_count if piece_rows else 0
+            if self._text and (self._text_len + piece_len > self.limit
+                               or self._buttons + piece_buttons > self.max_buttons):
+                self._close_message()
+            self._text += piece
+            self._text_len += piece_len
+            self._rows.extend(piece_rows)
+            self._buttons += piece_buttons
+
+    def _close_message(self) -> None:
+        self._messages.append((self._text, self._rows))
+        self._text = ""
+        self._text_len = 0
+        self._rows = []
+        self._buttons = 0
+
+    def messages(self, footer_buttons: list[list[InlineKeyboardButton]] | None = None) -> list[tuple[str, InlineKeyboardMarkup | None]]:
+        """Возвращает готовые сообщения (текст, клавиатура). footer_buttons добавляются к последнему."""
+        if self._text:
+            self._close_message()
+        result = [(text, rows) for text, rows in self._messages]
+        if footer_buttons and result:
+            result[-1] = (result[-1][0], result[-1][1] + footer_buttons)
+        return [(text, InlineKeyboardMarkup(rows) if rows else None) for text, rows in result]
+
+    async def reply(self, message: Message, footer_buttons: list[list[InlineKeyboardButton]] | None = None) -> int:
+        """Отправляет упакованные сообщения ответом на message. Возвращает число отправленных."""
+        packed = self.messages(footer_buttons)
+        for text, reply_markup in packed:
+            await message.reply_text(text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+        return len(packed)
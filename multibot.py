@@ -0,0 +1,84 @@
+# multibot.py
+import asyncio
+import logging
+import signal
+import time
+
+import config
+from main import build_application, start_process, stop_process, start_bot, warm_up, log_listener
+
+# Несколько брендированных ботов в одном процессе: config.BOTS = [{"token": ..., "tenant": ...}, ...].
+# Все боты работают в одном event loop поверх общего engine, очереди писателя и кэшей модулей
+# (индексы каталога, навигация - с ключом по арендатору). Данные арендаторов разделены
+# столбцом Provider.tenant: бот видит только поставщиков, услуги и брони своего арендатора.
+logger = logging.getLogger(__name__)
+
+METRICS_INTERVAL = 60 # Раз в сколько секунд пишутся метрики ботов
+
+
+def load_bots() -> list[dict]:
+    """Боты из config.BOTS; без него - один бот BOT_TOKEN арендатора по умолчанию."""
+    bots = getattr(config, "BOTS", None)
+    if not bots:
+        from database import DEFAULT_TENANT
+        return [{"token": config.BOT_TOKEN, "tenant": DEFAULT_TENANT}]
+    tenants = [bot["tenant"] for bot in bots]
+    if len(set(tenants)) != len(tenants):
+        raise ValueError("config.BOTS: арендаторы ботов должны быть уникальны")
+    return bots
+
+
+def log_metrics(applications) -> None:
+    """Метрики каждого бота (BotMetrics и лимитер флуда) - одной записью на бота."""
+    for application in applications:
+        metrics = application.bot_data["metrics"].stats()
+        metrics["rate_limiter"] = application.bot_data["rate_limiter"].stats()
+        logger.info("Bot metrics", extra={"tenant": application.bot_data["tenant"], "metrics": metrics})
+
+
+async def run_bots(bots: list[dict]) -> None:
+    """Запускает опрос всех ботов и ждет сигнала остановки."""
+    started = time.perf_counter()
+    await start_process(len(bots))
+    applications = [build_application(bot["token"], bot["tenant"]) for bot in bots]
+    running = []
+    try:
+        for application in applications:
+            await application.initialize()
+            await start_bot(application)
+            await application.updater.start_polling()
+            await application.start()
+            running.append(application)
+            logger.info("Bot started", extra={"tenant": application.bot_data["tenant"]})
+        asyncio.get_running_loop().run_in_executor(None, warm_up)
+        logger.info("%d bots are polling %.3fs after start.", len(running), time.perf_counter() - started)
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), METRICS_INTERVAL)
+            except asyncio.TimeoutError:
+                log_metrics(running)
+    finally:
+        for application in reversed(running):
+            await application.updater.stop()
+            await application.stop()
+        for application in applications:
+            await application.shutdown()
+        log_metrics(running)
+        await stop_process()
+
+
+def main() -> None:
+    bots = load_bots()
+    logger.info("Starting %d bots in one process...", len(bots))
+    asyncio.run(run_bots(bots))
+    logger.info("All bots have stopped.")
+    log_listener.stop() # Дописываем оставшиеся в очереди записи
+
+
+if __name__ == "__main__":
+    main()
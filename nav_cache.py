@@ -0,0 +1,130 @@
+# nav_cache.py
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+from telegram import InlineKeyboardButton
+
+NAV_STATE_TTL = 30 * 60 # Через сколько секунд бездействия состояние пользователя удаляется
+NAV_MAX_USERS = 10_000 # Сколько пользователей хранится одновременно (вытесняются давно не активные)
+NAV_MAX_MESSAGES = 5 # Сколько сообщений одного пользователя помнят свою историю
+NAV_MAX_DEPTH = 8 # Сколько экранов помнит одно сообщение
+
+
+class NavView(NamedTuple):
+    """Отрисованный экран: HTML-текст и ряды кнопок (без ряда навигации - он добавляется при показе)."""
+    text: str
+    rows: tuple
+
+
+class NavHistory:
+    """История экранов одного сообщения и текущая позиция в ней."""
+    __slots__ = ("views", "position")
+
+    def __init__(self):
+        self.views: list[NavView] = []
+        self.position = -1
+
+    def push(self, view: NavView) -> None:
+        """Новый экран после текущего; экраны "вперед" отбрасываются, как в браузере."""
+        del self.views[self.position + 1:]
+        self.views.append(view)
+        if len(self.views) > NAV_MAX_DEPTH:
+            del self.views[0]
+        self.position = len(self.views) - 1
+
+
+class NavState:
+    """Навигация пользователя: выбранная услуга и истории его сообщений (message_id -> NavHistory)."""
+    __slots__ = ("expires_at", "service_id", "messages")
+
+    def __init__(self):
+        self.expires_at = 0.0
+        self.service_id = None
+        self.messages: OrderedDict = OrderedDict()
+
+
+class NavigationCache:
+    """Состояние навигации по каталогу для кнопок "Назад"/"Вперед", в памяти процесса.
+
+    Хранит уже отрисованные экраны (страницу каталога из /services, список слотов услуги),
+    поэтому переход по истории редактирует сообщение без обращения к БД. Ключ пользователя -
+    (арендатор, user_id): один человек в двух ботах процесса - два независимых состояния. Объем ограничен:
+    не больше max_users пользователей (вытесняется самый давно активный), у пользователя -
+    NAV_MAX_MESSAGES сообщений по NAV_MAX_DEPTH экранов; состояние живет ttl секунд с
+    последнего обращения. Кэш не переживает перезапуск - тогда кнопки просят заново открыть /services.
+    """
+
+    def __init__(self, max_users: int = NAV_MAX_USERS, ttl: float = NAV_STATE_TTL, clock=time.monotonic):
+        self.max_users = max_users
+        self.ttl = ttl
+        self.clock = clock
+        self._states = OrderedDict() # (арендатор, user_id) -> NavState; порядок = порядок последнего обращения
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def _evict(self, now: float) -> None:
+        while self._states:
+            user_id, state = next(iter(self._states.items()))
+            if state.expires_at > now and len(self._states) <= self.max_users:
+                break
+            del self._states[user_id]
+
+    def _state(self, user_id, create: bool) -> NavState | None:
+        now = self.clock()
+        state = self._states.get(user_id)
+        if state is not None and state.expires_at <= now:
+            del self._states[user_id]
+            state = None
+        if state is None:
+            if not create:
+                return None
+            state = self._states[user_id] = NavState()
+        else:
+            self._states.move_to_end(user_id)
+        state.expires_at = now + self.ttl
+        self._evict(now)
+        return state
+
+    def push(self, user_id, message_id, view: NavView, service_id: int | None = None) -> NavHistory:
+        """Показываемый в сообщении экран становится текущим в его истории."""
+        state = self._state(user_id, create=True)
+        history = state.messages.get(message_id)
+        if history is None:
+            history = state.messages[message_id] = NavHistory()
+            if len(state.messages) > NAV_MAX_MESSAGES:
+                state.messages.popitem(last=False)
+        else:
+            state.messages.move_to_end(message_id)
+        history.push(view)
+        if service_id is not None:
+            state.service_id = service_id
+        return history
+
+    def go(self, user_id, message_id, position: int) -> tuple[NavView, NavHistory] | None:
+        """Переходит к экрану position истории сообщения. None, если история истекла или вытеснена."""
+        state = self._state(user_id, create=False)
+        history = state.messages.get(message_id) if state else None
+        if history is None or not 0 <= position < len(history.views):
+            self.misses += 1
+            return None
+        self.hits += 1
+        history.position = position
+        return history.views[position], history
+
+    def selected_service(self, user_id) -> int | None:
+        state = self._state(user_id, create=False)
+        return state.service_id if state else None
+
+
+def nav_row(history: NavHistory) -> list[InlineKeyboardButton]:
+    """Кнопки "Назад"/"Вперед" для текущей позиции. В колбеке - номер экрана, а не направление:
+    повторное нажатие той же кнопки показывает тот же экран, а не уходит на шаг дальше."""
+    row = []
+    if history.position > 0:
+        row.append(InlineKeyboardButton("⬅️ Назад", callback_data=f"nav_{history.position - 1}"))
+    if history.position < len(history.views) - 1:
+        row.append(InlineKeyboardButton("Вперед ➡️", callback_data=f"nav_{history.position + 1}"))
+    return row
@@ -0,0 +1,122 @@
+# rate_limit.py
+import logging
+import re
+import time
+from collections import Counter
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, ContextTypes
+
+logger = logging.getLogger(__name__)
+
+# action -> (емкость корзины, пополнение токенов в секунду). "default" - для остальных действий.
+DEFAULT_RATE_LIMITS = {
+    "default": (10, 1.0),
+    "view_slots": (5, 1.0),
+    "book_slot": (3, 0.5),
+    "book_vslot": (3, 0.5),
+    "cancel_booking_client": (3, 0.5),
+    "/services": (3, 0.2),
+    "inline_query": (20, 2.0), # Запрос приходит на каждое нажатие клавиши в @bot ...
+}
+IDLE_BUCKET_TTL = 600 # Через сколько секунд бездействия корзина пользователя удаляется
+EVICTION_INTERVAL = 60 # Как часто (не чаще) проводить очистку
+
+_CALLBACK_ID_RE = re.compile(r"(_-?\d+)+$")
+
+
+def update_action(update: Update) -> str:
+    """Определяет действие апдейта: команда (/services), префикс колбека (book_slot), inline-запрос или тип сообщения."""
+    if update.inline_query:
+        return "inline_query"
+    if update.callback_query and update.callback_query.data:
+        return _CALLBACK_ID_RE.sub("", update.callback_query.data)
+    message = update.effective_message
+    if message and message.text and message.text.startswith("/"):
+        return message.text.split(maxsplit=1)[0].split("@", 1)[0]
+    if message and message.document:
+        return "document"
+    return "message"
+
+
+class TokenBucketLimiter:
+    """Лимитер "корзина токенов" по паре (пользователь, действие).
+
+    Корзина хранится компактно - списком [токены, время последнего пополнения].
+    Корзины, к которым давно не обращались, периодически удаляются, так что память
+    пропорциональна числу активных пользователей.
+    """
+
+    def __init__(self, limits: dict | None = None, idle_ttl: float = IDLE_BUCKET_TTL,
+                 eviction_interval: float = EVICTION_INTERVAL, clock=time.monotonic):
+        self.limits = dict(DEFAULT_RATE_LIMITS)
+        self.limits.update(limits or {})
+        self.idle_ttl = idle_ttl
+        self.eviction_interval = eviction_interval
+        self.clock = clock
+        self.buckets = {} # (user_id, action) -> [tokens, last_refill]
+        self.allowed = 0
+        self.dropped = Counter() # action -> число отброшенных апдейтов
+        self._last_eviction = clock()
+
+    def allow(self, user_id: int, action: str) -> bool:
+        """Списывает токен и возвращает True, если апдейт можно обрабатывать."""
+        now = self.clock()
+        if now - self._last_eviction >= self.eviction_interval:
+            self.evict_idle(now)
+
+        capacity, refill_rate = self.limits.get(action) or self.limits["default"]
+        key = (user_id, action)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            self.buckets[key] = [capacity - 1, now]
+            self.allowed += 1
+            return True
+
+        tokens = min(capacity, bucket[0] + (now - bucket[1]) * refill_rate)
+        bucket[1] = now
+        if tokens < 1:
+            bucket[0] = tokens
+            self.dropped[action] += 1
+            return False
+        bucket[0] = tokens - 1
+        self.allowed += 1
+        return True
+
+    def evict_idle(self, now: float | None = None) -> int:
+        """Удаляет корзины, простаивавшие дольше idle_ttl. Возвращает число удаленных."""
+        now = self.clock() if now is None else now
+        self._last_eviction = now
+        stale = [key for key, bucket in self.buckets.items() if now - bucket[1] > self.idle_ttl]
+        for key in stale:
+            del self.buckets[key]
+        if self.dropped:
+            logger.info("Rate limiter: %s", self.stats())
+        return len(stale)
+
+    def stats(self) -> dict:
+        """Метрики лимитера: пропущенные и отброшенные апдейты, число активных корзин."""
+        return {
+            "allowed": self.allowed,
+            "dropped": sum(self.dropped.values()),
+            "dropped_by_action": dict(self.dropped),
+            "buckets": len(self.buckets),
+        }
+
+
+def build_rate_limit_guard(limiter: TokenBucketLimiter):
+    """Возвращает колбек для ранней группы хендлеров, отсекающий апдейты сверх лимита до работы с БД."""
+    async def rate_limit_guard(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        user = update.effective_user
+        if user is None:
+            return
+        if limiter.allow(user.id, update_action(update)):
+            return
+        if update.callback_query:
+            # Отвечаем на колбек без обращения к БД, чтобы у пользователя перестала "грузиться" кнопка
+            try:
+                await update.callback_query.answer("Слишком много запросов. Подождите немного.")
+            except Exception as e_answer:
+                logger.debug("Failed to answer throttled callback for user %s: %s", user.id, e_answer)
+        raise ApplicationHandlerStop
+
+    return rate_limit_guard
@@ -0,0 +1,103 @@
+# read_models.py
+from collections import defaultdict
+from typing import NamedTuple
+from sqlalchemy import Text, case, func
+from sqlalchemy.orm import Session
+from database import Provider, Service, TimeSlot, Booking
+
+# Модели чтения для списков: хендлеры только форматируют несколько полей в текст, поэтому
+# запрос выбирает эти колонки и строки сразу становятся кортежами - без экземпляров ORM,
+# identity map и прокси связей. Описание услуги (Text) в модели отложено (deferred) и
+# выбирается только здесь; для каталога оно обрезается в SQL, а не после загрузки целиком.
+DESCRIPTION_PREVIEW = 100 # Символов описания в каталоге /services
+
+
+class ServiceCard(NamedTuple):
+    service_id: int
+    name: str
+    provider_name: str
+    duration_minutes: int
+    price: float | None
+    description: str | None
+
+
+class ClientBooking(NamedTuple):
+    booking_id: int
+    service_name: str
+    provider_name: str
+    start_time: int
+    end_time: int
+
+
+class ProviderSlot(NamedTuple):
+    slot_id: int
+    service_id: int
+    service_name: str
+    start_time: int
+    end_time: int
+    is_available: bool
+    capacity: int
+    booked_seats: int
+    bookings: list # [(booking_id, client_telegram_id)]
+
+
+def description_preview(limit: int = DESCRIPTION_PREVIEW):
+    """Описание, обрезанное в SQL до limit символов (с многоточием, если было длиннее)."""
+    return case(
+        (func.length(Service.description) > limit, func.substr(Service.description, 1, limit, type_=Text) + "..."),
+        else_=Service.description
+    )
+
+
+def catalog_services(db: Session, tenant: str) -> list[ServiceCard]:
+    """Услуги активных поставщиков арендатора для /services: одним запросом, описание - превью."""
+    rows = db.query(Service.service_id, Service.name, Provider.name, Service.duration_minutes, Service.price,
+                    description_preview())\
+        .join(Provider, Service.provider_id == Provider.provider_id)\
+        .filter(Provider.tenant == tenant, Provider.is_active == True)\
+        .order_by(Provider.name, Service.name)
+    return [ServiceCard(*row) for row in rows]
+
+
+def provider_services(db: Session, provider_id: int, provider_name: str) -> list[ServiceCard]:
+    """Услуги поставщика для /my_services: владельцу описание показывается полностью."""
+    rows = db.query(Service.service_id, Service.name, Service.duration_minutes, Service.price, Service.description)\
+        .filter(Service.provider_id == provider_id)
+    return [ServiceCard(service_id, name, provider_name, duration, price, description)
+            for service_id, name, duration, price, description in rows]
+
+
+def client_bookings(db: Session, client_telegram_id: int, tenant: str, after: int) -> list[ClientBooking]:
+    """Подтвержденные брони клиента в боте арендатора со слотом после after, по времени - одним запросом."""
+    rows = db.query(Booking.booking_id, Service.name, Provider.name, TimeSlot.start_time, TimeSlot.end_time)\
+        .join(TimeSlot, Booking.slot_id == TimeSlot.slot_id)\
+        .join(Service, TimeSlot.service_id == Service.service_id)\
+        .join(Provider, Service.provider_id == Provider.provider_id)\
+        .filter(
+            Booking.client_telegram_id == client_telegram_id,
+            Booking.status == "confirmed",
+            TimeSlot.start_time > after,
+            Provider.tenant == tenant
+        ).order_by(TimeSlot.start_time)
+    return [ClientBooking(*row) for row in rows]
+
+
+def provider_slots(db: Session, provider_id: int) -> list[ProviderSlot]:
+    """Слоты услуг поставщика по времени вместе с их подтвержденными бронями для /my_slots - двумя запросами.
+
+    Отмененные брони (cancelled_by_*) могли остаться в базах со старых версий - они не показываются.
+    """
+    bookings = defaultdict(list)
+    for slot_id, booking_id, client_telegram_id in db.query(Booking.slot_id, Booking.booking_id, Booking.client_telegram_id)\
+            .join(TimeSlot, Booking.slot_id == TimeSlot.slot_id)\
+            .join(Service, TimeSlot.service_id == Service.service_id)\
+            .filter(Service.provider_id == provider_id, Booking.status == "confirmed")\
+            .order_by(Booking.booking_id):
+        bookings[slot_id].append((booking_id, client_telegram_id))
+
+    rows = db.query(TimeSlot.slot_id, TimeSlot.service_id, Service.name, TimeSlot.start_time, TimeSlot.end_time,
+                    TimeSlot.is_available, TimeSlot.capacity, TimeSlot.booked_seats)\
+        .join(Service, TimeSlot.service_id == Service.service_id)\
+        .filter(Service.provider_id == provider_id)\
+        .order_by(TimeSlot.start_time)
+    return [ProviderSlot(*row, bookings.get(row.slot_id, [])) for row in rows]
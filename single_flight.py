@@ -0,0 +1,62 @@
+# single_flight.py
+import asyncio
+import time
+from collections import OrderedDict
+
+
+class SingleFlight:
+    """Объединяет одновременные одинаковые вызовы в один.
+
+    Пока вызов с ключом выполняется, повторные вызовы с тем же ключом не запускают работу
+    заново, а дожидаются результата первого. Завершившийся результат еще result_ttl секунд
+    отдается поздним повторам (повторная отправка колбека клиентом, двойное нажатие).
+    """
+
+    def __init__(self, result_ttl: float = 3.0, clock=time.monotonic):
+        self.result_ttl = result_ttl
+        self.clock = clock
+        self._in_flight = {} # key -> asyncio.Future
+        self._recent = OrderedDict() # key -> (истекает_в, результат); порядок вставки = порядок истечения
+        self.shared = 0 # Сколько вызовов получили чужой результат
+
+    def _evict_expired(self, now: float) -> None:
+        while self._recent:
+            key, (expires_at, _) = next(iter(self._recent.items()))
+            if expires_at > now:
+                break
+            del self._recent[key]
+
+    async def run(self, key, func):
+        """Выполняет await func() не более одного раза для одновременных вызовов с key.
+
+        Возвращает (результат, shared), где shared=True означает, что работа была выполнена
+        другим вызовом. Исключение первого вызова получают и все ожидавшие его дубликаты.
+        """
+        now = self.clock()
+        self._evict_expired(now)
+        if key in self._recent:
+            self.shared += 1
+            return self._recent[key][1], True
+
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.shared += 1
+            return await asyncio.shield(future), True
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            result = await func()
+        except Exception as e:
+            future.set_exception(e)
+            future.exception() # Помечаем исключение полученным, если дубликатов не было
+            raise
+        except BaseException:
+            future.cancel()
+            raise
+        else:
+            future.set_result(result)
+            self._recent[key] = (self.clock() + self.result_ttl, result)
+            return result, False
+        finally:
+            del self._in_flight[key]
@@ -0,0 +1,42 @@
+# slot_seats.py
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+from database import TimeSlot
+from timeutil import now_ts
+
+# Слот вмещает capacity мест (групповое занятие - одна строка), booked_seats - занятые места:
+# брони и место, удерживаемое для очереди ожидания. is_available поддерживается равным
+# booked_seats < capacity, поэтому выборки свободных слотов по-прежнему фильтруют только по нему.
+# Счетчик меняется выражением в SQL (booked_seats = booked_seats + 1), а не пересчетом в Python.
+
+
+def take_seat(db: Session, slot_id: int) -> bool:
+    """Занимает место в будущем слоте одним условным UPDATE. False - мест нет или слот в прошлом.
+
+    Проверка и изменение выполняются одной командой, поэтому два клиента не получат одно место
+    ни при каком порядке операций записи.
+    """
+    result = db.execute(
+        update(TimeSlot)
+        .where(
+            TimeSlot.slot_id == slot_id,
+            TimeSlot.booked_seats < TimeSlot.capacity,
+            TimeSlot.start_time > now_ts()
+        )
+        .values(booked_seats=TimeSlot.booked_seats + 1, is_available=TimeSlot.booked_seats + 1 < TimeSlot.capacity)
+    )
+    return result.rowcount == 1
+
+
+def free_seat(db: Session, slot: TimeSlot) -> None:
+    """Возвращает место слота (отмена брони или снятие удержания)."""
+    slot.booked_seats = TimeSlot.booked_seats - 1
+    slot.is_available = True
+    db.flush() # Выражение применяется сразу; атрибуты перечитаются при следующем обращении
+
+
+def hold_seat(db: Session, slot: TimeSlot) -> None:
+    """Удерживает только что освободившееся место для клиента из очереди ожидания."""
+    slot.booked_seats = TimeSlot.booked_seats + 1
+    slot.is_available = TimeSlot.booked_seats + 1 < TimeSlot.capacity
+    db.flush()
@@ -0,0 +1,27 @@
+# timeutil.py
+import time
+from datetime import datetime, timezone
+
+# Время в БД хранится целым числом секунд UTC (epoch). В datetime с часовым поясом оно
+# переводится только при выводе пользователю и при разборе введенного им времени.
+DISPLAY_FORMAT = "%Y-%m-%d %H:%M"
+
+
+def now_ts() -> int:
+    """Текущее время, секунды UTC epoch."""
+    return int(time.time())
+
+
+def to_ts(value: datetime) -> int:
+    """datetime -> секунды UTC epoch. Наивное время считается локальным (так его вводят пользователи)."""
+    return int(value.timestamp())
+
+
+def from_ts(ts: int) -> datetime:
+    """Секунды UTC epoch -> datetime в локальном часовом поясе (с tzinfo)."""
+    return datetime.fromtimestamp(ts, timezone.utc).astimezone()
+
+
+def format_ts(ts: int, fmt: str = DISPLAY_FORMAT) -> str:
+    """Форматирует время для сообщений пользователю в локальном часовом поясе."""
+    return from_ts(ts).strftime(fmt)
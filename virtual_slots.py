@@ -0,0 +1,194 @@
+# virtual_slots.py
+import bisect
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from sqlalchemy.orm import Session, joinedload
+from database import Provider, ScheduleRule, Service, TimeSlot
+from timeutil import now_ts, to_ts, from_ts
+
+# Слоты по правилам расписания (ScheduleRule) не хранятся: они вычисляются из рабочих окон
+# за вычетом перерывов, исключений и уже существующих строк TimeSlot. Строка TimeSlot
+# создается только при бронировании (materialize_slot), поэтому объем таблицы и стоимость
+# ее просмотра растут с числом бронирований, а не с числом предложенных интервалов.
+RULE_HORIZON_DAYS = 60 # На сколько дней вперед ищутся свободные слоты по правилам
+
+WEEKDAY_NAMES = ("пн", "вт", "ср", "чт", "пт", "сб", "вс")
+
+
+class ServiceSchedule:
+    """Правила одной услуги, разложенные по дням недели для генерации слотов."""
+
+    def __init__(self, rules, duration_minutes: int):
+        self.duration_minutes = duration_minutes
+        self.hours = defaultdict(list) # день недели -> [(начало, конец)] в минутах от полуночи
+        self.breaks = defaultdict(list)
+        self.closed = [] # [(начало, конец)] в секундах epoch
+        for rule in rules:
+            if rule.kind == "hours":
+                self.hours[rule.weekday].append((rule.start_minute, rule.end_minute))
+            elif rule.kind == "break":
+                self.breaks[rule.weekday].append((rule.start_minute, rule.end_minute))
+            elif rule.kind == "closed":
+                self.closed.append((rule.start_time, rule.end_time))
+        for windows in (*self.hours.values(), *self.breaks.values()):
+            windows.sort()
+
+    def __bool__(self) -> bool:
+        return bool(self.hours)
+
+    def _day_minutes(self, day: date):
+        """Начала слотов дня в минутах: слоты идут подряд от начала окна, перерыв сдвигает сетку на свой конец."""
+        duration = self.duration_minutes
+        breaks = self.breaks.get(day.weekday(), ())
+        for window_start, window_end in self.hours.get(day.weekday(), ()):
+            minute = window_start
+            while minute + duration <= window_end:
+                break_end = next((end for start, end in breaks if start < minute + duration and end > minute), None)
+                if break_end is not None:
+                    minute = break_end
+                    continue
+                yield minute
+                minute += duration
+
+    def iter_slots(self, start_ts: int, until_ts: int):
+        """(начало, конец) слотов по правилам с началом в [start_ts, until_ts), по возрастанию."""
+        day = from_ts(start_ts).date()
+        last_day = from_ts(until_ts).date()
+        while day <= last_day:
+            midnight = datetime.combine(day, time())
+            for minute in self._day_minutes(day):
+                start = to_ts(midnight + timedelta(minutes=minute))
+                end = start + self.duration_minutes * 60
+                if start < start_ts or start >= until_ts:
+                    continue
+                if any(closed_start < end and closed_end > start for closed_start, closed_end in self.closed):
+                    continue
+                yield start, end
+            day += timedelta(days=1)
+
+
+class BusyIntervals:
+    """Уже существующие строки TimeSlot услуги (брони и обычные слоты), отсортированные по началу.
+
+    Строки одной услуги не пересекаются (это проверяют /add_slot и импорт), поэтому для проверки
+    пересечения достаточно соседней слева строки.
+    """
+
+    def __init__(self, intervals):
+        self.intervals = sorted(intervals)
+        self.starts = [start for start, _ in self.intervals]
+
+    def overlaps(self, start: int, end: int) -> bool:
+        index = bisect.bisect_left(self.starts, end)
+        return index > 0 and self.intervals[index - 1][1] > start
+
+
+def load_schedules(db: Session, services: dict[int, int]) -> dict[int, ServiceSchedule]:
+    """Расписания услуг с правилами: {service_id: длительность} -> {service_id: ServiceSchedule}. Один запрос."""
+    if not services:
+        return {}
+    rules = defaultdict(list)
+    for rule in db.query(ScheduleRule).filter(ScheduleRule.service_id.in_(list(services))):
+        rules[rule.service_id].append(rule)
+    schedules = {service_id: ServiceSchedule(service_rules, services[service_id])
+                 for service_id, service_rules in rules.items()}
+    return {service_id: schedule for service_id, schedule in schedules.items() if schedule}
+
+
+def load_service_schedule(db: Session, service_id: int, tenant: str) -> tuple[Service | None, ServiceSchedule | None]:
+    """Услуга арендатора вместе с правилами - одним запросом (JOIN). Расписание None, если рабочих окон нет."""
+    service = db.query(Service).join(Provider, Service.provider_id == Provider.provider_id)\
+        .options(joinedload(Service.schedule_rules))\
+        .filter(Service.service_id == service_id, Provider.tenant == tenant).first()
+    if service is None:
+        return None, None
+    schedule = ServiceSchedule(service.schedule_rules, service.duration_minutes)
+    return service, (schedule if schedule else None)
+
+
+def _slot_rows(db: Session, service_ids, start_ts: int, until_ts: int):
+    """Строки TimeSlot услуг, пересекающие [start_ts, until_ts). Один запрос по индексу (service_id, start_time)."""
+    return db.query(TimeSlot.service_id, TimeSlot.slot_id, TimeSlot.start_time, TimeSlot.end_time, TimeSlot.is_available,
+                    (TimeSlot.capacity - TimeSlot.booked_seats).label("seats_left"))\
+        .filter(
+            TimeSlot.service_id.in_(list(service_ids)),
+            TimeSlot.start_time < until_ts,
+            TimeSlot.end_time > start_ts
+        ).all()
+
+
+def load_busy(db: Session, service_ids, start_ts: int, until_ts: int) -> dict[int, BusyIntervals]:
+    """Занятые строками TimeSlot интервалы услуг в [start_ts, until_ts)."""
+    busy = defaultdict(list)
+    if service_ids:
+        for row in _slot_rows(db, service_ids, start_ts, until_ts):
+            busy[row.service_id].append((row.start_time, row.end_time))
+    return {service_id: BusyIntervals(busy.get(service_id, ())) for service_id in service_ids}
+
+
+def free_virtual_slots(schedule: ServiceSchedule, busy: BusyIntervals, start_ts: int, until_ts: int, limit: int):
+    """Первые limit свободных слотов по правилам: [(начало, конец)]."""
+    slots = []
+    for start, end in schedule.iter_slots(start_ts, until_ts):
+        if not busy.overlaps(start, end):
+            slots.append((start, end))
+            if len(slots) >= limit:
+                break
+    return slots
+
+
+def upcoming_slots(db: Session, service_id: int, schedule: ServiceSchedule, limit: int) -> list[tuple[int, int, int | None, int]]:
+    """Ближайшие свободные слоты услуги с правилами: хранимые и вычисленные, одним запросом к TimeSlot.
+
+    Возвращает [(начало, конец, slot_id, свободных мест)], slot_id None - слот по правилам
+    (строки еще нет, место одно).
+    Хранимые свободные слоты берутся в пределах того же горизонта RULE_HORIZON_DAYS.
+    """
+    start_ts = now_ts() + 1
+    until_ts = start_ts + RULE_HORIZON_DAYS * 86400
+    rows = _slot_rows(db, [service_id], start_ts, until_ts)
+    stored = [(row.start_time, row.end_time, row.slot_id, row.seats_left) for row in rows
+              if row.is_available and row.start_time >= start_ts]
+    busy = BusyIntervals((row.start_time, row.end_time) for row in rows)
+    virtual = [(start, end, None, 1) for start, end in free_virtual_slots(schedule, busy, start_ts, until_ts, limit)]
+    return sorted(stored + virtual, key=lambda slot: slot[0])[:limit]
+
+
+def next_virtual_starts(db: Session, services: dict[int, int]) -> dict[int, int]:
+    """{service_id: длительность} -> {service_id: начало ближайшего свободного слота по правилам}."""
+    schedules = load_schedules(db, services)
+    if not schedules:
+        return {}
+    start_ts = now_ts() + 1
+    until_ts = start_ts + RULE_HORIZON_DAYS * 86400
+    busy = load_busy(db, list(schedules), start_ts, until_ts)
+    starts = {}
+    for service_id, schedule in schedules.items():
+        slots = free_virtual_slots(schedule, busy[service_id], start_ts, until_ts, 1)
+        if slots:
+            starts[service_id] = slots[0][0]
+    return starts
+
+
+def materialize_slot(db: Session, service_id: int, start_time: int, tenant: str) -> int | None:
+    """Операция записи: создает строку TimeSlot для слота по правилам, если он еще свободен.
+
+    Время проверяется по правилам заново (колбек мог устареть или быть подделан).
+    Возвращает slot_id или None, если такого слота по правилам нет, время уже занято
+    или услуга принадлежит другому арендатору.
+    """
+    if start_time <= now_ts():
+        return None
+    service, schedule = load_service_schedule(db, service_id, tenant)
+    if schedule is None:
+        return None
+    end_time = start_time + service.duration_minutes * 60
+    if (start_time, end_time) not in schedule.iter_slots(start_time, start_time + 1):
+        return None
+    if load_busy(db, [service_id], start_time, end_time)[service_id].intervals:
+        return None
+
+    slot = TimeSlot(service_id=service_id, start_time=start_time, end_time=end_time, is_available=True)
+    db.add(slot)
+    db.flush()
+    return slot.slot_id